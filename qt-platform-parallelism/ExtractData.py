@@ -1,32 +1,68 @@
 # This Python file uses the following encoding: utf-8
 
 from PySide6.QtSerialPort import QSerialPortInfo, QSerialPort
-from PySide6.QtCore import QObject, Signal, QMutex
-from time import sleep
-from re import sub
+from PySide6.QtCore import QObject, Signal, QSocketNotifier
+from time import monotonic_ns
 
-class SerialPortGetter(QObject):
+from SerialFramer import MUX_PORTS_IN_USE, ControllerStream
+from Hotplug import NetlinkUeventSource
+from PortDiscovery import PortDiscovery, is_controller
+
+class HotplugWatcher(QObject):
+    '''
+    Wakes up only on USB serial add/remove uevents, no polling.
+    Emits (kind, port name) where kind is "controller" or "scanner".
+    '''
 
     # Signals
     finished = Signal()
-    dataOut = Signal(list)
-    running = True
+    device_added = Signal(str, str)
+    device_removed = Signal(str, str)
+
+    def __init__(self, discovery: PortDiscovery, source=None, parent=None):
+        super().__init__(parent)
+        self.discovery = discovery
+        self.source = source
+        self.notifier = None
+
+    # Must run in the watcher thread, the notifier belongs to the thread that creates it
+    def start(self):
+        if self.source is None:
+            try:
+                self.source = NetlinkUeventSource()
+            except OSError as error:
+                print(f"Hotplug events unavailable: {error}")
+                return
+
+        self.notifier = QSocketNotifier(self.source.fileno(), QSocketNotifier.Read, self)
+        self.notifier.activated.connect(self.eventsAvailable)
 
-    # Get Serial Ports
-    def getPorts(self):
-        while self.running:
-            ports = QSerialPortInfo.availablePorts()
-            self.dataOut.emit(ports)
-            sleep(1)
+    def eventsAvailable(self):
+        for event in self.source.read_events():
+            # Keep the shared port list current without re-enumerating
+            if event.action == "add":
+                self.discovery.add(event.identity)
+            else:
+                self.discovery.remove(event.port_name)
+
+            # A remembered device keeps its role even if its description is generic
+            kind = self.discovery.role_of(event.identity) or event.kind
+            if not kind: # Not a device we care about
+                continue
+
+            print(f"Hotplug: {event.action} {kind} {event.port_name}")
+            if event.action == "add":
+                self.device_added.emit(kind, event.port_name)
+            else:
+                self.device_removed.emit(kind, event.port_name)
 
+    # Called from the GUI thread, the notifier and socket go with the thread cleanup
     def finish(self):
-        self.running = False
         self.finished.emit()
 
 class DataGetter(QObject):
 
     # Signals
-    running = True
     finished = Signal()
     new_serial_port_name = Signal(str)
 
@@ -36,25 +72,17 @@ class DataGetter(QObject):
     Mux 1 -> Ports 0 -> 7
     Mux 2 -> Ports 8 -> 15
     '''
-    mux_ports_in_use = [1, 2, 4, 5, 6, 9, 10, 12, 13]
-
-    data = {
-        "0": "--.---",
-        "1": "--.---",
-        "2": "--.---",
-        "3": "--.---",
-        "4": "--.---",
-        "5": "--.---",
-        "6": "--.---",
-        "7": "--.---",
-        "8": "--.---"
-    }
-
-    dataOut = Signal(dict)
-
-    def __init__(self, parent=None):
+    mux_ports_in_use = MUX_PORTS_IN_USE
+
+    # Emits one SweepFrame per complete sweep over mux_ports_in_use, integer microns in array buffers
+    dataOut = Signal(object)
+
+    def __init__(self, discovery: PortDiscovery, recorder=None, parent=None):
         super().__init__(parent)
 
+        self.discovery = discovery
+        self.stream = ControllerStream(self.mux_ports_in_use, recorder) # Shared with JigEngine, recorder keeps raw bytes for replay
+
         self.port = QSerialPort(self)
         self.port.readyRead.connect(self.dataAvailable)
 
@@ -63,41 +91,26 @@ class DataGetter(QObject):
         self.port.setParity(QSerialPort.NoParity)
         self.port.setStopBits(QSerialPort.OneStop)
 
-    def threadFunction(self):
-        while self.running:
-            if not self.port.isOpen():
-                self.findESP32S3Port()
-
     # Auto find the right USB Serial port
     def findESP32S3Port(self):
         if self.port.isOpen():
             self.port.close()
 
-        ports = QSerialPortInfo.availablePorts()
-
-        # No available ports to browse
-        if len(ports) == 0:
-            print("No ports to scan")
+        self.discovery.refresh(QSerialPortInfo.availablePorts())
 
-            return None
+        # Remembered controller first, then anything that looks like one
+        known = self.discovery.lookup("controller")
+        candidates = ([known] if known is not None else []) + self.discovery.candidates(is_controller)
 
-        # Browse ports
-        for port in ports:
-            # Only accept ports that we want
-            print(f"Serial Port Name: {port.description()}")
-            if port.description() in ["USB Single Serial", "USB-Enhanced-SERIAL CH343"] and port.manufacturer() in ["1a86", "wch.cn"]:
-                print(f"Serial Port Device Manufacturer: '{port.manufacturer()}'")
-                print(f"New Serial Port: {port.portName()}")
-                self.port.setPortName(port.portName())
-                self.port.open(QSerialPort.ReadOnly)
+        for identity in candidates:
+            print(f"Serial Port: {identity.port_name} - {identity.description} ({identity.manufacturer}) {identity.key}")
+            self.newSerialPort(identity.port_name)
 
-                if not self.port.isOpen():
-                    print("Failed to open port")
-                    return
-
-                self.new_serial_port_name.emit(port.portName())
+            if self.port.isOpen():
+                self.discovery.remember("controller", identity)
+                self.new_serial_port_name.emit(identity.port_name)
                 return
-            
+
         print("No ports found")
         self.new_serial_port_name.emit("No Device")
 
@@ -107,36 +120,47 @@ class DataGetter(QObject):
 
         print(f"New serial port: {newPortName}")
         self.port.setPortName(newPortName)
+        self.stream.reset()
         self.port.open(QSerialPort.ReadOnly)
 
         if not self.port.isOpen():
             print("Failed to open port")
 
+    # Hotplug slots, a controller plugged in is opened straight away
+    def deviceAdded(self, kind, port_name):
+        if kind != "controller" or self.port.isOpen():
+            return
+
+        self.newSerialPort(port_name)
+        if self.port.isOpen():
+            identity = self.discovery.get(port_name)
+            if identity is not None:
+                self.discovery.remember("controller", identity)
+            self.new_serial_port_name.emit(port_name)
+
+    def deviceRemoved(self, kind, port_name):
+        if port_name != self.port.portName():
+            return
+
+        print(f"Serial port removed: {port_name}")
+        self.port.close()
+        self.new_serial_port_name.emit("No Device")
+
     def dataAvailable(self):
         try:
-            incoming_data = self.port.readAll().toStdString().strip()
+            incoming_data = self.port.readAll().data()
         except:
             print("Error handling data")
             return
 
-        index = None
-        for string in incoming_data.split():
-            # Micrometer index number
-            if string.startswith("[M") and string.endswith("]:"):
-                index = int(sub(r'[\[\]:M]', '', string))
-            else:
-                # Checking if port in use
-                if index not in self.mux_ports_in_use:
-                    continue
-            
-                # Micrometer value
-                self.data[str(self.mux_ports_in_use.index(index))] = string
-                # print(self.data)
-                self.dataOut.emit(self.data)
+        # Only complete sweeps go downstream, every reading in one chunk shares the same receive time
+        for frame in self.stream.feed(incoming_data, monotonic_ns()):
+            self.dataOut.emit(frame)
 
+    # On the data thread (main.py stop_data_getter), dataAvailable may be mid write otherwise
     def finish(self):
-        self.running = False
         self.port.close()
+        self.stream.close()
         self.finished.emit()
 
 
@@ -0,0 +1,278 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Flatness of a platform from its readings, three ways:
+
+    LEAST_SQUARES   plane with the smallest sum of squared residuals
+    MINIMUM_ZONE    Chebyshev fit, the two closest parallel planes holding
+                    every reading (ISO 1101 flatness)
+    THREE_POINT     contact plane the platform rests on (RestingPlane.py)
+
+Flatness is the distance between the highest and lowest residual, residuals
+are reading minus plane (three point residuals are all <= 0). It does not
+depend on the indicator spacing, so the unit 3x3 grid gives mm for any
+platform size.
+
+The minimum zone is a linear program in the plane slope. Its vertices are
+planes through three readings, or parallel to two pairs of readings, and
+each is a fixed linear map of the readings. On up to ENUMERATION_MAX_POINTS
+indicators every vertex is tried at once as one matrix product, which
+vectorises over (N, k) batches. The three point plane is enumerated the same
+way, over the triangles around the centre. Rows missing a reading use the
+tables of the indicators left. Larger layouts solve the programs with the
+RestingPlane pivots instead; the minimum zone width is the upper hull height
+over the origin of every reading minus every other.
+
+Checked against the pivot solvers with test_scripts/flatness_benchmark.py.
+'''
+
+from functools import lru_cache
+from itertools import combinations
+from typing import NamedTuple
+
+import numpy as np
+
+from RestingPlane import resting_plane, tip_offset
+
+LEAST_SQUARES = "least squares"
+MINIMUM_ZONE = "minimum zone"
+THREE_POINT = "three point"
+METHODS = [LEAST_SQUARES, MINIMUM_ZONE, THREE_POINT]
+
+ENUMERATION_MAX_POINTS = 12 # Zone vertices grow as k^4, larger layouts pivot instead
+CHUNK_ELEMENTS = 1 << 21    # Candidate residuals per pass, bounds batch memory
+
+class Flatness(NamedTuple):
+    method: str
+    flatness: float       # mm, NaN if the readings cannot define a plane
+    coefficients: tuple   # a, b, c of z = a * x + b * y + c
+    residuals: np.ndarray # (k,) reading minus plane, NaN for no reading
+
+class FlatnessBatch(NamedTuple):
+    method: str
+    flatness: np.ndarray     # (N,)
+    coefficients: np.ndarray # (N, 3)
+    residuals: np.ndarray    # (N, k)
+
+def flatness(coordinates, heights, method: str = MINIMUM_ZONE, centre=None) -> Flatness:
+    '''
+    Args:
+        coordinates (array): (k, 2) indicator x, y, eg RestingPlane.grid_layout(3, 3)
+        heights (array): (k,) readings, NaN for no reading
+        method (str): LEAST_SQUARES, MINIMUM_ZONE or THREE_POINT
+        centre (tuple): Platform centre of mass for THREE_POINT, defaults to the middle of the layout
+
+    Returns:
+        Flatness: Fit of one platform
+    '''
+    batch = flatness_batch(coordinates, np.asarray(heights, dtype=float)[None, :], method, centre)
+    return Flatness(method, float(batch.flatness[0]), tuple(float(value) for value in batch.coefficients[0]), batch.residuals[0])
+
+def flatness_batch(coordinates, heights, method: str = MINIMUM_ZONE, centre=None) -> FlatnessBatch:
+    '''
+    Args:
+        coordinates (array): (k, 2) indicator x, y, shared by every row
+        heights (array): (N, k) readings, NaN for no reading
+
+    Returns:
+        FlatnessBatch: Fit per row, NaN where fewer than three readings are off one line
+    '''
+    if method not in METHODS:
+        raise ValueError(f"Unknown flatness method: {method}")
+    coordinates = np.asarray(coordinates, dtype=float)
+    heights = np.asarray(heights, dtype=float)
+    centre = coordinates.mean(axis=0) if centre is None else np.asarray(centre, dtype=float)
+    slopes = np.full((len(heights), 2), np.nan)
+
+    if method != LEAST_SQUARES and len(coordinates) > ENUMERATION_MAX_POINTS:
+        # Too many zone vertices to enumerate, pivot row by row
+        for row, readings in enumerate(heights):
+            slopes[row] = minimum_zone_row(coordinates, readings) if method == MINIMUM_ZONE else three_point_row(coordinates, readings, centre)
+    else:
+        # Rows with the same readings missing share the tables of the indicators left
+        present = np.isfinite(heights)
+        if len(heights) == 1 or present.all():
+            patterns, groups = present[:1], np.zeros(len(heights), dtype=np.intp)
+        else:
+            patterns, groups = np.unique(present, axis=0, return_inverse=True)
+        size = np.ptp(coordinates, axis=0).max()
+        for index, pattern in enumerate(patterns):
+            rows = np.flatnonzero(groups == index) if len(patterns) > 1 else slice(None)
+            tables = layout_tables(np.ascontiguousarray(coordinates[pattern]).tobytes())
+            if not tables["plane"]:
+                continue
+            readings = heights[rows][:, pattern]
+            if method == LEAST_SQUARES:
+                slopes[rows] = readings @ tables["least_squares"]
+            elif method == MINIMUM_ZONE:
+                slopes[rows] = minimum_zone_slopes(tables, readings)
+            else:
+                slopes[rows] = three_point_slopes(tables, readings, centre, size)
+
+    # Residuals about the fitted slope
+    tilted = heights - slopes[:, :1] * coordinates[:, 0] - slopes[:, 1:] * coordinates[:, 1]
+    highest = np.fmax.reduce(tilted, axis=1)
+    lowest = np.fmin.reduce(tilted, axis=1)
+    if method == LEAST_SQUARES:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            offsets = np.where(np.isfinite(tilted), tilted, 0.0).sum(axis=1) / np.isfinite(tilted).sum(axis=1)
+    elif method == MINIMUM_ZONE:
+        offsets = (highest + lowest) / 2 # Mid plane of the zone
+    else:
+        offsets = highest # Contact plane on top
+
+    return FlatnessBatch(
+        method=method,
+        flatness=highest - lowest,
+        coefficients=np.column_stack((slopes, offsets)),
+        residuals=tilted - offsets[:, None]
+    )
+
+@lru_cache(maxsize=64)
+def layout_tables(layout: bytes) -> dict:
+    '''
+    Linear maps from a row of readings, built once per set of indicators
+
+    Args:
+        layout (bytes): (k, 2) float64 coordinates, bytes hash far quicker than nested tuples
+
+    Returns:
+        dict: plane, False if the indicators are fewer than three or all on one line
+              least_squares (k, 2) slopes
+              zone_slopes (c, 2, k), zone_residuals (k, k * c) per minimum zone vertex
+              triangles (t, 3), weights (t, 3), moves (t, 3, 2) around the centre, keyed by centre
+    '''
+    coordinates = np.frombuffer(layout, dtype=float).reshape(-1, 2)
+    count = len(coordinates)
+    design = np.column_stack((coordinates, np.ones(count))) # x, y, 1
+    tables = {
+        "coordinates": coordinates,
+        "plane": count >= 3 and np.linalg.matrix_rank(design) == 3,
+        "least_squares": np.linalg.pinv(design)[:2].T
+    }
+    if not tables["plane"] or count > ENUMERATION_MAX_POINTS:
+        return tables
+
+    # Minimum zone vertices as slope maps
+    maps = []
+    for triangle in combinations(range(count), 3):
+        # Plane through three readings
+        corners = design[list(triangle)]
+        if abs(np.linalg.det(corners)) <= 1e-9:
+            continue
+        slope_map = np.zeros((2, count))
+        slope_map[:, triangle] = np.linalg.inv(corners)[:2]
+        maps.append(slope_map)
+    for (i, j), (l, m) in combinations(combinations(range(count), 2), 2):
+        # Plane parallel to two pairs of readings, pairs sharing a reading are planes through three
+        dx1, dy1 = coordinates[j] - coordinates[i]
+        dx2, dy2 = coordinates[m] - coordinates[l]
+        normal_z = dx1 * dy2 - dy1 * dx2
+        if len({i, j, l, m}) < 4 or abs(normal_z) <= 1e-9:
+            continue
+        slope_map = np.zeros((2, count))
+        slope_map[0, [i, j, l, m]] = np.array([-dy2, dy2, dy1, -dy1]) / normal_z
+        slope_map[1, [i, j, l, m]] = np.array([dx2, -dx2, -dx1, dx1]) / normal_z
+        maps.append(slope_map)
+    maps = np.array(maps) # (c, 2, k)
+
+    # Residuals z - a x - b y for every vertex as one matrix, vertex varying fastest so
+    # the widths reduce over whole rows of vertices
+    residual_maps = np.eye(count)[None] - coordinates[None, :, 0, None] * maps[:, None, 0] - coordinates[None, :, 1, None] * maps[:, None, 1] # (c, residual, reading)
+    tables["zone_slopes"] = maps
+    tables["zone_residuals"] = residual_maps.transpose(2, 1, 0).reshape(count, -1)
+    return tables
+
+def centre_triangles(tables: dict, centre: np.ndarray):
+    '''
+    Triangles of indicators with the centre inside or on an edge
+
+    Returns:
+        tuple: (t, 3) indexes, (t, 3) weights of the centre, (t, 3, 2) weight change per unit centre move
+    '''
+    key = ("triangles", tuple(centre))
+    if key not in tables:
+        coordinates = tables["coordinates"]
+        triangles = []
+        weights = []
+        moves = []
+        for triangle in combinations(range(len(coordinates)), 3):
+            corners = np.column_stack((coordinates[list(triangle)], np.ones(3)))
+            if abs(np.linalg.det(corners)) <= 1e-9:
+                continue
+            inverse = np.linalg.inv(corners.T)
+            centre_weights = inverse @ [centre[0], centre[1], 1.0]
+            if (centre_weights >= -1e-9).all():
+                triangles.append(triangle)
+                weights.append(centre_weights)
+                moves.append(inverse[:, :2])
+        tables[key] = (np.array(triangles, dtype=np.intp).reshape(-1, 3), np.array(weights).reshape(-1, 3), np.array(moves).reshape(-1, 3, 2))
+    return tables[key]
+
+def minimum_zone_slopes(tables: dict, heights: np.ndarray) -> np.ndarray:
+    '''
+    Returns:
+        ndarray: (N, 2) a, b of the minimum zone
+    '''
+    count = heights.shape[1]
+    vertices = len(tables["zone_slopes"])
+    slopes = np.empty((len(heights), 2))
+
+    rows_per_chunk = max(1, CHUNK_ELEMENTS // (vertices * count))
+    for start in range(0, len(heights), rows_per_chunk):
+        chunk = heights[start:start + rows_per_chunk]
+        tilted = (chunk @ tables["zone_residuals"]).reshape(len(chunk), count, vertices)
+        best = (tilted.max(axis=1) - tilted.min(axis=1)).argmin(axis=1)
+
+        # Slope of the narrowest vertex only
+        slopes[start:start + rows_per_chunk] = np.einsum("ndk,nk->nd", tables["zone_slopes"][best], chunk)
+    return slopes
+
+def three_point_slopes(tables: dict, heights: np.ndarray, centre: np.ndarray, size: float) -> np.ndarray:
+    '''
+    Args:
+        size (float): Largest extent of the whole layout, sets the tip as in RestingPlane.resting_plane
+
+    Returns:
+        ndarray: (N, 2) a, b of the plane each row rests on, NaN if the centre is outside the indicators
+    '''
+    triangles, weights, moves = centre_triangles(tables, centre)
+    slopes = np.full((len(heights), 2), np.nan)
+    if len(triangles) == 0:
+        return slopes
+
+    # Same tip as RestingPlane.resting_plane for balanced platforms
+    tips = tip_offset(heights @ tables["least_squares"], size)
+
+    rows_per_chunk = max(1, CHUNK_ELEMENTS // (3 * len(triangles)))
+    for start in range(0, len(heights), rows_per_chunk):
+        chunk = heights[start:start + rows_per_chunk]
+        corner_heights = chunk[:, triangles] # (n, t, 3)
+        tipped = weights[None] + np.einsum("tij,nj->nti", moves, tips[start:start + rows_per_chunk])
+
+        # Highest plane over the tipped centre, every reading is on or below it
+        over_centre = np.where((tipped >= -1e-12).all(axis=2), np.einsum("nti,nti->nt", tipped, corner_heights), -np.inf)
+        best = over_centre.argmax(axis=1)
+        resting = np.isfinite(over_centre.max(axis=1))
+
+        # A weight's change per centre move is also the plane slope's change per reading
+        chunk_slopes = np.einsum("nij,ni->nj", moves[best], corner_heights[np.arange(len(best)), best])
+        slopes[start:start + rows_per_chunk] = np.where(resting[:, None], chunk_slopes, np.nan)
+    return slopes
+
+def minimum_zone_row(coordinates: np.ndarray, heights: np.ndarray) -> np.ndarray:
+    # Zone width is the upper hull height over the origin of every reading minus every other
+    present = np.flatnonzero(np.isfinite(heights))
+    first, second = np.nonzero(~np.eye(len(present), dtype=bool))
+    try:
+        plane = resting_plane(coordinates[present[first]] - coordinates[present[second]],
+                              heights[present[first]] - heights[present[second]], centre=(0.0, 0.0))
+    except ValueError:
+        return np.full(2, np.nan)
+    return np.array(plane.coefficients[:2])
+
+def three_point_row(coordinates: np.ndarray, heights: np.ndarray, centre: np.ndarray) -> np.ndarray:
+    try:
+        return np.array(resting_plane(coordinates, heights, centre).coefficients[:2])
+    except ValueError:
+        return np.full(2, np.nan)
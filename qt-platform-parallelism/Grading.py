@@ -0,0 +1,106 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Platform grading rules, shared by the Qt window and the headless engine.
+
+Indicator layout (index in mux_ports_in_use order, viewed from the front):
+    0 1 2   back row
+    3 4 5   middle row
+    6 7 8   front row
+'''
+
+from typing import NamedTuple
+
+BIAS_BACK_ROW = 0.000 # Indicators 0, 1, 2
+BIAS_MIDDLE_ROW = 0.001 # Indicators 3, 4, 5
+BIAS_FRONT_ROW = 0.002 # Indicators 6, 7, 8
+
+# Bias per indicator, mm
+BIASES = [BIAS_BACK_ROW] * 3 + [BIAS_MIDDLE_ROW] * 3 + [BIAS_FRONT_ROW] * 3
+
+PASS_CRITERIA = 0.035
+MIN_VALID_READINGS = 8 # Accepts 8 or 9 data points
+
+# indicator-controller mux_thread.c, per port: 50 ms select settle, query, 50 ms reply wait,
+# up to 50 ms read then 100 ms gap. Both MUX boards sweep their 7 ports side by side
+FIRMWARE_PORT_MS = 250
+FIRMWARE_PORTS = 7
+SWEEP_MS = FIRMWARE_PORT_MS * FIRMWARE_PORTS
+SWEEP_MARGIN_MS = 500 # Serial latency and board drift
+
+# A frame completes up to one sweep after its oldest value and stays the latest for one more sweep
+MAX_READING_AGE_MS = 2 * SWEEP_MS + SWEEP_MARGIN_MS
+
+PASS = "PASS"
+FAIL = "FAIL"
+DATA_ERROR = "DATA ERROR"
+
+class GradeResult(NamedTuple):
+    grade: str          # PASS, FAIL or DATA ERROR
+    max_min: float      # mm, None on DATA ERROR
+    max_index: int      # Indicators to highlight, None on DATA ERROR
+    min_index: int
+
+def reading_ages_ms(frame, now_ns: int) -> list:
+    '''
+    Returns:
+        list: Age of each value in a SweepFrame, ms
+    '''
+    return [(now_ns - received_ns) // 1_000_000 for received_ns in frame.received_ns]
+
+def frame_is_current(frame, now_ns: int, sweep_ms: int = SWEEP_MS) -> bool:
+    # The next frame is due one sweep after this one, the controller or a MUX board has stopped once it is overdue
+    sweep_ns = max(sweep_ms * 1_000_000, frame.timestamp_ns - frame.started_ns)
+    return now_ns - frame.timestamp_ns <= sweep_ns + SWEEP_MARGIN_MS * 1_000_000
+
+def fresh_mask(frame, now_ns: int, max_age_ms: int = MAX_READING_AGE_MS) -> int:
+    '''
+    Readings received since the previous frame's sweep started: those of the
+    latest frame, from its started_ns on, while the sweep after it is still
+    running. Nothing is fresh once the next frame is overdue, and no reading
+    older than max_age_ms is used whatever the frame says.
+
+    Returns:
+        int: valid_mask of a SweepFrame without the stale readings, for SweepFrame.mm
+    '''
+    if not frame_is_current(frame, now_ns):
+        return 0
+
+    oldest_ns = max(frame.started_ns, now_ns - max_age_ms * 1_000_000)
+    mask = frame.valid_mask
+    for slot, received_ns in enumerate(frame.received_ns):
+        if received_ns < oldest_ns:
+            mask &= ~(1 << slot)
+    return mask
+
+def fresh_values(frame, now_ns: int, max_age_ms: int = MAX_READING_AGE_MS) -> tuple:
+    '''
+    Values of a SweepFrame with the readings fresh_mask drops replaced by None
+    '''
+    mask = fresh_mask(frame, now_ns, max_age_ms)
+    return tuple(microns if mask >> slot & 1 else None for slot, microns in enumerate(frame.microns))
+
+def apply_bias(values: tuple, biases: list = BIASES) -> list:
+    '''
+    Args:
+        values (tuple): Microns or None per indicator, eg SweepFrame.values
+
+    Returns:
+        list: mm rounded to 3dp with the bias applied, None where there was no reading
+    '''
+    return [None if microns is None else round(microns / 1000 + bias, 3) for microns, bias in zip(values, biases)]
+
+def grade(readings: list, pass_criteria: float = PASS_CRITERIA) -> GradeResult:
+    '''
+    Grade one sweep of biased readings (mm, None for no reading)
+    '''
+    valid = [value for value in readings if value is not None]
+    if len(valid) < MIN_VALID_READINGS:
+        return GradeResult(DATA_ERROR, None, None, None)
+
+    highest = max(valid)
+    lowest = min(valid)
+    max_min = round(abs(highest - lowest), 3)
+
+    # Indexes among the valid readings, as highlighted by the window
+    return GradeResult(PASS if max_min <= pass_criteria else FAIL, max_min, valid.index(highest), valid.index(lowest))
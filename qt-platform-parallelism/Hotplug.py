@@ -0,0 +1,167 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+USB serial hotplug events without polling.
+
+Listens on the kernel uevent netlink socket (Linux only), which wakes up only
+when a device is added or removed. Events from udev (group 2) are used by
+default as they arrive once /dev nodes exist and carry vendor/model
+properties. Raw kernel events (group 1) are filled in from sysfs instead.
+
+FakeUeventSource speaks the same datagram format over a socketpair so the
+watcher can be driven without hardware.
+'''
+
+import socket
+from os import path
+from struct import unpack_from
+from typing import NamedTuple
+
+from PortDiscovery import PortIdentity, identity_from_uevent, is_controller, is_scanner_candidate
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_GROUP = 1
+UDEV_GROUP = 2
+
+UDEV_PREFIX = b"libudev\0"
+
+class HotplugEvent(NamedTuple):
+    action: str             # "add" or "remove"
+    port_name: str          # eg "ttyACM0", same as QSerialPortInfo.portName()
+    kind: str               # "controller", "scanner" or "" when not of interest
+    identity: PortIdentity
+
+def parse_uevent(message: bytes) -> dict:
+    '''
+    Parse a kernel or udev netlink message into its KEY=VALUE properties
+    '''
+    if message.startswith(UDEV_PREFIX):
+        # udev_monitor_netlink_header: prefix[8], magic, header_size, properties_off, properties_len
+        properties_off, properties_len = unpack_from("=II", message, 16)
+        fields = message[properties_off:properties_off + properties_len].split(b"\0")
+    else:
+        # "<action>@<devpath>" followed by properties
+        fields = message.split(b"\0")[1:]
+
+    properties = {}
+    for field in fields:
+        key, separator, value = field.partition(b"=")
+        if separator:
+            properties[key.decode(errors="replace")] = value.decode(errors="replace")
+    return properties
+
+def read_sysfs_identity(properties: dict) -> dict:
+    '''
+    Fill in udev style USB identity properties for a raw kernel event
+    '''
+    device = path.realpath(path.join("/sys", properties.get("DEVPATH", "").lstrip("/"), "device"))
+
+    # Walk up from the tty interface to the USB device
+    while device != "/" and not path.isfile(path.join(device, "idVendor")):
+        device = path.dirname(device)
+    if device == "/":
+        return properties
+
+    def read(name):
+        try:
+            with open(path.join(device, name)) as file:
+                return file.read().strip()
+        except OSError:
+            return ""
+
+    properties.setdefault("ID_VENDOR_ID", read("idVendor"))
+    properties.setdefault("ID_MODEL_ID", read("idProduct"))
+    properties.setdefault("ID_VENDOR", read("manufacturer") or read("idVendor"))
+    properties.setdefault("ID_MODEL", (read("product") or read("idProduct")).replace(" ", "_"))
+    properties.setdefault("ID_SERIAL_SHORT", read("serial"))
+    return properties
+
+def classify(identity: PortIdentity) -> str:
+    if is_controller(identity):
+        return "controller"
+    if is_scanner_candidate(identity):
+        return "scanner"
+    return ""
+
+class UeventSource:
+    '''
+    Non-blocking datagram socket of uevent messages
+    '''
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.sock.setblocking(False)
+
+        # Removes carry no identity, remember what each port was when it was added
+        self.known = {}
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def read_events(self) -> list:
+        '''
+        Drain all pending messages
+
+        Returns:
+            list: HotplugEvent for every tty device added or removed
+        '''
+        events = []
+        while True:
+            try:
+                message = self.sock.recv(16384)
+            except (BlockingIOError, InterruptedError):
+                break
+
+            properties = parse_uevent(message)
+            action = properties.get("ACTION")
+            if properties.get("SUBSYSTEM") != "tty" or action not in ("add", "remove") or "DEVNAME" not in properties:
+                continue
+
+            port_name = path.basename(properties["DEVNAME"])
+
+            if action == "add":
+                if "ID_VENDOR_ID" not in properties:
+                    read_sysfs_identity(properties)
+                identity = identity_from_uevent(port_name, properties)
+                self.known[port_name] = identity
+            else:
+                identity = self.known.pop(port_name, None) or identity_from_uevent(port_name, properties)
+
+            events.append(HotplugEvent(action, port_name, classify(identity), identity))
+
+        return events
+
+    def close(self):
+        self.sock.close()
+
+class NetlinkUeventSource(UeventSource):
+
+    def __init__(self, group: int = UDEV_GROUP):
+        # Raises OSError where netlink is unavailable (not Linux, sandboxed)
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        sock.bind((0, group))
+        super().__init__(sock)
+
+class FakeUeventSource(UeventSource):
+    '''
+    Socketpair stand-in for the netlink socket, push() events from tests or the simulator
+    '''
+
+    def __init__(self):
+        sock, self.writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        super().__init__(sock)
+
+    def push(self, action: str, port_name: str, **properties):
+        fields = {
+            "ACTION": action,
+            "SUBSYSTEM": "tty",
+            "DEVNAME": f"/dev/{port_name}",
+            "DEVPATH": f"/devices/virtual/tty/{port_name}",
+            **properties
+        }
+        message = f"{action}@{fields['DEVPATH']}\0" + "\0".join(f"{key}={value}" for key, value in fields.items())
+        self.writer.send(message.encode())
+
+    def close(self):
+        self.writer.close()
+        super().close()
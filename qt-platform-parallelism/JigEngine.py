@@ -0,0 +1,519 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Headless jig engine: controller ingest, barcode scan, grading and saving on
+one asyncio loop, no Qt. Serial ports are plain file descriptors watched with
+loop.add_reader, so an idle jig costs nothing and one process can drive many.
+
+Controller bytes to sweeps (SerialFramer.ControllerStream), the scan
+exchange (ScannerCodec.TriggerScan), grading a part (SequentialGrader.PartGrader)
+and records (Results) are the same code the Qt window runs, only the IO differs.
+
+Usage:
+    python3 JigEngine.py --controller ttyACM0 --scanner ttyACM1
+    python3 JigEngine.py --stations stations.json
+Ports default to PPQC_CONTROLLER_PORT / PPQC_SCANNER_PORT. Press Enter to
+test the platform on the jig, or type a station name then Enter when
+running several.
+
+stations.json lists one jig per entry, only name and controller are required:
+    [{"name": "A", "controller": "/dev/serial/by-id/...", "scanner": "ttyACM1",
+      "mux_ports_in_use": [1, 2, 4, 5, 6, 9, 10, 12, 13],
+      "biases": [0, 0, 0, 0.001, 0.001, 0.001, 0.002, 0.002, 0.002],
+      "data_file": "data-A.csv", "auto_trigger": true}]
+data_file defaults to data-<name>.csv, the CSV has no station column so
+each jig keeps its own. auto_trigger tests each platform once it settles (SettleDetector.py), no Enter.
+"sequential": true grades on the mean of as many sweeps as it takes to be
+confident of PASS / FAIL (SequentialGrader.py) rather than the latest sweep.
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import termios
+import tty
+from os import environ, path
+from time import monotonic_ns
+from typing import NamedTuple
+
+from Grading import BIASES, DATA_ERROR, MAX_READING_AGE_MS
+from PortDiscovery import PORT_OVERRIDE_ENV
+from Outbox import OUTBOX_FILE, Outbox
+from PersistenceWorker import PersistenceWorker
+from Results import make_record
+from ResultsStore import RESULTS_DB, ResultsStore
+from ScannerCodec import ScannerStreamDecoder, ScanStep, TriggerScan, IDLE, CODE_IDLE_MS, NO_CODE, NO_CONFIRM, REFUSED
+from SerialFramer import MUX_PORTS_IN_USE, ControllerStream
+from SettleDetector import SettleDetector
+from SequentialGrader import PartGrader
+
+DATA_FILE = "data.csv"
+STATION_DATA_FILE = "data-{}.csv" # Per station in stations.json, the CSV has no station column
+
+CONTROLLER_BAUD = 115200
+SCANNER_BAUD = 9600
+READ_SIZE = 4096
+RECONNECT_S = 1.0 # Wait before reopening a controller that went away
+
+def device_path(port_name: str) -> str:
+    # QSerialPortInfo style names ("ttyACM0") or full paths
+    return port_name if port_name.startswith("/") else f"/dev/{port_name}"
+
+def open_serial(port_name: str, baud: int) -> int:
+    '''
+    Open a serial port raw and non-blocking
+
+    Returns:
+        int: File descriptor
+    '''
+    fd = os.open(device_path(port_name), os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        attributes = termios.tcgetattr(fd)
+        attributes[2] |= termios.CLOCAL | termios.CREAD
+        attributes[4] = attributes[5] = getattr(termios, f"B{baud}")
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+    except termios.error:
+        pass # Not a tty (fifo, capture replay), nothing to configure
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+class SerialConnection:
+    '''
+    Serial port on the running loop, on_data(chunk, received ns) is called for every read
+    '''
+
+    def __init__(self, port_name: str, baud: int, on_data):
+        self.port_name = port_name
+        self.baud = baud
+        self.on_data = on_data
+        self.fd = None
+        self.loop = None
+        self.closed = None
+
+    def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.fd = open_serial(self.port_name, self.baud)
+        self.closed = self.loop.create_future()
+        self.loop.add_reader(self.fd, self.readable)
+
+    def readable(self):
+        try:
+            chunk = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as error: # Unplugged
+            print(f"Serial port {self.port_name}: {error}")
+            self.close()
+            return
+
+        if not chunk: # Hung up
+            self.close()
+            return
+        self.on_data(chunk, monotonic_ns())
+
+    def write(self, data: bytes):
+        os.write(self.fd, data)
+
+    def is_open(self) -> bool:
+        return self.fd is not None
+
+    def close(self):
+        if self.fd is None:
+            return
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    async def wait_closed(self):
+        await self.closed
+
+class ControllerIngest:
+    '''
+    Keeps the latest SweepFrame from one indicator controller, reconnecting when it goes away
+    '''
+
+    def __init__(self, port_name: str, mux_ports_in_use: list = MUX_PORTS_IN_USE, recorder=None, on_frame=None):
+        self.port_name = port_name
+        self.stream = ControllerStream(mux_ports_in_use, recorder) # Shared with ExtractData.DataGetter
+        self.on_frame = on_frame
+
+        self.latest = None
+        self.connected = False
+        self.waiters = [] # Futures for next_frame()
+
+    def data(self, chunk: bytes, received_ns: int):
+        for frame in self.stream.feed(chunk, received_ns):
+            self.latest = frame
+            if self.on_frame is not None:
+                self.on_frame(frame)
+            for waiter in self.waiters:
+                if not waiter.done():
+                    waiter.set_result(frame)
+            self.waiters.clear()
+
+    async def next_frame(self, timeout_s: float = MAX_READING_AGE_MS / 1000):
+        '''
+        Returns:
+            SweepFrame | None: The next sweep to complete, None if the controller goes quiet
+        '''
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout_s)
+        except asyncio.TimeoutError:
+            return None
+
+    async def run(self):
+        while True:
+            self.stream.reset()
+            connection = SerialConnection(self.port_name, CONTROLLER_BAUD, self.data)
+            try:
+                connection.open()
+            except OSError as error:
+                print(f"Controller {self.port_name}: {error}")
+                await asyncio.sleep(RECONNECT_S)
+                continue
+
+            print(f"Controller connected: {self.port_name}")
+            self.connected = True
+            try:
+                await connection.wait_closed()
+            finally:
+                connection.close()
+                self.connected = False
+                self.latest = None
+
+            print(f"Controller disconnected: {self.port_name}")
+            await asyncio.sleep(RECONNECT_S)
+
+    def close(self):
+        self.stream.close()
+
+class AsyncScanner:
+    '''
+    Barcode scanner in command trigger mode, read_code() triggers one scan.
+    The exchange itself is ScannerCodec.TriggerScan, as in qr.py.
+    '''
+
+    def __init__(self, port_name: str, baud: int = SCANNER_BAUD):
+        self.port_name = port_name
+        self.baud = baud
+        self.decoder = ScannerStreamDecoder()
+        self.scan = TriggerScan()
+        self.connection = None
+        self.done = None # Future for the step that ends the scan in progress
+        self.timeout_handle = None
+        self.idle_handle = None
+
+    def data(self, chunk: bytes, received_ns: int):
+        if self.idle_handle is not None:
+            self.idle_handle.cancel()
+            self.idle_handle = None
+
+        self.handle_events(self.decoder.feed(chunk))
+
+        # Code without CR/LF ends when the line goes quiet
+        if self.decoder.has_pending_text():
+            self.idle_handle = asyncio.get_running_loop().call_later(CODE_IDLE_MS / 1000, self.flush)
+
+    def flush(self):
+        self.idle_handle = None
+        self.handle_events(self.decoder.flush())
+
+    def handle_events(self, events: list):
+        for kind, payload in events:
+            step = self.scan.handle(kind, payload)
+            if step is not None:
+                self.follow(step)
+
+    def timed_out(self):
+        self.timeout_handle = None
+        self.follow(self.scan.timed_out())
+
+    def follow(self, step: ScanStep):
+        if step.write is not None and self.connection is not None and self.connection.is_open():
+            self.connection.write(step.write)
+
+        if step.wait_ms is not None:
+            if self.timeout_handle is not None:
+                self.timeout_handle.cancel()
+                self.timeout_handle = None
+            if step.wait_ms > 0:
+                self.timeout_handle = asyncio.get_running_loop().call_later(step.wait_ms / 1000, self.timed_out)
+
+        if step.done and self.done is not None and not self.done.done():
+            self.done.set_result(step)
+
+    def open(self) -> bool:
+        if self.connection is not None and self.connection.is_open():
+            return True
+        self.decoder.reset()
+        self.connection = SerialConnection(self.port_name, self.baud, self.data)
+        try:
+            self.connection.open()
+        except OSError as error:
+            print(f"Scanner {self.port_name}: {error}")
+            self.connection = None
+            return False
+        return True
+
+    async def read_code(self):
+        '''
+        Returns:
+            str | None: Scanned code, None if there is no scanner or nothing was read
+        '''
+        if self.scan.state != IDLE:
+            print("Scan already in progress")
+            return None
+        if not self.open():
+            return None
+
+        # Anything left from an earlier scan is not this platform's code
+        self.decoder.reset()
+        self.done = asyncio.get_running_loop().create_future()
+        self.follow(self.scan.start())
+        try:
+            step = await self.done
+        except asyncio.CancelledError:
+            self.follow(self.scan.cancel())
+            raise
+        finally:
+            self.done = None
+
+        if step.failure == NO_CONFIRM:
+            print("Scanner did not confirm the trigger")
+            self.close()
+        elif step.failure == REFUSED:
+            print("Scanner refused the trigger")
+        elif step.failure == NO_CODE:
+            print("No code scanned")
+        return step.code.strip() if step.code is not None else None
+
+    def close(self):
+        if self.timeout_handle is not None:
+            self.timeout_handle.cancel()
+            self.timeout_handle = None
+        self.scan.reset()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class StationConfig(NamedTuple):
+    name: str
+    controller_port: str
+    scanner_port: str = None
+    mux_ports_in_use: list = MUX_PORTS_IN_USE
+    biases: list = BIASES       # mm per indicator, Grading.py order
+    data_file: str = DATA_FILE
+    auto_trigger: bool = False  # Test when a placed platform settles
+    sequential: bool = False    # Grade on the mean of repeated sweeps
+
+def load_stations(file_name: str) -> list:
+    '''
+    Returns:
+        list: StationConfig per jig in a stations.json file
+    '''
+    with open(file_name) as file:
+        entries = json.load(file)
+
+    stations = []
+    for entry in entries:
+        station = StationConfig(
+            name=str(entry["name"]),
+            controller_port=entry["controller"],
+            scanner_port=entry.get("scanner"),
+            mux_ports_in_use=entry.get("mux_ports_in_use", MUX_PORTS_IN_USE),
+            biases=entry.get("biases", BIASES),
+            data_file=entry.get("data_file", STATION_DATA_FILE.format(entry["name"])),
+            auto_trigger=bool(entry.get("auto_trigger", False)),
+            sequential=bool(entry.get("sequential", False))
+        )
+        if len(station.mux_ports_in_use) != len(station.biases):
+            raise ValueError(f"Station {station.name}: {len(station.mux_ports_in_use)} ports but {len(station.biases)} biases")
+        stations.append(station)
+
+    names = [station.name for station in stations]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate station names: {names}")
+    data_files = [path.abspath(station.data_file) for station in stations]
+    if len(set(data_files)) != len(data_files):
+        raise ValueError(f"Stations share a data file, rows would not say which jig tested them: {[station.data_file for station in stations]}")
+    return stations
+
+class JigEngine:
+    '''
+    One jig: a controller, an optional scanner, grading and saving
+    '''
+
+    def __init__(self, station: StationConfig, outbox=None, recorder=None, on_frame=None, on_result=None, store=None):
+        self.station = station
+        self.ingest = ControllerIngest(station.controller_port, station.mux_ports_in_use, recorder, self.frame_received)
+        self.scanner = AsyncScanner(station.scanner_port) if station.scanner_port else None
+        self.outbox = outbox # Outbox to Google Sheets, shared by the stations of a host
+        self.store = store   # ResultsStore, likewise
+        self.task = None
+
+        self.on_frame = on_frame
+        self.on_result = on_result # Called with (station name, GradeResult, ResultRecord | None) after auto tests
+        self.settle_detector = SettleDetector() if station.auto_trigger else None
+        self.auto_tests = set()
+        self.persistence = None # PersistenceWorker, started on the first save
+
+    def start(self):
+        self.task = asyncio.create_task(self.ingest.run())
+
+    def frame_received(self, frame):
+        if self.on_frame is not None:
+            self.on_frame(frame)
+
+        # Hands-free, the platform settled after being placed
+        if self.settle_detector is not None and self.settle_detector.add(frame.values, frame.timestamp_ns):
+            print(f"[{self.station.name}] Platform settled, testing (sweep {frame.sequence})")
+            test = asyncio.create_task(self.auto_test())
+            self.auto_tests.add(test)
+            test.add_done_callback(self.auto_tests.discard)
+
+    async def auto_test(self):
+        result, record = await self.test_part()
+        if self.on_result is not None:
+            self.on_result(self.station.name, result, record)
+
+    async def test_part(self):
+        '''
+        Scan the identifier while grading the latest sweep, save if both worked
+
+        Returns:
+            tuple: (GradeResult, ResultRecord | None)
+        '''
+        scan = asyncio.create_task(self.scanner.read_code()) if self.scanner is not None else None
+
+        # The latest sweep, sequential grading waits for as many more as it needs
+        grader = PartGrader(self.station.biases, self.station.sequential)
+        decided = grader.add(self.ingest.latest)
+        while decided is None:
+            decided = grader.add(await self.ingest.next_frame())
+        result, readings = decided
+        if grader.sequential is not None and result.grade != DATA_ERROR:
+            print(f"[{self.station.name}] {result.grade} after {grader.sweeps} sweeps: {result.max_min} +/- {grader.sequential.uncertainty:.4f}")
+
+        if result.grade == DATA_ERROR:
+            if scan is not None:
+                scan.cancel()
+            return result, None
+
+        identifier = await scan if scan is not None else None
+        if not identifier:
+            print("No identifier, result not saved")
+            return result, None
+
+        record = make_record(identifier, result, readings, station=self.station.name)
+        self.save(record)
+        return result, record
+
+    def save(self, record):
+        # Queued, file and network I/O run on the worker's threads and never stall ingest
+        if self.persistence is None:
+            self.persistence = PersistenceWorker(self.station.data_file, self.outbox, store=self.store)
+        self.persistence.submit(record)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.scanner is not None:
+            self.scanner.close()
+        if self.persistence is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.persistence.close)
+        self.ingest.close()
+
+class JigHost:
+    '''
+    Several jigs on one loop, each with its own ingest, scanner and grading
+    '''
+
+    def __init__(self, stations: list, post: bool = False, on_result=None, results_db: str = RESULTS_DB):
+        self.outbox = Outbox(OUTBOX_FILE) if post else None
+        self.store = ResultsStore(results_db) if results_db else None
+        self.engines = {station.name: JigEngine(station, self.outbox, on_result=on_result, store=self.store) for station in stations}
+
+    def start(self):
+        for engine in self.engines.values():
+            engine.start()
+
+    async def test_part(self, name: str):
+        return await self.engines[name].test_part()
+
+    async def stop(self):
+        await asyncio.gather(*(engine.stop() for engine in self.engines.values()))
+        if self.outbox is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.outbox.close)
+        if self.store is not None:
+            self.store.close()
+
+async def run_console(host: JigHost):
+    # Enter on stdin tests the platform, "<station>" + Enter picks the jig
+    loop = asyncio.get_running_loop()
+    requests = asyncio.Queue()
+    loop.add_reader(sys.stdin.fileno(), lambda: requests.put_nowait(sys.stdin.readline()))
+
+    host.start()
+    print(f"Stations: {', '.join(host.engines)}. Press Enter to test, Ctrl+C to quit")
+    tests = set()
+    try:
+        while True:
+            line = await requests.get()
+            if not line:
+                break # stdin closed
+
+            name = line.strip() or next(iter(host.engines))
+            if name not in host.engines:
+                print(f"Unknown station: {name}")
+                continue
+
+            # Stations test independently, a slow scan on one never holds up another
+            test = asyncio.create_task(test_and_report(host, name))
+            tests.add(test)
+            test.add_done_callback(tests.discard)
+    finally:
+        loop.remove_reader(sys.stdin.fileno())
+        await host.stop()
+
+async def test_and_report(host: JigHost, name: str):
+    report(name, *await host.test_part(name))
+
+def report(name: str, result, record):
+    print(f"[{name}] {result.grade} {'' if result.max_min is None else result.max_min} {record.platform_id if record else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the platform parallelism jig without the GUI")
+    parser.add_argument("--stations", help="stations.json, one entry per jig")
+    parser.add_argument("--controller", default=environ.get(PORT_OVERRIDE_ENV["controller"]), help="Controller port, eg ttyACM0")
+    parser.add_argument("--scanner", default=environ.get(PORT_OVERRIDE_ENV["scanner"]), help="Scanner port, eg ttyACM1")
+    parser.add_argument("--data-file", default=DATA_FILE)
+    parser.add_argument("--results-db", default=RESULTS_DB, help="Results database shared by the stations (ResultsStore.py)")
+    parser.add_argument("--post", action="store_true", help="Also post results to Google Sheets")
+    parser.add_argument("--auto", action="store_true", help="Test when a placed platform settles")
+    args = parser.parse_args()
+
+    if args.stations is not None:
+        stations = load_stations(args.stations)
+    elif args.controller is not None:
+        stations = [StationConfig("jig", args.controller, args.scanner, data_file=args.data_file, auto_trigger=args.auto)]
+    else:
+        parser.error("No controller port, pass --controller, --stations or set PPQC_CONTROLLER_PORT")
+
+    try:
+        asyncio.run(run_console(JigHost(stations, args.post, on_result=report, results_db=args.results_db)))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,235 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Durable outbox for results on their way to Google Sheets.
+
+add() commits the result to a SQLite table before returning, so a result is
+never lost to a dropped network, a crash or a restart. An uploader thread
+sends the oldest rows and deletes them once the sheet script confirms them,
+a 200 carrying the script's error page keeps them for a retry.
+
+The deployed script takes one result per request, so rows go up one at a
+time in that body (PostToSheet.post_each). BATCH_UPLOADS sends up to
+BATCH_ROWS per request instead (PostToSheet.post_rows), only turn it on once
+the script takes {"rows": [...]}: every row carries an idempotency key, so a
+batch that was appended but whose response got lost is skipped by the
+script when it is sent again.
+
+Failed uploads back off exponentially with jitter up to BACKOFF_MAX_S. When
+the last attempt got no answer at all, the uploader probes the sheet host
+every PROBE_INTERVAL_S while backing off (PostToSheet.sheet_reachable, a
+TCP connect) and retries as soon as it accepts a connection, so a backlog
+goes up within seconds of the network coming back rather than after the
+rest of the backoff. The first batch to get through flushes the backlog
+back to back, flush() cuts the wait short too. With more than one sender, batches go up concurrently over the pooled session
+(PostToSheet.SheetUploader) and may reach the sheet out of order.
+'''
+
+import json
+import random
+import sqlite3
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from uuid import uuid4
+
+from PostToSheet import post_each, post_rows, sheet_reachable
+from Results import to_json
+
+OUTBOX_FILE = "outbox.db"
+BATCH_UPLOADS = False   # Off until the sheet script is redeployed to take {"rows": [...]} and skip known ids
+BATCH_ROWS = 50         # Rows per request when batching
+BATCH_LINGER_S = 2.0    # A part batch waits this long from its oldest row for more to join
+BACKOFF_BASE_S = 1.0    # First retry, doubled per failure
+BACKOFF_MAX_S = 300.0
+PROBE_INTERVAL_S = 10.0 # Reachability checks while backing off, the retry waits at most this long once the network is back
+CLOSE_TIMEOUT_S = 5.0   # Last upload attempt on close, what is left goes on the next start
+SENDERS = 1             # Batches in flight at once, 1 keeps the sheet in test order
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    body TEXT NOT NULL,
+    created_s REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+def backoff_s(failures: int, base_s: float = BACKOFF_BASE_S, max_s: float = BACKOFF_MAX_S) -> float:
+    # Exponential with jitter so several jigs coming back online do not retry in step
+    return min(max_s, base_s * 2 ** (failures - 1)) * random.uniform(0.5, 1.0)
+
+class Outbox:
+    '''
+    Results waiting to be uploaded, on disk until the sheet has them. Safe to share between threads
+
+    Args:
+        db_file (str): SQLite file, created if missing
+        send (callable): send(rows) -> bool, posts to_json() bodies, defaults to PostToSheet.post_rows or post_each
+        senders (int): Upload threads, each with one batch in flight
+        batched (bool): Up to batch_rows per request, otherwise one
+        probe (callable): probe() -> bool, network back, defaults to PostToSheet.sheet_reachable with the default send
+    '''
+
+    def __init__(self, db_file: str = OUTBOX_FILE, send=None, batch_rows: int = BATCH_ROWS, linger_s: float = BATCH_LINGER_S,
+                 backoff_base_s: float = BACKOFF_BASE_S, backoff_max_s: float = BACKOFF_MAX_S, senders: int = SENDERS,
+                 batched: bool = BATCH_UPLOADS, probe=None, probe_interval_s: float = PROBE_INTERVAL_S):
+        self.probe = probe or (sheet_reachable if send is None else None)
+        self.probe_interval_s = probe_interval_s
+        self.send = send or (post_rows if batched else post_each)
+        self.batch_rows = batch_rows if batched else 1 # A half sent batch would be resent, only the batch script skips repeats
+        self.linger_s = linger_s
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+
+        self.lock = Lock()
+        self.db = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL") # Committed rows survive a power cut
+        self.db.execute(SCHEMA)
+
+        self.requests = 0   # Upload round trips, successful or not
+        self.uploaded = 0   # Rows the sheet accepted
+        self.failures = 0   # Failed attempts in a row
+        self.unreachable = False # Last attempt never got an answer, the probe can tell when that changes
+        self.claimed = set() # seq of rows in flight
+        self.closing = False
+        self.wake = Event()      # A row was added
+        self.reconnect = Event() # flush(), skip the backoff
+
+        backlog = self.pending()
+        if backlog:
+            print(f"Outbox {db_file}: {backlog} results from an earlier run waiting to upload")
+        self.threads = [Thread(target=self.upload_rows, name=f"outbox-upload-{index}", daemon=True) for index in range(senders)]
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, record) -> str:
+        '''
+        Store a ResultRecord for upload, committed to disk before returning
+
+        Returns:
+            str: Its idempotency key
+        '''
+        key = uuid4().hex
+        body = json.dumps({**to_json(record), "id": key})
+        with self.lock:
+            self.db.execute("INSERT INTO outbox (id, body, created_s) VALUES (?, ?, ?)", (key, body, time()))
+        self.wake.set()
+        return key
+
+    def pending(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def flush(self):
+        # Network is back, retry now rather than when the backoff runs out
+        self.reconnect.set()
+        self.wake.set()
+
+    def claim_batch(self):
+        '''
+        Oldest rows no other sender has, claimed unless the batch should wait for more
+
+        Returns:
+            tuple: (rows, seconds to linger before sending, 0 once claimed)
+        '''
+        with self.lock:
+            rows = self.db.execute("SELECT seq, body, created_s FROM outbox ORDER BY seq LIMIT ?", (self.batch_rows + len(self.claimed),)).fetchall()
+            batch = [row for row in rows if row[0] not in self.claimed][:self.batch_rows]
+            if not batch:
+                return batch, 0
+
+            # Part batch, give a busy shift a moment to fill it
+            linger_s = min(self.linger_s, self.linger_s - (time() - batch[0][2])) # Clock stepped back
+            if len(batch) < self.batch_rows and linger_s > 0 and not self.closing:
+                return batch, linger_s
+            self.claimed.update(row[0] for row in batch)
+            return batch, 0
+
+    def upload_rows(self):
+        while True:
+            batch, linger_s = self.claim_batch()
+            if not batch:
+                if self.closing:
+                    return
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            if linger_s > 0:
+                self.wake.wait(linger_s)
+                self.wake.clear()
+                continue
+
+            if self.upload(batch):
+                self.failures = 0
+                continue # Straight on to the next batch, a backlog drains back to back
+
+            self.failures += 1
+            if self.closing:
+                return # Stays on disk for the next start
+            delay_s = backoff_s(self.failures, self.backoff_base_s, self.backoff_max_s)
+            print(f"Upload failed {self.failures} times in a row, {self.pending()} results waiting, retrying in {delay_s:.1f} s")
+            self.wait_to_retry(delay_s)
+
+    def wait_to_retry(self, delay_s: float):
+        # Backoff, cut short by flush() or the sheet host answering again
+        deadline = monotonic() + delay_s
+        while not self.closing:
+            left_s = deadline - monotonic()
+            if left_s <= 0 or self.reconnect.wait(min(left_s, self.probe_interval_s)):
+                break
+            if self.unreachable and self.probe is not None and self.probe():
+                print("Sheet reachable again, retrying now")
+                break
+        self.reconnect.clear()
+
+    def upload(self, batch: list) -> bool:
+        sequence = [row[0] for row in batch]
+        try:
+            accepted = self.send([json.loads(row[1]) for row in batch])
+            self.unreachable = False # Answered, a refusal backs off in full
+        except Exception as error: # Connection errors and timeouts, retried
+            print(f"Upload of {len(batch)} results: {type(error).__name__}: {error}")
+            accepted = False
+            self.unreachable = True
+
+        marks = ",".join("?" * len(sequence))
+        with self.lock:
+            if accepted:
+                self.db.execute(f"DELETE FROM outbox WHERE seq IN ({marks})", sequence)
+                self.uploaded += len(batch)
+            else:
+                self.db.execute(f"UPDATE outbox SET attempts = attempts + 1 WHERE seq IN ({marks})", sequence)
+            self.claimed.difference_update(sequence)
+            self.requests += 1
+        return accepted
+
+    def close(self, timeout_s: float = CLOSE_TIMEOUT_S) -> bool:
+        '''
+        One last attempt at what is waiting, safe to call twice
+
+        Returns:
+            bool: True if nothing was left waiting
+        '''
+        if self.db is None:
+            return True
+        self.closing = True
+        self.flush()
+        deadline = monotonic() + timeout_s
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - monotonic()))
+        left = self.pending()
+        if left:
+            print(f"{left} results kept in the outbox for the next start")
+        if not any(thread.is_alive() for thread in self.threads): # Otherwise still stuck in a request, they die with the process
+            with self.lock:
+                self.db.close()
+                self.db = None
+        return left == 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
@@ -0,0 +1,397 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Platform geometry and grading without Qt, numpy only.
+
+Contact triangle, plane, parallelism and flatness for one platform (compute)
+or many at once (compute_batch), plus the grading rules (Grading.py) and the
+least squares / minimum zone / three point fits (Flatness.py) in one import.
+ParallelismChecker is the Qt adapter that emits these results as signals.
+Batch scripts and worker processes import this module so they never load
+PySide6 (test_scripts/core_import_check.py).
+
+Indicator layout, unit grid:
+    0 1 2   back row, y = 2
+    3 4 5   middle row, y = 1
+    6 7 8   front row, y = 0
+'''
+
+from itertools import combinations
+from typing import NamedTuple
+
+import numpy as np
+from numpy import array, cross, dot
+
+from Flatness import LEAST_SQUARES, METHODS, MINIMUM_ZONE, THREE_POINT, flatness, flatness_batch
+from Grading import BIASES, DATA_ERROR, FAIL, PASS, PASS_CRITERIA, GradeResult, grade
+from RestingPlane import grid_layout, resting_plane
+
+NO_READING = "--.---"
+BATCH_CHUNK_ROWS = 65536 # Rows per pass in compute_batch, keeps temporaries in cache
+
+POINTS_N_COORDINATES = {
+    0: [0, 2],
+    1: [1, 2],
+    2: [2, 2],
+    3: [0, 1],
+    4: [1, 1],
+    5: [2, 1],
+    6: [0, 0],
+    7: [1, 0],
+    8: [2, 0]
+}
+
+class ParallelismResult(NamedTuple):
+    points: dict       # {index: reading} of the contact triangle, p1, p2, p3
+    plane: tuple       # a, b, c, d of a x + b y + c z + d = 0
+    parallelism: float # mm, max - min of the readings
+    flatness: float    # mm, deepest reading below the plane
+
+class BatchResult(NamedTuple):
+    valid: np.ndarray       # (N,) bool, False where compute() reports DATA ERROR
+    points: np.ndarray      # (N, 3) contact triangle indexes p1, p2, p3, -1 when not valid
+    planes: np.ndarray      # (N, 4) a, b, c, d as compute_plane_equation, NaN when not valid
+    parallelism: np.ndarray # (N,) as compute_parallelism_value, NaN when not valid
+    flatness: np.ndarray    # (N,) as compute_flatness, NaN when not valid
+
+# compute_p3 weighs these two groups against each other in the balance case, keyed by the peak that is not the middle
+BALANCE_GROUPS = {
+    0: ([1, 2, 5], [3, 6, 7]),
+    8: ([1, 2, 5], [3, 6, 7]),
+    1: ([2, 5, 8], [0, 3, 6]),
+    7: ([2, 5, 8], [0, 3, 6]),
+    2: ([5, 7, 8], [0, 1, 3]),
+    6: ([5, 7, 8], [0, 1, 3]),
+    3: ([6, 7, 8], [0, 1, 2]),
+    5: ([6, 7, 8], [0, 1, 2])
+}
+
+def parse_readings(data: dict, current_data: dict = None) -> dict:
+    '''
+    Args:
+        data (dict): {index: "+1.234" or "--.---"} as sent by DataGetter
+        current_data (dict): Readings to update, a new dict if None
+
+    Returns:
+        dict: {index: mm or "--.---"}
+    '''
+    current_data = {} if current_data is None else current_data
+    for index, value in data.items():
+        if value == NO_READING:
+            current_data[index] = value
+            continue
+
+        number = value.replace('+', '')
+        current_data[index] = float(number)
+    return current_data
+
+def readings_data(readings: list) -> dict:
+    '''
+    Args:
+        readings (list): mm or None per indicator, eg SweepFrame.mm(BIASES)
+
+    Returns:
+        dict: {index: mm or "--.---"} for compute
+    '''
+    return {str(index): NO_READING if value is None else value for index, value in enumerate(readings)}
+
+def compute(current_data: dict) -> ParallelismResult:
+    '''
+    Args:
+        current_data (dict): {index: mm or "--.---"} for all 9 indicators
+
+    Returns:
+        ParallelismResult: None on a missing reading (DATA ERROR)
+
+    Raises:
+        IndexError: No p3 candidate keeps the centre inside the triangle
+    '''
+    if any(value == NO_READING for value in current_data.values()) or len(current_data.items()) != 9:
+        return None
+
+    sorted_dict_data = dict(sorted(current_data.items(), key=lambda item: item[1], reverse=True))
+    points = compute_contact_triangle_points(sorted_dict_data)
+    parallelism_value, plane_coeff = compute_parallelism_value(list(points.keys()), sorted_dict_data)
+    flatness_value = compute_flatness(sorted_dict_data, plane_coeff)
+    return ParallelismResult(points, plane_coeff, parallelism_value, flatness_value)
+
+# Returns dict of points and associated z values
+def compute_contact_triangle_points(sorted_dict_data: dict) -> dict:
+    # Highest peak is the largest number
+    p1 = list(sorted_dict_data.items())[0]
+    p1_index, p1_value = p1
+
+    p2_index, p2_value = compute_p2(sorted_dict_data, (int(p1_index), float(p1_value)))
+    p3_index, p3_value = compute_p3(sorted_dict_data, (int(p1_index), float(p1_value)), (int(p2_index), float(p2_value)))
+
+    return {
+        int(p1_index): float(p1_value),
+        int(p2_index): float(p2_value),
+        int(p3_index): float(p3_value)
+    }
+
+# Finds second point after simulating plane rotation and pressure
+# Handles quadrant average for middle case
+def compute_p2(sorted_dict_data: dict, p1: tuple) -> tuple:
+    p1_index, p1_value = p1
+
+    # Candidates after plane rotation, or the quadrant for a middle peak (contact_triangle_tables)
+    p2_candidates = GEOMETRY_TABLES["p2_candidates"][p1_index]
+
+    # Get values of p2 candidates
+    p2_candidates_index_n_values = {k: v for k, v in sorted_dict_data.items() if int(k) in p2_candidates}
+
+    # Get p2 index & value, from calculating the point with min distance from golden plane touching highest peak
+    p2_index = max(p2_candidates_index_n_values, key=p2_candidates_index_n_values.get)
+    p2_value = p2_candidates_index_n_values[p2_index]
+
+    return (p2_index, p2_value)
+
+def compute_p3(sorted_dict_data: dict, p1: tuple, p2: tuple) -> tuple:
+    p1_index, p1_value = p1
+    p2_index, p2_value = p2
+
+    # Candidates are looked up already narrowed to those keeping the centre inside the triangle (contact_triangle_tables)
+    balance_groups = GEOMETRY_TABLES["balance_groups"].get((p1_index, p2_index))
+    if balance_groups is not None: # Two peaks balancing case
+        group1, group2, group1_candidates, group2_candidates = balance_groups
+        group1_average = sum([sorted_dict_data[str(index)] for index in group1]) / 3
+        group2_average = sum([sorted_dict_data[str(index)] for index in group2]) / 3
+
+        p3_candidates = group1_candidates if group1_average > group2_average else group2_candidates
+
+    else: # Non balance case
+        p3_candidates = GEOMETRY_TABLES["p3_candidates"][(p1_index, p2_index)]
+
+    # Get values of p3 candidates
+    p3_candidates_index_n_values = {k: v for k, v in sorted_dict_data.items() if int(k) in p3_candidates}
+    sorted_p3_candidates = dict(sorted(p3_candidates_index_n_values.items(), key=lambda item: item[1], reverse=True))
+
+    p3_index, p3_value = list(sorted_p3_candidates.items())[0]
+
+    return (p3_index, p3_value)
+
+def centre_in_triangle(p1_index: int, p2_index: int, p3_index: int) -> bool:
+    return GEOMETRY_TABLES["centre_in_triangle"][tuple(sorted([p1_index, p2_index, p3_index]))]
+
+def convert_to_3d(point: tuple) -> tuple:
+    index, z = point
+    x, y = POINTS_N_COORDINATES[index]
+    return (x, y, z)
+
+def compute_plane_equation(p1: tuple, p2: tuple, p3: tuple) -> tuple:
+    p1 = array(p1)
+    p2 = array(p2)
+    p3 = array(p3)
+
+    # Calculate two vectors from the points
+    v1 = p2 - p1
+    v2 = p3 - p1
+
+    # Calculate the cross product of the two vectors to get the normal vector
+    normal_vector = cross(v1, v2)
+
+    # The coefficients a, b, and c of the plane equation
+    a, b, c = normal_vector
+
+    # Calculate d using the point p1
+    d = dot(normal_vector, p1)
+
+    return (round(a, 3), round(b, 3), round(c, 3), -round(d, 3))
+
+def plane_z(plane: tuple, x_val, y_val):
+    a, b, c, d = plane
+    return -(a * x_val + b * y_val + d) / c
+
+def compute_parallelism_value(indexes: list, sorted_dict_data: dict) -> tuple:
+    # Get plane from 3d coordinates of chosen peaks
+    p1_3d_coords = convert_to_3d((indexes[0], sorted_dict_data[str(indexes[0])]))
+    p2_3d_coords = convert_to_3d((indexes[1], sorted_dict_data[str(indexes[1])]))
+    p3_3d_coords = convert_to_3d((indexes[2], sorted_dict_data[str(indexes[2])]))
+
+    # Gets plane
+    a, b, c, d = compute_plane_equation(p1_3d_coords, p2_3d_coords, p3_3d_coords)
+
+    # Parallelism is the spread of the readings, the plane is kept for compute_flatness
+    max_key, max_value = max(sorted_dict_data.items(), key=lambda item: item[1])
+    min_key, min_value = min(sorted_dict_data.items(), key=lambda item: item[1])
+
+    return abs(max_value - min_value), (a, b, c, d)
+
+def compute_flatness(sorted_dict_data: dict, computed_plane: tuple) -> float:
+    # find the index with the lowest value, ie the deepest trough in the BP
+    # Compute z value of of same index x y coordinate, find difference
+    sorted_dict_data = dict(sorted(sorted_dict_data.items(), key=lambda item: item[1], reverse=False))
+
+    lowest_point = list(sorted_dict_data.items())[0]
+    index, lowest_z = lowest_point
+
+    equivalent_z = plane_z(computed_plane, POINTS_N_COORDINATES[int(index)][0], POINTS_N_COORDINATES[int(index)][1])
+
+    return abs(equivalent_z - lowest_z)
+
+def contact_triangle_tables(coordinates: dict = POINTS_N_COORDINATES) -> dict:
+    '''
+    Contact triangle geometry for every p1 and (p1, p2), the grid is fixed so
+    compute_p2 / compute_p3 and compute_batch only need lookups. Built once at
+    import (GEOMETRY_TABLES), a few ms.
+
+    Returns:
+        dict: Python lookups for the per platform functions
+                centre_in_triangle {(i, j, k) ascending: bool}, all 84 triangles
+                p2_candidates [frozenset] per p1
+                p3_candidates {(p1, p2): frozenset} when not balancing
+                balance_groups {(p1, p2): (group1, group2, group1 candidates, group2 candidates)}
+              numpy masks for compute_batch
+                p2 (9, 9), balance (9, 9), p3 / group_a_p3 / group_b_p3 (9, 9, 9), group_a / group_b indexes (9, 9, 3)
+    '''
+    count = len(coordinates)
+    x = np.array([coordinates[index][0] for index in range(count)])
+    y = np.array([coordinates[index][1] for index in range(count)])
+
+    def towards(positions, origin, target):
+        # Points past origin in the direction of target, none if already there
+        if target < origin:
+            return positions < origin
+        if target > origin:
+            return positions > origin
+        return np.zeros(count, dtype=bool)
+
+    def area(x1, y1, x2, y2, x3, y3):
+        return abs((x1*(y2-y3) + x2*(y3-y1) + x3*(y1-y2)) / 2.0)
+
+    def indexes(mask):
+        return frozenset(np.flatnonzero(mask).tolist())
+
+    def centre_in_triangle(p1, p2, p3):
+        if 4 in [p1, p2, p3]:
+            return True
+        full_area = area(x[p1], y[p1], x[p2], y[p2], x[p3], y[p3])
+        return full_area == (area(1, 1, x[p2], y[p2], x[p3], y[p3]) + area(x[p1], y[p1], 1, 1, x[p3], y[p3])
+                             + area(x[p1], y[p1], x[p2], y[p2], 1, 1))
+
+    tables = {
+        "p2": np.zeros((count, count), dtype=bool),
+        "balance": np.zeros((count, count), dtype=bool),
+        "p3": np.zeros((count, count, count), dtype=bool),
+        "group_a": np.zeros((count, count, 3), dtype=np.intp),
+        "group_b": np.zeros((count, count, 3), dtype=np.intp),
+        "group_a_p3": np.zeros((count, count, count), dtype=bool),
+        "group_b_p3": np.zeros((count, count, count), dtype=bool),
+        "centre_in_triangle": {triangle: centre_in_triangle(*triangle) for triangle in combinations(range(count), 3)},
+        "p3_candidates": {},
+        "balance_groups": {}
+    }
+
+    for p1 in range(count):
+        if p1 == 4:
+            # Middle peak, compute_p2 averages the quadrant indexes so always picks the same quadrant
+            quadrant_groups = {1: [1, 2, 5], 2: [0, 1, 3], 3: [3, 6, 7], 4: [5, 7, 8]}
+            quadrant = min(quadrant_groups, key=lambda key: sum(quadrant_groups[key]) / 3)
+            tables["p2"][p1, quadrant_groups[quadrant]] = True
+        else:
+            tables["p2"][p1] = towards(x, x[p1], 1) | towards(y, y[p1], 1)
+
+        for p2 in range(count):
+            if p2 == p1:
+                continue
+            midpoint_x = (x[p1] + x[p2]) / 2
+            midpoint_y = (y[p1] + y[p2]) / 2
+            inside = np.array([p3 not in [p1, p2] and tables["centre_in_triangle"][tuple(sorted([p1, p2, p3]))] for p3 in range(count)])
+
+            if (midpoint_x, midpoint_y) == (1, 1) or 4 in [p1, p2]:
+                group_a, group_b = BALANCE_GROUPS[p1 if p1 != 4 else p2]
+                tables["balance"][p1, p2] = True
+                tables["group_a"][p1, p2] = group_a
+                tables["group_b"][p1, p2] = group_b
+                tables["group_a_p3"][p1, p2, group_a] = True
+                tables["group_b_p3"][p1, p2, group_b] = True
+                tables["group_a_p3"][p1, p2] &= inside
+                tables["group_b_p3"][p1, p2] &= inside
+                tables["balance_groups"][p1, p2] = (tuple(group_a), tuple(group_b), indexes(tables["group_a_p3"][p1, p2]), indexes(tables["group_b_p3"][p1, p2]))
+            else:
+                candidates = towards(x, midpoint_x, 1) | towards(y, midpoint_y, 1)
+                candidates[[p1, p2]] = False
+                tables["p3"][p1, p2] = candidates & inside
+                tables["p3_candidates"][p1, p2] = indexes(tables["p3"][p1, p2])
+
+    tables["p2_candidates"] = [indexes(mask) for mask in tables["p2"]]
+    return tables
+
+GEOMETRY_TABLES = contact_triangle_tables()
+POINT_X = np.array([POINTS_N_COORDINATES[index][0] for index in range(9)], dtype=float)
+POINT_Y = np.array([POINTS_N_COORDINATES[index][1] for index in range(9)], dtype=float)
+
+def compute_batch(values, valid=None) -> BatchResult:
+    '''
+    compute over many platforms at once, row for row the same results as
+    compute_contact_triangle_points, compute_plane_equation,
+    compute_parallelism_value and compute_flatness. Ties go to the lowest
+    index, as they do through the sorted dicts.
+
+    Args:
+        values (array): (N, 9) readings, mm
+        valid (array): (N, 9) bool, False for "--.---". Defaults to the finite values
+
+    Returns:
+        BatchResult: Per row arrays, rows without 9 valid readings are not valid
+    '''
+    values = np.asarray(values, dtype=float)
+    valid = np.isfinite(values) if valid is None else np.asarray(valid, dtype=bool) & np.isfinite(values)
+    rows = len(values)
+
+    result = BatchResult(
+        valid=np.zeros(rows, dtype=bool),
+        points=np.full((rows, 3), -1, dtype=np.intp),
+        planes=np.full((rows, 4), np.nan),
+        parallelism=np.full(rows, np.nan),
+        flatness=np.full(rows, np.nan)
+    )
+    for start in range(0, rows, BATCH_CHUNK_ROWS):
+        end = min(start + BATCH_CHUNK_ROWS, rows)
+        compute_chunk(values[start:end], valid[start:end], result, start)
+    return result
+
+def compute_chunk(values, valid, result: BatchResult, start: int):
+    # Only rows with all 9 readings are graded
+    rows = np.flatnonzero(valid.all(axis=1))
+    values = values[rows]
+    tables = GEOMETRY_TABLES
+
+    # Contact triangle, highest candidate at each step
+    p1 = values.argmax(axis=1)
+    p2 = np.where(tables["p2"][p1], values, -np.inf).argmax(axis=1)
+
+    group_a = np.take_along_axis(values, tables["group_a"][p1, p2], axis=1)
+    group_b = np.take_along_axis(values, tables["group_b"][p1, p2], axis=1)
+    heavier_a = (group_a[:, 0] + group_a[:, 1] + group_a[:, 2]) / 3 > (group_b[:, 0] + group_b[:, 1] + group_b[:, 2]) / 3
+    p3_candidates = np.where(tables["balance"][p1, p2][:, None],
+                             np.where(heavier_a[:, None], tables["group_a_p3"][p1, p2], tables["group_b_p3"][p1, p2]),
+                             tables["p3"][p1, p2])
+    p3 = np.where(p3_candidates, values, -np.inf).argmax(axis=1)
+
+    # compute_p3 fails when no candidate surrounds the centre
+    found = p3_candidates.any(axis=1)
+    rows, values, p1, p2, p3 = rows[found], values[found], p1[found], p2[found], p3[found]
+    index = np.arange(len(rows))
+
+    # Plane through the three points, as compute_plane_equation
+    x1, y1, z1 = POINT_X[p1], POINT_Y[p1], values[index, p1]
+    v1 = np.stack((POINT_X[p2] - x1, POINT_Y[p2] - y1, values[index, p2] - z1), axis=1)
+    v2 = np.stack((POINT_X[p3] - x1, POINT_Y[p3] - y1, values[index, p3] - z1), axis=1)
+    normal = np.cross(v1, v2)
+    d = normal[:, 0] * x1 + normal[:, 1] * y1 + normal[:, 2] * z1
+    a, b, c = np.round(normal, 3).T
+    d = -np.round(d, 3)
+
+    # Flatness at the deepest point, as compute_flatness
+    lowest = values.argmin(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        equivalent_z = -(a * POINT_X[lowest] + b * POINT_Y[lowest] + d) / c
+
+    rows += start
+    result.valid[rows] = True
+    result.points[rows] = np.stack((p1, p2, p3), axis=1)
+    result.planes[rows] = np.stack((a, b, c, d), axis=1)
+    result.parallelism[rows] = np.abs(values.max(axis=1) - values.min(axis=1))
+    result.flatness[rows] = np.abs(equivalent_z - values[index, lowest])
@@ -0,0 +1,132 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Write-behind persistence for test results, so saving never waits on the
+disk or the network on the caller's thread.
+
+submit() only puts the record on a bounded queue. A writer thread appends it
+to the results CSV (ResultsWriter), adds it to the results database
+(ResultsStore.py) then commits it to the upload outbox (Outbox.py), which
+ships it to Google Sheets on its own thread and keeps it through
+network outages and restarts. Callbacks run on the writer thread, Qt code
+should connect them to signals so they arrive on the GUI thread (main.py).
+'''
+
+import sqlite3
+from queue import Empty, Full, Queue
+from threading import Thread
+
+from Results import ResultsWriter
+
+QUEUE_SIZE = 256 # Records waiting for the disk, submit() fails rather than blocks beyond this
+
+# Stage passed to on_failed
+QUEUE = "queue"
+LOCAL = "local"
+STORE = "store"
+OUTBOX = "outbox"
+
+class PersistenceWorker:
+    '''
+    Saves ResultRecords off the caller's thread, to the data file, results database and upload outbox
+
+    Args:
+        data_file (str): Results CSV
+        outbox (Outbox): Uploads to Google Sheets, None to only save locally
+        on_saved (callable): Called with the record once it is on disk and queued for upload
+        on_failed (callable): Called with (record, stage, message) when a stage fails
+        store (ResultsStore): Results database, None for the CSV only
+    '''
+
+    def __init__(self, data_file: str, outbox=None, on_saved=None, on_failed=None, queue_size: int = QUEUE_SIZE, store=None):
+        self.outbox = outbox
+        self.store = store
+        self.on_saved = on_saved
+        self.on_failed = on_failed
+        self.writer = ResultsWriter(data_file)
+
+        self.queue = Queue(queue_size)
+        self.closed = False
+
+        self.write_thread = Thread(target=self.write_records, name="results-writer", daemon=True)
+        self.write_thread.start()
+
+    def submit(self, record) -> bool:
+        '''
+        Queue a record to be saved, never blocks
+
+        Returns:
+            bool: False if the queue is full or the worker is closed, on_failed has been called
+        '''
+        if self.closed:
+            self.failed(record, QUEUE, "Persistence worker closed")
+            return False
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.failed(record, QUEUE, f"{self.queue.maxsize} results already waiting to be saved")
+            return False
+        return True
+
+    def pending(self) -> int:
+        # Records not yet written locally
+        return self.queue.qsize()
+
+    def write_records(self):
+        while True:
+            # Wake up now and then so the last rows of a quiet spell get fsynced
+            try:
+                record = self.queue.get(timeout=self.writer.sync_interval_s)
+            except Empty:
+                self.writer.sync_if_due()
+                continue
+            if record is None:
+                break
+
+            try:
+                self.writer.append(record)
+            except OSError as error:
+                self.failed(record, LOCAL, str(error))
+                continue
+
+            # The CSV has it, carry on to the upload when the database fails
+            stored = True
+            if self.store is not None:
+                try:
+                    self.store.add(record)
+                except sqlite3.Error as error:
+                    self.failed(record, STORE, f"in {self.writer.data_file} but not the results database, {error}")
+                    stored = False
+
+            if self.outbox is not None:
+                try:
+                    self.outbox.add(record)
+                except sqlite3.Error as error:
+                    self.failed(record, OUTBOX, f"saved locally only, {error}")
+                    continue
+            if stored:
+                self.saved(record)
+
+        self.writer.close()
+
+    def saved(self, record):
+        if self.on_saved is not None:
+            self.on_saved(record)
+
+    def failed(self, record, stage: str, message: str):
+        print(f"Result {record.platform_id}: {stage} save failed, {message}")
+        if self.on_failed is not None:
+            self.on_failed(record, stage, message)
+
+    def close(self):
+        # Write everything queued, safe to call twice. The outbox and store are closed by their owners
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None) # Behind everything already submitted
+        self.write_thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
@@ -0,0 +1,204 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Shared serial port discovery for the indicator controller and QR scanner.
+
+Each port is identified by VID:PID + serial number (or its /dev/serial/by-id
+link when the device has no serial), which stays the same when the device
+moves between ttyACM0/ttyACM1. The identity that last worked for each role
+is saved to disk, so on startup and reconnect a known device is opened
+straight away instead of being probed again.
+'''
+
+import json
+from os import environ, listdir, path, replace
+from threading import Lock
+from typing import NamedTuple
+
+BY_ID_DIR = "/dev/serial/by-id"
+
+# Pin a role to a device path, eg a pty from test_scripts/serial_simulator.py
+PORT_OVERRIDE_ENV = {
+    "controller": "PPQC_CONTROLLER_PORT",
+    "scanner": "PPQC_SCANNER_PORT"
+}
+
+# Indicator controller, CH343 USB serial bridge
+CONTROLLER_DESCRIPTIONS = ["USB Single Serial", "USB-Enhanced-SERIAL CH343"]
+CONTROLLER_MANUFACTURERS = ["1a86", "wch.cn"]
+
+# Barcode scanner, still needs probing to confirm
+SCANNER_DESCRIPTIONS = ["USB Serial Device", "USB Single Serial", "USBKey Module"]
+
+class PortIdentity(NamedTuple):
+    port_name: str          # eg "ttyACM0"
+    vendor_id: str = ""     # 4 digit hex, eg "1a86"
+    product_id: str = ""
+    serial_number: str = ""
+    by_id: str = ""         # /dev/serial/by-id link, if any
+    description: str = ""
+    manufacturer: str = ""
+
+    @property
+    def key(self) -> str:
+        # Stable across re-enumeration, port_name only as a last resort
+        if self.vendor_id and self.serial_number:
+            return f"{self.vendor_id}:{self.product_id}:{self.serial_number}"
+        if self.by_id:
+            return self.by_id
+        return f"{self.vendor_id}:{self.product_id}@{self.port_name}"
+
+def is_controller(identity: PortIdentity) -> bool:
+    return identity.description in CONTROLLER_DESCRIPTIONS and (identity.manufacturer in CONTROLLER_MANUFACTURERS or identity.vendor_id == "1a86")
+
+def is_scanner_candidate(identity: PortIdentity) -> bool:
+    return identity.description in SCANNER_DESCRIPTIONS and not is_controller(identity)
+
+def read_by_id_links() -> dict:
+    '''
+    Returns:
+        dict: port name -> /dev/serial/by-id link
+    '''
+    try:
+        names = listdir(BY_ID_DIR)
+    except OSError:
+        return {}
+
+    links = {}
+    for name in names:
+        link = path.join(BY_ID_DIR, name)
+        links[path.basename(path.realpath(link))] = link
+    return links
+
+def identity_from_port_info(info, by_id_links: dict = None) -> PortIdentity:
+    '''
+    Build an identity from a QSerialPortInfo (duck typed, no Qt import here)
+    '''
+    by_id_links = read_by_id_links() if by_id_links is None else by_id_links
+    return PortIdentity(
+        port_name=info.portName(),
+        vendor_id=f"{info.vendorIdentifier():04x}" if info.hasVendorIdentifier() else "",
+        product_id=f"{info.productIdentifier():04x}" if info.hasProductIdentifier() else "",
+        serial_number=info.serialNumber(),
+        by_id=by_id_links.get(info.portName(), ""),
+        description=info.description(),
+        manufacturer=info.manufacturer()
+    )
+
+def identity_from_uevent(port_name: str, properties: dict) -> PortIdentity:
+    '''
+    Build an identity from udev properties of a hotplug event
+    '''
+    by_id = next((link for link in properties.get("DEVLINKS", "").split() if link.startswith(BY_ID_DIR)), "")
+    return PortIdentity(
+        port_name=port_name,
+        vendor_id=properties.get("ID_VENDOR_ID", ""),
+        product_id=properties.get("ID_MODEL_ID", ""),
+        serial_number=properties.get("ID_SERIAL_SHORT", ""),
+        by_id=by_id,
+        description=properties.get("ID_MODEL", "").replace("_", " "),
+        manufacturer=properties.get("ID_VENDOR", "").replace("_", " ")
+    )
+
+class PortDiscovery:
+    '''
+    Present ports and remembered roles ("controller", "scanner"), shared between
+    the data and scanner threads
+    '''
+
+    def __init__(self, cache_file: str = None):
+        self.cache_file = cache_file
+        self.lock = Lock()
+
+        self.present = {}   # port name -> PortIdentity
+        self.by_key = {}    # identity key -> PortIdentity
+        self.roles = {}     # role -> identity key
+
+        self.load()
+
+    def load(self):
+        if self.cache_file is None or not path.isfile(self.cache_file):
+            return
+        try:
+            with open(self.cache_file) as file:
+                self.roles = {role: str(key) for role, key in json.load(file).items()}
+        except (OSError, ValueError, AttributeError) as error:
+            print(f"Ignoring port cache {self.cache_file}: {error}")
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        # Write then rename, a crash never leaves a half written cache
+        temp_file = f"{self.cache_file}.tmp"
+        try:
+            with open(temp_file, "w") as file:
+                json.dump(self.roles, file, indent=4)
+            replace(temp_file, self.cache_file)
+        except OSError as error:
+            print(f"Failed to save port cache: {error}")
+
+    def refresh(self, port_infos: list):
+        '''
+        Replace the present ports with a fresh enumeration (QSerialPortInfo.availablePorts())
+        '''
+        by_id_links = read_by_id_links()
+        identities = [identity_from_port_info(info, by_id_links) for info in port_infos]
+        with self.lock:
+            self.present = {identity.port_name: identity for identity in identities}
+            self.by_key = {identity.key: identity for identity in identities}
+
+    def add(self, identity: PortIdentity):
+        with self.lock:
+            self.present[identity.port_name] = identity
+            self.by_key[identity.key] = identity
+
+    def remove(self, port_name: str):
+        with self.lock:
+            identity = self.present.pop(port_name, None)
+            if identity is not None:
+                self.by_key.pop(identity.key, None)
+
+    def get(self, port_name: str):
+        with self.lock:
+            return self.present.get(port_name)
+
+    def lookup(self, role: str):
+        '''
+        Returns:
+            PortIdentity | None: Present port last confirmed for this role
+        '''
+        override = environ.get(PORT_OVERRIDE_ENV.get(role, ""))
+        if override:
+            return PortIdentity(port_name=override)
+
+        with self.lock:
+            key = self.roles.get(role)
+            return None if key is None else self.by_key.get(key)
+
+    def role_of(self, identity: PortIdentity):
+        with self.lock:
+            return next((role for role, key in self.roles.items() if key == identity.key), None)
+
+    def remember(self, role: str, identity: PortIdentity):
+        if environ.get(PORT_OVERRIDE_ENV.get(role, "")):
+            return # Pinned, nothing to learn
+
+        with self.lock:
+            if self.roles.get(role) == identity.key:
+                return
+            self.roles[role] = identity.key
+        self.save()
+
+    def forget(self, role: str):
+        with self.lock:
+            if self.roles.pop(role, None) is None:
+                return
+        self.save()
+
+    def candidates(self, match) -> list:
+        '''
+        Present ports accepted by match(identity), skipping ports already known to be another role
+        '''
+        with self.lock:
+            known = set(self.roles.values())
+            return [identity for identity in self.present.values() if match(identity) and identity.key not in known]
@@ -1,6 +1,103 @@
-from requests import post
+import socket
+from collections import deque
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from requests import Session
+from requests.adapters import HTTPAdapter
 
 DEPLOYED_SHEET_URL = "https://script.google.com/macros/s/AKfycbwcem4Ihq-y3vkVZcbr7d9SAHY2lYP519-2VOddnl1f6PilMSekuXqvHu8o-i41LPEF/exec"
+POST_TIMEOUT_S = (5.0, 30.0) # Connect, read
+MAX_IN_FLIGHT = 4            # Requests at once per uploader, also the number of pooled connections
+LATENCY_WINDOW = 1000        # Most recent request latencies kept for the percentiles
+REACHABLE_TIMEOUT_S = 2.0    # Connect only, for sheet_reachable
+
+# Apps Script answers 200 with this page when doPost throws, nothing was appended
+SCRIPT_ERROR_PAGE = "<title>Error</title>"
+BATCH_ACCEPTED = {"result": "success"} # post_rows needs this body back before a batch counts as appended
+
+def script_failed(response) -> bool:
+    # 200 from the script is not enough, the body says whether doPost got through
+    if SCRIPT_ERROR_PAGE in response.text:
+        return True
+    try:
+        answer = response.json()
+    except ValueError:
+        return False # Plain text or empty, nothing says it failed
+    return isinstance(answer, dict) and answer.get("result") == "error"
+
+def batch_accepted(response) -> bool:
+    try:
+        return response.json() == BATCH_ACCEPTED
+    except ValueError:
+        return False
+
+class SheetUploader:
+    '''
+    Posts to the sheet script over a pooled keep-alive session, so only the
+    first request pays for the TCP connection and TLS handshake, and the
+    Google redirect reuses it too. Safe to share between threads, at most
+    max_in_flight requests run at once and the rest wait for a connection.
+    '''
+
+    def __init__(self, url: str = DEPLOYED_SHEET_URL, max_in_flight: int = MAX_IN_FLIGHT, timeout=POST_TIMEOUT_S):
+        self.url = url
+        self.timeout = timeout
+        self.slots = BoundedSemaphore(max_in_flight)
+
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max_in_flight) # Script and redirect hosts
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.lock = Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW) # Seconds per request, redirect included
+
+    def post_json(self, json_data: dict, timeout=None) -> bool:
+        '''
+        Returns:
+            bool: True if the sheet answered 200 without a script error, raises on connection errors and timeouts
+        '''
+        response = self.post(json_data, timeout)
+        return response.status_code == 200 and not script_failed(response)
+
+    def post_rows(self, rows: list, timeout=None) -> bool:
+        # Only a script that knows {"rows": [...]} answers BATCH_ACCEPTED, anything else keeps the rows for a retry
+        response = self.post({"rows": rows}, timeout)
+        return response.status_code == 200 and batch_accepted(response)
+
+    def post(self, json_data: dict, timeout=None):
+        with self.slots:
+            start = perf_counter()
+            response = self.session.post(self.url, json=json_data, timeout=timeout or self.timeout)
+            elapsed = perf_counter() - start
+        with self.lock:
+            self.latencies.append(elapsed)
+        return response
+
+    def latency_percentiles(self, percentiles: tuple = (50, 90, 99)) -> dict:
+        '''
+        Returns:
+            dict: Milliseconds per percentile over the last LATENCY_WINDOW requests, empty before the first
+        '''
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {}
+        return {percentile: latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)] * 1000 for percentile in percentiles}
+
+    def close(self):
+        self.session.close()
+
+uploaders = {} # One per url, shared by the module functions
+uploaders_lock = Lock()
+
+def uploader_for(url: str = DEPLOYED_SHEET_URL) -> SheetUploader:
+    with uploaders_lock:
+        if url not in uploaders:
+            uploaders[url] = SheetUploader(url)
+        return uploaders[url]
 
 def post_to_google_sheets(json_data: dict) -> bool:
     '''
@@ -9,9 +106,53 @@ def post_to_google_sheets(json_data: dict) -> bool:
     Args:
         json_data (dict): Data to post
 
-    eturns:
+    Returns:
         bool: True if successful, False otherwise
     '''
-    response = post(DEPLOYED_SHEET_URL, json=json_data)
+    return uploader_for().post_json(json_data)
 
-    return response.status_code == 200
\ No newline at end of file
+def post_each(rows: list, url: str = DEPLOYED_SHEET_URL, timeout=POST_TIMEOUT_S) -> bool:
+    '''
+    Post results one request each, in the to_json() body the deployed script
+    takes (post_to_google_sheets). The outbox idempotency key is left out, that
+    script does not know it.
+
+    Args:
+        rows (list): to_json() bodies, with or without an "id"
+
+    Returns:
+        bool: True if every row was accepted, stops at the first refusal. Raises on connection errors and timeouts
+    '''
+    uploader = uploader_for(url)
+    return all(uploader.post_json({key: value for key, value in row.items() if key != "id"}, timeout) for row in rows)
+
+def post_rows(rows: list, url: str = DEPLOYED_SHEET_URL, timeout=POST_TIMEOUT_S) -> bool:
+    '''
+    Post a batch of results in one request, as {"rows": [...]}
+
+    Needs a sheet script that appends every row, skips ids it already holds so
+    a retried batch is never doubled, and answers {"result": "success"}. The
+    deployed script does not yet, see Outbox.BATCH_UPLOADS.
+
+    Args:
+        rows (list): to_json() bodies with an "id" each (Outbox.py)
+
+    Returns:
+        bool: True if the script confirmed the batch, raises on connection errors and timeouts
+    '''
+    return uploader_for(url).post_rows(rows, timeout)
+
+def sheet_reachable(url: str = DEPLOYED_SHEET_URL, timeout_s: float = REACHABLE_TIMEOUT_S) -> bool:
+    '''
+    Cheap check that the network is back: a TCP connect to the script host,
+    no request, nothing appended. The outbox probes with it while backing off.
+
+    Returns:
+        bool: True if the host accepted a connection
+    '''
+    parts = urlsplit(url)
+    try:
+        with socket.create_connection((parts.hostname, parts.port or (443 if parts.scheme == "https" else 80)), timeout_s):
+            return True
+    except OSError: # Refused, unreachable, timed out or no DNS
+        return False
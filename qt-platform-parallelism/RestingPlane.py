@@ -0,0 +1,189 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Plane a platform rests on, for any indicator layout.
+
+A rigid platform lying on the indicators rests on the facet of the upper
+convex hull of the readings (x, y, height) that its centre of mass projects
+into. Every reading is on or below that plane, and of all such planes it is
+the highest above the centre. As a linear program over indicator weights:
+
+    maximise  sum(w_i * z_i)
+    with      w_i >= 0, sum(w_i) = 1, sum(w_i * (x_i, y_i)) = centre
+
+Basic solutions are triangles of indicators around the centre, w being the
+share of the platform's weight each contact carries. The solver starts from
+a triangle picked by angle around the centre (sort, O(n log n)) and pivots
+the reading furthest above the current plane in while keeping the centre
+inside the triangle (O(n) each), as the platform rocks onto its next contact.
+Dense grids settle in a handful of pivots (test_scripts/resting_plane_benchmark.py).
+
+When the centre sits right over a contact or edge (a 3x3 grid's middle
+indicator) several facets touch it and the platform is balanced. It is taken
+to tip towards its higher side (the least squares slope), as
+ParallelismCore's balance cases do, by nudging the centre TIP_FRACTION of
+the layout that way (tip_offset). The nudge is skewed slightly so it never
+runs along a line of indicators and leaves the tie in place.
+
+Coordinates and heights in mm.
+'''
+
+from math import pi
+from typing import NamedTuple
+
+import numpy as np
+
+TOLERANCE_MM = 1e-9 # Well below the 1 um indicator resolution
+MAX_PIVOTS = 1000
+TIP_FRACTION = 1e-5 # Of the layout size, breaks ties between facets touching the centre
+TIP_SKEW = (0.0054, 0.0084) # Added to the unit tip direction, 1e-2 at 1 radian
+
+class RestingPlane(NamedTuple):
+    points: tuple        # Indicator indexes of the contact triangle, highest reading first
+    weights: tuple       # Share of the platform's weight on each contact, sums to 1
+    coefficients: tuple  # a, b, c of z = a * x + b * y + c
+    centre_height: float # Plane height above the centre
+    pivots: int          # Triangles tried after the first
+
+def grid_layout(rows: int, columns: int, pitch_x: float = 1.0, pitch_y: float = 1.0) -> np.ndarray:
+    '''
+    Indicator positions of a regular grid, back row first and left to right
+    viewed from the front, as Grading.py numbers them. grid_layout(3, 3) is
+    ParallelismCore.POINTS_N_COORDINATES.
+
+    Returns:
+        ndarray: (rows * columns, 2) x, y, mm
+    '''
+    x = np.tile(np.arange(columns) * pitch_x, rows)
+    y = np.repeat(np.arange(rows - 1, -1, -1) * pitch_y, columns)
+    return np.column_stack((x, y)).astype(float)
+
+def tip_offset(slopes, size: float) -> np.ndarray:
+    '''
+    Args:
+        slopes (array): (..., 2) least squares a, b, uphill
+        size (float): Largest extent of the layout
+
+    Returns:
+        ndarray: (..., 2) nudge of the centre for balanced platforms
+    '''
+    slopes = np.asarray(slopes, dtype=float)
+    length = np.hypot(slopes[..., 0], slopes[..., 1])[..., None]
+    direction = np.divide(slopes, length, out=np.zeros_like(slopes), where=length > 0)
+    return (direction + TIP_SKEW) * size * TIP_FRACTION
+
+def plane_heights(plane: RestingPlane, coordinates) -> np.ndarray:
+    '''
+    Returns:
+        ndarray: Height of the plane over each (x, y)
+    '''
+    a, b, c = plane.coefficients
+    coordinates = np.asarray(coordinates, dtype=float)
+    return a * coordinates[:, 0] + b * coordinates[:, 1] + c
+
+def resting_plane(coordinates, heights, centre=None, tolerance: float = TOLERANCE_MM) -> RestingPlane:
+    '''
+    Args:
+        coordinates (array): (n, 2) indicator x, y
+        heights (array): (n,) readings, NaN for no reading
+        centre (tuple): Platform centre of mass x, y. Defaults to the middle of the layout
+
+    Returns:
+        RestingPlane: Contact triangle and plane
+
+    Raises:
+        ValueError: The centre is not inside the indicators with a reading
+    '''
+    coordinates = np.asarray(coordinates, dtype=float)
+    heights = np.asarray(heights, dtype=float)
+    centre = true_centre = coordinates.mean(axis=0) if centre is None else np.asarray(centre, dtype=float)
+
+    # Missing readings take no part, indexes are mapped back at the end
+    present = np.flatnonzero(np.isfinite(heights))
+    z = heights[present]
+    columns = np.column_stack((coordinates[present], np.ones(len(present)))) # x, y, 1
+
+    # Balanced platforms tip towards the higher side
+    slope = np.linalg.lstsq(columns, z, rcond=None)[0][:2]
+    centre = centre + tip_offset(slope, np.ptp(coordinates, axis=0).max())
+    target = np.array([centre[0], centre[1], 1.0])
+
+    basis = initial_triangle(coordinates[present], z, centre, tolerance)
+    bland = False # Lowest index rules after a pivot that went nowhere, so pivots cannot cycle
+    for pivots in range(MAX_PIVOTS):
+        triangle = columns[basis]
+        coefficients = np.linalg.solve(triangle, z[basis])
+        weights = np.linalg.solve(triangle.T, target)
+
+        # Readings above the plane would hold the platform higher over the centre
+        above = z - columns @ coefficients
+        above[basis] = 0.0
+        rising = np.flatnonzero(above > tolerance)
+        if len(rising) == 0:
+            break
+        entering = rising[0] if bland else rising[np.argmax(above[rising])]
+
+        # Contact to lift off, the centre must stay inside the new triangle
+        share = np.linalg.solve(triangle.T, columns[entering])
+        candidates = np.flatnonzero(share > tolerance)
+        ratios = weights[candidates] / share[candidates]
+        smallest = ratios.min()
+        tied = candidates[ratios <= smallest + tolerance]
+        leaving = tied[np.argmin(basis[tied])]
+
+        bland = smallest <= tolerance
+        basis[leaving] = entering
+    else:
+        raise RuntimeError(f"No resting plane after {MAX_PIVOTS} pivots")
+
+    # Weights and height over the true centre
+    target[:2] -= centre - true_centre
+    weights = np.linalg.solve(columns[basis].T, target)
+
+    order = np.argsort(-z[basis], kind="stable")
+    return RestingPlane(
+        points=tuple(int(present[index]) for index in basis[order]),
+        weights=tuple(float(weight) for weight in weights[order]),
+        coefficients=tuple(float(value) for value in coefficients),
+        centre_height=float(target @ coefficients),
+        pivots=pivots
+    )
+
+def initial_triangle(coordinates: np.ndarray, heights: np.ndarray, centre: np.ndarray, tolerance: float) -> np.ndarray:
+    '''
+    Three indicators around the centre, starting from the highest reading
+
+    Returns:
+        ndarray: Indexes into coordinates
+    '''
+    offsets = coordinates - centre
+    around = np.flatnonzero(np.hypot(offsets[:, 0], offsets[:, 1]) > tolerance) # Not right under the centre
+    if len(around) < 3:
+        raise ValueError("Need three readings around the platform centre")
+
+    first = around[np.argmax(heights[around])]
+    angles = np.arctan2(offsets[around, 1], offsets[around, 0])
+    angles = (angles - np.arctan2(offsets[first, 1], offsets[first, 0])) % (2 * pi)
+    order = np.argsort(angles, kind="stable")
+    angles = angles[order]
+    around = around[order]
+
+    # Readings all to one side, the platform would tip off them
+    if np.max(np.diff(angles, append=2 * pi)) > pi + tolerance:
+        raise ValueError("Platform centre is outside the indicators with readings")
+
+    # Furthest round within half a turn of the first, then the next one past it
+    last = np.searchsorted(angles, pi + tolerance, side="right") - 1
+    if last + 1 < len(angles):
+        triangle = np.array([first, around[last], around[last + 1]])
+    else:
+        # Centre on the edge of the layout, any reading off the line through it
+        off_line = np.flatnonzero((angles > tolerance) & (angles < pi - tolerance))
+        if len(off_line) == 0:
+            raise ValueError("Indicators with readings are all on one line")
+        triangle = np.array([first, around[last], around[off_line[0]]])
+
+    area = np.linalg.det(np.column_stack((coordinates[triangle], np.ones(3))))
+    if abs(area) <= tolerance:
+        raise ValueError("Indicators with readings are all on one line")
+    return triangle
@@ -0,0 +1,194 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Test result records and their CSV / Google Sheets forms, without Qt or pandas.
+
+ResultsWriter appends rows to the results CSV without reading it back, so a
+save costs the same at any history length (test_scripts/results_benchmark.py).
+Each row goes down in one write() on an O_APPEND descriptor and rows are
+fsynced in batches. A new file gets its header through a temporary file and
+rename, and a line cut short by a crash is dropped when the file is next
+opened, so the file always reads as whole rows.
+'''
+
+import csv
+import io
+import os
+from datetime import datetime
+from os import path
+from threading import Lock
+from time import monotonic
+from typing import NamedTuple
+
+from Grading import GradeResult
+
+DATE_FORMAT = "%H:%M - %d/%m/%Y"
+COLUMNS = ["Date", "PlatformID", "Grade", "MaxMin", "P0", "P1", "P2", "P3", "P4", "P5", "P6", "P7", "P8"]
+
+SYNC_ROWS = 8         # fsync once this many rows are pending
+SYNC_INTERVAL_S = 1.0 # or once the oldest pending row is this old, see ResultsWriter.sync_if_due
+RECOVERY_SCAN_BYTES = 64 * 1024 # Tail read when looking for the last complete row
+
+class ResultRecord(NamedTuple):
+    date: str
+    platform_id: str
+    grade: str
+    max_min: str
+    points: tuple       # 9 strings, "--.---" for no reading
+    station: str = ""   # Jig that tested it, when one host runs several
+    tested_s: float = 0.0 # Epoch seconds, date is only to the minute
+
+def make_record(platform_id: str, result: GradeResult, readings: list, when: datetime = None, station: str = "") -> ResultRecord:
+    '''
+    Args:
+        readings (list): Biased mm per indicator, None for no reading (Grading.apply_bias)
+    '''
+    points = tuple("--.---" if value is None else f"{value}" for value in readings) if readings else ("-",) * 9
+    when = when or datetime.now()
+    return ResultRecord(
+        date=when.strftime(DATE_FORMAT),
+        platform_id=platform_id.strip(),
+        grade=result.grade,
+        max_min="" if result.max_min is None else f"{result.max_min}",
+        points=points,
+        station=station,
+        tested_s=when.timestamp()
+    )
+
+def csv_row(record: ResultRecord) -> bytes:
+    # Columns by position, as COLUMNS
+    line = io.StringIO()
+    csv.writer(line).writerow([record.date, record.platform_id, record.grade, record.max_min, *record.points])
+    return line.getvalue().encode()
+
+def append_csv(data_file: str, record: ResultRecord):
+    # One off append, keep a ResultsWriter open for repeated saves
+    with ResultsWriter(data_file, sync_rows=1) as writer:
+        writer.append(record)
+
+class ResultsWriter:
+    '''
+    Append-only results CSV, one per data file. Safe to share between threads
+    '''
+
+    def __init__(self, data_file: str, columns: list = COLUMNS, sync_rows: int = SYNC_ROWS, sync_interval_s: float = SYNC_INTERVAL_S):
+        self.data_file = data_file
+        self.sync_rows = sync_rows
+        self.sync_interval_s = sync_interval_s
+        self.pending = 0             # Rows written since the last fsync
+        self.pending_since = None    # monotonic() of the oldest of them
+        self.recovered_bytes = 0     # Partial row dropped on open
+        self.lock = Lock()
+
+        if path.isfile(data_file):
+            self.recovered_bytes = self.recover()
+            if self.recovered_bytes:
+                print(f"{data_file}: dropped {self.recovered_bytes} bytes of a partly written row")
+        if not path.isfile(data_file) or path.getsize(data_file) == 0: # New, or only a partial header
+            self.create(columns)
+        self.fd = os.open(data_file, os.O_WRONLY | os.O_APPEND)
+
+    def create(self, columns: list):
+        # Header to a temporary file first, the data file appears complete or not at all
+        temporary = f"{self.data_file}.tmp"
+        line = io.StringIO()
+        csv.writer(line).writerow(columns)
+        with open(temporary, "wb") as file:
+            file.write(line.getvalue().encode())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.data_file)
+        sync_directory(self.data_file)
+
+    def recover(self) -> int:
+        '''
+        Cut the file back to its last newline
+
+        Returns:
+            int: Bytes dropped
+        '''
+        with open(self.data_file, "r+b") as file:
+            size = file.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - RECOVERY_SCAN_BYTES)
+                file.seek(start)
+                newline = file.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end == size:
+                return 0
+            file.truncate(end)
+            file.flush()
+            os.fsync(file.fileno())
+            return size - end
+
+    def append(self, record: ResultRecord):
+        # Whole row in one write, a crash leaves at most one partial row at the end
+        row = csv_row(record)
+        with self.lock:
+            os.write(self.fd, row)
+            if self.pending == 0:
+                self.pending_since = monotonic()
+            self.pending += 1
+            due = self.pending >= self.sync_rows or monotonic() - self.pending_since >= self.sync_interval_s
+            if due:
+                self.sync_pending()
+
+    def sync_if_due(self):
+        # Call now and then (eg a UI timer) so a quiet station still gets its last rows to disk
+        with self.lock:
+            if self.pending and monotonic() - self.pending_since >= self.sync_interval_s:
+                self.sync_pending()
+
+    def sync(self):
+        with self.lock:
+            self.sync_pending()
+
+    def sync_pending(self):
+        if self.pending and self.fd is not None:
+            os.fsync(self.fd)
+            self.pending = 0
+            self.pending_since = None
+
+    def close(self):
+        with self.lock:
+            if self.fd is None:
+                return
+            self.sync_pending()
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+def sync_directory(file_name: str):
+    # The rename is only durable once the directory entry is
+    try:
+        fd = os.open(path.dirname(path.abspath(file_name)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def to_json(record: ResultRecord) -> dict:
+    # Body expected by the Google Sheets script
+    json_data = {
+        "date": record.date,
+        "platform_id": record.platform_id,
+        "grade": record.grade,
+        "maxmin": record.max_min,
+        "data_points": {str(index): point for index, point in enumerate(record.points)}
+    }
+    if record.station:
+        json_data["station"] = record.station
+    return json_data
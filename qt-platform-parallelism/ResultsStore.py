@@ -0,0 +1,318 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Indexed SQLite store of test results, for questions the CSV can only answer
+with a full scan: every test of one platform, yield over a week.
+
+One row per test with the time as epoch seconds (indexed, with an ISO 8601
+UTC copy that sorts the same for people reading the table), readings and
+max - min as integer microns, NULL for no reading. WAL mode, so the GUI and
+scripts can read while the jig writes. data.csv stays as the plain text
+copy, import_csv() loads an existing one.
+
+Usage:
+    python3 ResultsStore.py --import data.csv
+    python3 ResultsStore.py --platform PN00001234
+    python3 ResultsStore.py --week [--station A]
+'''
+
+import argparse
+import csv
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from os import path
+from threading import Lock
+from time import time
+from typing import NamedTuple
+
+from Grading import DATA_ERROR, FAIL, PASS
+from Results import DATE_FORMAT
+
+RESULTS_DB = "results.db"
+INDICATORS = 9
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    tested_s REAL NOT NULL,
+    tested_at TEXT NOT NULL,
+    platform_id TEXT NOT NULL,
+    grade TEXT NOT NULL,
+    max_min_um INTEGER,
+    station TEXT NOT NULL DEFAULT '',
+    {", ".join(f"p{index}_um INTEGER" for index in range(INDICATORS))}
+);
+CREATE INDEX IF NOT EXISTS results_platform ON results (platform_id, tested_s);
+CREATE INDEX IF NOT EXISTS results_tested ON results (tested_s);
+CREATE TABLE IF NOT EXISTS imports (
+    file TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    imported_s REAL NOT NULL
+);
+"""
+
+COLUMNS = ["tested_s", "tested_at", "platform_id", "grade", "max_min_um", "station"] + [f"p{index}_um" for index in range(INDICATORS)]
+INSERT = f"INSERT INTO results ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+SELECT = f"SELECT id, {', '.join(COLUMNS)} FROM results"
+
+class StoredResult(NamedTuple):
+    id: int
+    tested_s: float
+    platform_id: str
+    grade: str
+    max_min_um: int     # None for a DATA ERROR
+    station: str
+    readings_um: tuple  # Biased microns per indicator, None for no reading
+
+    def tested_at(self) -> datetime:
+        return datetime.fromtimestamp(self.tested_s)
+
+class YieldSummary(NamedTuple):
+    tested: int
+    passed: int
+    failed: int
+    data_errors: int
+
+    def pass_rate(self):
+        '''
+        Returns:
+            float | None: PASS / (PASS + FAIL), None before any graded test
+        '''
+        graded = self.passed + self.failed
+        return self.passed / graded if graded else None
+
+def microns(text: str):
+    # "1.509" mm -> 1509, "--.---", "-" and "" -> None
+    try:
+        return round(float(text) * 1000)
+    except (TypeError, ValueError):
+        return None
+
+def iso_utc(tested_s: float) -> str:
+    return datetime.fromtimestamp(tested_s, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def row_values(tested_s: float, platform_id: str, grade: str, max_min: str, station: str, points) -> tuple:
+    return (tested_s, iso_utc(tested_s), platform_id, grade, microns(max_min), station, *(microns(point) for point in points))
+
+def stored_result(row) -> StoredResult:
+    return StoredResult(row[0], row[1], row[3], row[4], row[5], row[6], tuple(row[7:]))
+
+def week_start_s(when: datetime = None) -> float:
+    # Monday 00:00 local time of the week containing when
+    when = when or datetime.now()
+    monday = (when - timedelta(days=when.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    return monday.timestamp()
+
+class ResultsStore:
+    '''
+    Results database, safe to share between threads
+    '''
+
+    def __init__(self, db_file: str = RESULTS_DB):
+        self.db_file = db_file
+        self.lock = Lock()
+        self.db = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL") # data.csv and the outbox hold the durable copies
+        self.db.executescript(SCHEMA)
+
+    def add(self, record) -> int:
+        '''
+        Args:
+            record (ResultRecord): From Results.make_record
+
+        Returns:
+            int: Row id
+        '''
+        values = row_values(record.tested_s or time(), record.platform_id, record.grade, record.max_min, record.station, record.points)
+        with self.lock:
+            return self.db.execute(INSERT, values).lastrowid
+
+    def query(self, where: str = "", parameters: tuple = (), order: str = "tested_s DESC", limit: int = -1) -> list:
+        with self.lock:
+            rows = self.db.execute(f"{SELECT} {where} ORDER BY {order} LIMIT ?", (*parameters, limit)).fetchall()
+        return [stored_result(row) for row in rows]
+
+    def tests_for(self, platform_id: str) -> list:
+        '''
+        Returns:
+            list: StoredResult for every test of the platform, newest first
+        '''
+        return self.query("WHERE platform_id = ?", (platform_id.strip(),))
+
+    def between(self, start_s: float, end_s: float = None, station: str = None) -> list:
+        '''
+        Returns:
+            list: StoredResult tested in [start_s, end_s), oldest first
+        '''
+        where, parameters = self.time_range(start_s, end_s, station)
+        return self.query(where, parameters, order="tested_s")
+
+    def latest(self, limit: int = 50) -> list:
+        return self.query(limit=limit)
+
+    def yield_between(self, start_s: float, end_s: float = None, station: str = None) -> YieldSummary:
+        where, parameters = self.time_range(start_s, end_s, station)
+        with self.lock:
+            counts = dict(self.db.execute(f"SELECT grade, COUNT(*) FROM results {where} GROUP BY grade", parameters).fetchall())
+        return YieldSummary(sum(counts.values()), counts.get(PASS, 0), counts.get(FAIL, 0), counts.get(DATA_ERROR, 0))
+
+    def yield_this_week(self, station: str = None) -> YieldSummary:
+        return self.yield_between(week_start_s(), station=station)
+
+    def time_range(self, start_s: float, end_s: float, station: str) -> tuple:
+        where = "WHERE tested_s >= ? AND tested_s < ?"
+        parameters = (start_s, float("inf") if end_s is None else end_s)
+        if station is not None:
+            where += " AND station = ?"
+            parameters += (station,)
+        return where, parameters
+
+    def count(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+def parse_date(text: str) -> float:
+    # DATE_FORMAT local time to epoch seconds, minute resolution
+    text = text.strip()
+    if len(text) == 18 and text[2] == ":" and text[5:8] == " - " and text[10] == text[13] == "/":
+        # "%H:%M - %d/%m/%Y" sliced, strptime is most of an import
+        return datetime(int(text[14:]), int(text[11:13]), int(text[8:10]), int(text[:2]), int(text[3:5])).timestamp()
+    return datetime.strptime(text, DATE_FORMAT).timestamp()
+
+def csv_rows(csv_file: str) -> list:
+    '''
+    row_values() per line of a results CSV
+
+    Takes P0..P8 columns, or "0".."8" from files the pandas save wrote into
+    (the new rows went under extra columns beside an empty P0..P8).
+
+    Returns:
+        list: row_values() tuples, lines with an unreadable date are skipped
+    '''
+    rows = []
+    with open(csv_file, newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        column = {name: index for index, name in enumerate(header)}
+        if "Date" not in column:
+            print(f"{csv_file}: no Date column, nothing imported")
+            return rows
+
+        def field(entry: list, name: str) -> str:
+            index = column.get(name)
+            return entry[index] if index is not None and index < len(entry) else ""
+
+        for line, entry in enumerate(reader, start=2):
+            try:
+                tested_s = parse_date(field(entry, "Date"))
+            except ValueError:
+                print(f"{csv_file}:{line}: unreadable date {field(entry, 'Date')!r}, skipped")
+                continue
+            points = [field(entry, f"P{index}") or field(entry, str(index)) for index in range(INDICATORS)]
+            rows.append(row_values(tested_s, field(entry, "PlatformID").strip(), field(entry, "Grade"),
+                                   field(entry, "MaxMin"), field(entry, "Station"), points))
+    return rows
+
+def minute_key(platform_id: str, tested_s: float) -> tuple:
+    # CSV dates only keep the minute, live rows are matched on the same
+    return platform_id.strip(), int(tested_s // 60)
+
+def new_rows(store: ResultsStore, rows: list) -> list:
+    '''
+    Drop CSV rows the store already holds, saved live by PersistenceWorker to
+    both data.csv and the store. Matched on platform and minute, as many
+    rows per key as the store has, so repeat tests in one minute still load.
+    '''
+    if not rows:
+        return rows
+    start_s = min(row[0] for row in rows)
+    end_s = max(row[0] for row in rows) + 60
+    with store.lock:
+        stored = store.db.execute("SELECT platform_id, tested_s FROM results WHERE tested_s >= ? AND tested_s < ?", (start_s, end_s)).fetchall()
+
+    existing = {}
+    for platform_id, tested_s in stored:
+        key = minute_key(platform_id, tested_s)
+        existing[key] = existing.get(key, 0) + 1
+
+    fresh = []
+    for row in rows:
+        key = minute_key(row[2], row[0])
+        if existing.get(key, 0) > 0:
+            existing[key] -= 1
+        else:
+            fresh.append(row)
+    return fresh
+
+def import_csv(store: ResultsStore, csv_file: str, force: bool = False) -> int:
+    '''
+    Load a results CSV into the store, once per file unless forced. Rows the
+    store already has (new_rows) are skipped, so data.csv can be imported
+    after the jig has been saving to both.
+
+    Returns:
+        int: Rows imported, 0 if the file was imported before
+    '''
+    name = path.abspath(csv_file)
+    with store.lock:
+        done = store.db.execute("SELECT rows FROM imports WHERE file = ?", (name,)).fetchone()
+    if done is not None and not force:
+        print(f"{csv_file} already imported ({done[0]} rows), --force to import again")
+        return 0
+
+    rows = csv_rows(csv_file)
+    skipped = len(rows)
+    rows = new_rows(store, rows)
+    skipped -= len(rows)
+    if skipped:
+        print(f"{csv_file}: {skipped} rows already in the store, skipped")
+    with store.lock:
+        with store.db:
+            store.db.execute("BEGIN")
+            store.db.executemany(INSERT, rows)
+            store.db.execute("INSERT OR REPLACE INTO imports (file, rows, imported_s) VALUES (?, ?, ?)", (name, len(rows), time()))
+    return len(rows)
+
+def show(results: list):
+    for result in results:
+        max_min = "" if result.max_min_um is None else f"{result.max_min_um / 1000:.3f}"
+        readings = " ".join("--.---" if reading is None else f"{reading / 1000:.3f}" for reading in result.readings_um)
+        print(f"{result.tested_at():%Y-%m-%d %H:%M} {result.station:>4} {result.platform_id:<24} {result.grade:<10} {max_min:>6}  {readings}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the results database, or load a results CSV into it")
+    parser.add_argument("--db", default=RESULTS_DB)
+    parser.add_argument("--import", dest="csv_file", help="Results CSV to load, eg data.csv")
+    parser.add_argument("--force", action="store_true", help="Import a file again")
+    parser.add_argument("--platform", help="Every test of one platform")
+    parser.add_argument("--week", action="store_true", help="Yield since Monday")
+    parser.add_argument("--station", help="Only this station's tests, with --week")
+    parser.add_argument("--latest", type=int, default=0, help="Most recent tests")
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        if args.csv_file:
+            print(f"Imported {import_csv(store, args.csv_file, args.force)} rows, {store.count()} in {args.db}")
+        if args.platform:
+            show(store.tests_for(args.platform))
+        if args.week:
+            summary = store.yield_this_week(args.station)
+            rate = summary.pass_rate()
+            print(f"Since {datetime.fromtimestamp(week_start_s()):%a %d/%m}: {summary.tested} tests, {summary.passed} PASS, "
+                  f"{summary.failed} FAIL, {summary.data_errors} {DATA_ERROR}, yield {'-' if rate is None else f'{rate:.1%}'}")
+        if args.latest:
+            show(store.latest(args.latest))
@@ -0,0 +1,323 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Barcode scanner serial protocol (GM65 style).
+
+Commands:  0x7E 0x00 <type> <length> <address hi> <address lo> <data * length> <crc hi> <crc lo>
+Responses: 0x02 0x00 <status> <length> <data * length> <crc hi> <crc lo>
+
+CRC is CRC-16/XMODEM over everything after the 2 byte head. Scanned codes
+come back as plain text outside of response packets.
+'''
+
+from enum import Enum
+from typing import NamedTuple
+
+COMMAND_HEAD = b"\x7E\x00"
+RESPONSE_HEAD = b"\x02\x00"
+
+# Command types
+TYPE_READ = 0x07
+TYPE_WRITE = 0x08
+TYPE_SAVE = 0x09
+
+# Setting zones (addresses)
+ZONE_MODE = 0x0000          # Bits 1-0: 00 manual, 01 command trigger, 10 continuous, 11 induction
+ZONE_TRIGGER = 0x0002       # Bit 0: start scanning in command trigger mode
+ZONE_BAUD_RATE = 0x002A     # 2 bytes, low byte first, ~3 MHz / baud
+ZONE_IDENTITY = 0x00E0
+
+MODE_COMMAND_TRIGGER = 0x01
+MODE_CONTINUOUS = 0x02
+
+STATUS_OK = 0x00
+
+BAUD_RATES = [1200, 4800, 9600, 14400, 19200, 38400, 57600, 115200]
+
+def _crc_table() -> list:
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+CRC_TABLE = _crc_table()
+
+def crc16(data) -> int:
+    '''
+    CRC-16/XMODEM of bytes, bytearray or memoryview
+    '''
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+def build_command(command_type: int, address: int, data: bytes) -> bytes:
+    body = bytes([command_type, len(data), address >> 8, address & 0xFF]) + data
+    crc = crc16(body)
+    return COMMAND_HEAD + body + bytes([crc >> 8, crc & 0xFF])
+
+def build_read(address: int, count: int = 1) -> bytes:
+    return build_command(TYPE_READ, address, bytes([count]))
+
+def build_write(address: int, data: bytes) -> bytes:
+    return build_command(TYPE_WRITE, address, data)
+
+def build_save() -> bytes:
+    # Saves the current settings to the scanner flash
+    return build_command(TYPE_SAVE, 0x0000, b"\x00")
+
+def build_restore_defaults() -> bytes:
+    return build_command(TYPE_SAVE, 0x0000, b"\xFF")
+
+def build_baud_rate(baud: int) -> bytes:
+    if baud not in BAUD_RATES:
+        raise ValueError(f"Unsupported scanner baud rate: {baud}")
+    divisor = round(3_000_000 / baud)
+    return build_write(ZONE_BAUD_RATE, bytes([divisor & 0xFF, divisor >> 8]))
+
+# Commands used by the jig
+IDENTIFY_COMMAND = build_read(ZONE_IDENTITY)
+COMMAND_MODE_COMMAND = build_write(ZONE_MODE, bytes([MODE_COMMAND_TRIGGER]))
+CONTINUOUS_MODE_COMMAND = build_write(ZONE_MODE, bytes([MODE_CONTINUOUS]))
+TRIGGER_COMMAND = build_write(ZONE_TRIGGER, b"\x01")
+STOP_COMMAND = build_write(ZONE_TRIGGER, b"\x00")
+SAVE_SETTING_COMMAND = build_save()
+RESTORE_DEFAULTS_COMMAND = build_restore_defaults()
+
+def build_response(status: int, data: bytes) -> bytes:
+    # Scanner side of the protocol, for the simulator
+    body = bytes([status, len(data)]) + data
+    crc = crc16(body)
+    return RESPONSE_HEAD + body + bytes([crc >> 8, crc & 0xFF])
+
+class ResponseType(Enum):
+    UNKNOWN = 0
+    ACK = 1             # Write / save / trigger accepted
+    SCANNER_ID = 2      # Reply to IDENTIFY_COMMAND
+    ERROR = 3           # Non zero status
+    BAD_CRC = 4
+
+# (status, data) -> type, data is the single byte most replies carry
+KNOWN_RESPONSES = {
+    (STATUS_OK, 0x00): ResponseType.ACK,
+    (STATUS_OK, 0x02): ResponseType.SCANNER_ID,
+}
+
+class Command(NamedTuple):
+    command_type: int
+    address: int
+    data: bytes
+
+def decode_command(view: memoryview):
+    '''
+    Decode the command packet at the start of view (scanner side, for the simulator)
+
+    Returns:
+        tuple: (Command | None, bytes consumed), consumed is 0 while incomplete
+    '''
+    if len(view) < 4:
+        return None, 0
+    if bytes(view[:2]) != COMMAND_HEAD:
+        return None, 1 # Resync on the next byte
+    length = 2 + 4 + view[3] + 2
+    if len(view) < length:
+        return None, 0
+
+    body = view[2:length - 2]
+    crc = (view[length - 2] << 8) | view[length - 1]
+    # 0xABCD is accepted in place of a CRC by the scanner
+    if crc != 0xABCD and crc != crc16(body):
+        return None, length
+    return Command(body[0], (body[2] << 8) | body[3], bytes(body[4:])), length
+
+class Response(NamedTuple):
+    kind: ResponseType
+    status: int
+    data: bytes
+
+def response_length(view: memoryview) -> int:
+    '''
+    Returns:
+        int: Bytes in the packet at the start of view, 0 if the header is incomplete
+    '''
+    if len(view) < 4:
+        return 0
+    return 4 + view[3] + 2
+
+def decode_response(view: memoryview):
+    '''
+    Decode the response packet at the start of view without copying the buffer
+
+    Returns:
+        Response | None: None if the packet is incomplete
+    '''
+    length = response_length(view)
+    if length == 0 or len(view) < length:
+        return None
+
+    status = view[2]
+    data = view[4:length - 2]
+    if crc16(view[2:length - 2]) != (view[length - 2] << 8) | view[length - 1]:
+        kind = ResponseType.BAD_CRC
+    elif status != STATUS_OK:
+        kind = ResponseType.ERROR
+    elif len(data) == 1:
+        kind = KNOWN_RESPONSES.get((status, data[0]), ResponseType.UNKNOWN)
+    else:
+        kind = ResponseType.UNKNOWN
+
+    return Response(kind, status, bytes(data))
+
+# Parser events
+RESPONSE = "response"
+CODE = "code"
+
+LINE_ENDS = b"\r\n"
+
+class ScannerStreamDecoder:
+    '''
+    Splits the scanner byte stream into response packets and scanned codes.
+    Codes end with CR/LF, the start of a packet, or flush() once the line goes quiet.
+    '''
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def reset(self):
+        self.buffer.clear()
+
+    def has_pending_text(self) -> bool:
+        return len(self.buffer) > 0 and not self.buffer.startswith(RESPONSE_HEAD[:1])
+
+    def feed(self, chunk: bytes) -> list:
+        '''
+        Returns:
+            list: (RESPONSE, Response) and (CODE, str) events in arrival order
+        '''
+        buffer = self.buffer
+        buffer += chunk
+        events = []
+        consumed = 0
+
+        with memoryview(buffer) as view:
+            while consumed < len(buffer):
+                if buffer[consumed] == 0x02:
+                    # Packet, or a stray STX which is dropped
+                    if consumed + 1 < len(buffer) and buffer[consumed + 1] != 0x00:
+                        consumed += 1
+                        continue
+                    response = decode_response(view[consumed:])
+                    if response is None:
+                        break
+                    events.append((RESPONSE, response))
+                    consumed += response_length(view[consumed:])
+                    continue
+
+                # Code text up to the next line end or packet
+                end = self.find_text_end(consumed)
+                if end < 0:
+                    break
+                if end > consumed:
+                    events.append((CODE, buffer[consumed:end].decode(errors="replace")))
+                consumed = end + 1 if buffer[end] in LINE_ENDS else end
+
+        del buffer[:consumed]
+        return events
+
+    def find_text_end(self, start: int) -> int:
+        ends = [index for index in (self.buffer.find(b"\r", start), self.buffer.find(b"\n", start), self.buffer.find(b"\x02", start)) if index >= 0]
+        return min(ends) if ends else -1
+
+    def flush(self) -> list:
+        # Line went quiet, whatever text is left is a complete code
+        if not self.has_pending_text():
+            return []
+        text = self.buffer.decode(errors="replace")
+        self.buffer.clear()
+        return [(CODE, text)]
+
+# Scan states
+IDLE = 0
+TRIGGERING = 1 # Trigger sent, waiting for the confirm response
+SCANNING = 2 # Trigger confirmed, waiting for a code
+
+TRIGGER_TIMEOUT_MS = 200
+SCAN_TIMEOUT_MS = 2000
+CODE_IDLE_MS = 30 # Gap that ends a code sent without CR/LF
+
+# Why a scan ended without a code
+NO_CONFIRM = "no confirm" # Nothing answered the trigger, likely not the scanner any more
+REFUSED = "refused"
+NO_CODE = "no code"
+
+class ScanStep(NamedTuple):
+    write: bytes = None     # Command to send the scanner
+    wait_ms: int = None     # Restart the timeout, 0 stops it, None leaves it
+    done: bool = False
+    code: str = None
+    failure: str = None     # NO_CONFIRM, REFUSED or NO_CODE when done without a code
+
+class TriggerScan:
+    '''
+    One scan at a time, the trigger / confirm / code exchange without any IO.
+    The Qt scanner (qr.py) and the headless engine (JigEngine.py) feed it
+    decoder events and timeouts, and follow the ScanStep it returns.
+    '''
+
+    def __init__(self, continuous: bool = False):
+        self.continuous = continuous # Scanner scans on its own, no trigger
+        self.state = IDLE
+
+    def start(self) -> ScanStep:
+        if self.continuous:
+            self.state = SCANNING
+            return ScanStep(wait_ms=SCAN_TIMEOUT_MS)
+
+        self.state = TRIGGERING
+        return ScanStep(write=TRIGGER_COMMAND, wait_ms=TRIGGER_TIMEOUT_MS)
+
+    def handle(self, kind: str, payload):
+        '''
+        Args:
+            kind (str): RESPONSE or CODE, from ScannerStreamDecoder
+
+        Returns:
+            ScanStep | None: None if the event is not part of the scan
+        '''
+        if kind == RESPONSE:
+            if self.state != TRIGGERING:
+                return None # Reply to a mode change or stop command
+
+            if payload.kind != ResponseType.ACK:
+                self.state = IDLE
+                return ScanStep(wait_ms=0, done=True, failure=REFUSED)
+
+            self.state = SCANNING
+            return ScanStep(wait_ms=SCAN_TIMEOUT_MS)
+
+        # Continuous mode codes only count when a scan was asked for
+        if kind == CODE and self.state != IDLE:
+            self.state = IDLE
+            return ScanStep(wait_ms=0, done=True, code=payload)
+        return None
+
+    def timed_out(self) -> ScanStep:
+        state, self.state = self.state, IDLE
+        if state == TRIGGERING:
+            return ScanStep(done=True, failure=NO_CONFIRM)
+        if state == SCANNING:
+            return ScanStep(write=None if self.continuous else STOP_COMMAND, done=True, failure=NO_CODE)
+        return ScanStep()
+
+    def cancel(self) -> ScanStep:
+        # Stop waiting for an ACK or a code, the scanner stops looking too
+        state, self.state = self.state, IDLE
+        if state == IDLE or self.continuous:
+            return ScanStep(wait_ms=0)
+        return ScanStep(write=STOP_COMMAND, wait_ms=0)
+
+    def reset(self):
+        self.state = IDLE
@@ -0,0 +1,149 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Sequential PASS / FAIL over repeated sweeps of the same platform.
+
+Each sweep is averaged into a per-indicator running mean. The max-min of the
+means is compared with PASS_CRITERIA, together with its standard error:
+
+    PASS  once max-min + z * error <= PASS_CRITERIA
+    FAIL  once max-min - z * error >  PASS_CRITERIA
+
+Error is the reading noise (pooled sample deviation, never below
+READING_NOISE_MM) times sqrt(1/n1 + 1/n2), n1 and n2 being the reading counts
+of the two least sampled indicators, as two indicators make up max-min.
+z is one-sided for FALSE_ACCEPT_RATE split across MAX_SWEEPS looks, so
+peeking after every sweep cannot push the false accept rate past it. Clear
+parts decide on the first sweep, marginal ones take more, and a part still
+undecided after MAX_SWEEPS is failed.
+
+PartGrader is the one test of a platform the window (main.py) and the
+headless engine (JigEngine.py) both run: the latest sweep graded alone, or
+followed by as many sweeps as SequentialGrader needs.
+
+Validated with test_scripts/sequential_validation.py.
+'''
+
+from math import sqrt
+from statistics import NormalDist
+from time import monotonic_ns
+
+from Grading import BIASES, DATA_ERROR, FAIL, MIN_VALID_READINGS, PASS, PASS_CRITERIA, fresh_mask, grade
+
+FALSE_ACCEPT_RATE = 0.01
+MAX_SWEEPS = 8
+READING_NOISE_MM = 0.001 # Indicator resolution, floor for the noise estimate
+
+class SequentialGrader:
+
+    def __init__(self, pass_criteria: float = PASS_CRITERIA, false_accept_rate: float = FALSE_ACCEPT_RATE,
+                 max_sweeps: int = MAX_SWEEPS, noise: float = READING_NOISE_MM):
+        self.pass_criteria = pass_criteria
+        self.max_sweeps = max_sweeps
+        self.noise = noise
+        self.z = NormalDist().inv_cdf(1 - false_accept_rate / max_sweeps)
+
+        self.sweeps = 0
+        self.shifts = None  # First reading per channel, keeps the sums of squares small
+        self.sums = None
+        self.squares = None
+        self.counts = None
+
+        # Latest estimate, kept for display once decided
+        self.max_min = None
+        self.uncertainty = None
+
+    def add(self, readings: list):
+        '''
+        Args:
+            readings (list): Biased mm per indicator, None for no reading (Grading.apply_bias)
+
+        Returns:
+            GradeResult | None: Decision, None while more sweeps are needed
+        '''
+        if self.sums is None:
+            self.shifts = [None] * len(readings)
+            self.sums = [0.0] * len(readings)
+            self.squares = [0.0] * len(readings)
+            self.counts = [0] * len(readings)
+
+        for channel, value in enumerate(readings):
+            if value is None:
+                continue
+            if self.shifts[channel] is None:
+                self.shifts[channel] = value
+            value -= self.shifts[channel]
+            self.sums[channel] += value
+            self.squares[channel] += value * value
+            self.counts[channel] += 1
+        self.sweeps += 1
+
+        result = grade(self.means())
+        if result.grade == DATA_ERROR:
+            return result if self.sweeps >= self.max_sweeps else None
+
+        self.max_min = result.max_min
+        self.uncertainty = self.z * self.standard_error()
+
+        if result.max_min + self.uncertainty <= self.pass_criteria:
+            return result._replace(grade=PASS)
+        if result.max_min - self.uncertainty > self.pass_criteria or self.sweeps >= self.max_sweeps:
+            return result._replace(grade=FAIL)
+        return None
+
+    def means(self) -> list:
+        return [None if count == 0 else shift + total / count for shift, total, count in zip(self.shifts, self.sums, self.counts)]
+
+    def standard_error(self) -> float:
+        # Pooled deviation of every indicator about its own mean
+        deviation = 0.0
+        degrees = 0
+        for total, square, count in zip(self.sums, self.squares, self.counts):
+            if count > 1:
+                deviation += max(square - total * total / count, 0.0)
+                degrees += count - 1
+        noise = max(self.noise, sqrt(deviation / degrees)) if degrees > 0 else self.noise
+
+        # Channels with fewer readings make the max-min less certain
+        counts = sorted(count for count in self.counts if count > 0)
+        if len(counts) < MIN_VALID_READINGS:
+            return noise
+        return noise * sqrt(1 / counts[0] + 1 / counts[1])
+
+class PartGrader:
+    '''
+    Grades one platform from the sweeps given to add(), starting with the latest
+    '''
+
+    def __init__(self, biases: list = BIASES, sequential: bool = False):
+        self.biases = biases
+        self.sequential = SequentialGrader() if sequential else None
+        self.graded_sequence = None
+        self.sweeps = 0
+
+    def add(self, frame, now_ns: int = None):
+        '''
+        Args:
+            frame (SweepFrame | None): Latest sweep, None if the controller has sent none
+
+        Returns:
+            tuple | None: (GradeResult, readings saved with it), None while more sweeps are needed
+                or the frame was graded already
+        '''
+        if frame is None:
+            return grade([]), []
+        if frame.sequence == self.graded_sequence:
+            return None
+        self.graded_sequence = frame.sequence
+        self.sweeps += 1
+
+        # Only readings from the current sweep window, a silent indicator counts as missing
+        readings = frame.mm(self.biases, fresh_mask(frame, monotonic_ns() if now_ns is None else now_ns))
+        if self.sequential is None:
+            return grade(readings), readings
+
+        result = self.sequential.add(readings)
+        if result is None:
+            return None
+        # Graded on the mean of every sweep
+        return result, [None if mean is None else round(mean, 3) for mean in self.sequential.means()]
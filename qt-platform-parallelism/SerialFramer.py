@@ -0,0 +1,270 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Streaming parser for the indicator controller serial output.
+
+The controller (indicator-controller/src/mux_thread.c) prints one line per
+micrometer reading:
+    [M<index>]: <sign><mm>.<3dp>\\n      e.g. "[M4]: -0.012"
+    [M<index>]: --.---\\n                 no reading from that micrometer
+
+Lines can arrive split across any number of serial reads, so bytes are kept
+in a persistent buffer and only complete lines are decoded. Values are
+decoded straight from bytes into integer microns, no regex or str round trip.
+'''
+
+from array import array
+from time import monotonic_ns
+
+NO_READING = b"--.---"
+
+# MUX ports with an indicator, in indicator order (Grading.py layout)
+# Each MUX hub has 8 ports, Mux 1 -> Ports 0 -> 7, Mux 2 -> Ports 8 -> 15
+MUX_PORTS_IN_USE = [1, 2, 4, 5, 6, 9, 10, 12, 13]
+
+class ReadingFramer:
+
+    # Guard against a controller that never sends a newline (wrong baud, noise)
+    MAX_LINE_LENGTH = 64
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.bad_lines = 0
+
+    def feed(self, chunk: bytes) -> list:
+        '''
+        Add a chunk of raw serial bytes, decode every complete line in it
+
+        Args:
+            chunk (bytes): Bytes as read from the serial port
+
+        Returns:
+            list: (micrometer index, microns) tuples in arrival order.
+                  microns is None when the micrometer reported "--.---"
+        '''
+        buffer = self.buffer
+        buffer += chunk
+
+        end = buffer.rfind(b"\n", len(buffer) - len(chunk))
+        if end < 0:
+            # No complete line yet, drop runaway garbage
+            if len(buffer) > self.MAX_LINE_LENGTH:
+                self.bad_lines += 1
+                buffer.clear()
+            return []
+
+        lines = bytes(buffer[:end]).split(b"\n")
+        del buffer[:end + 1]
+
+        readings = []
+        for line in lines:
+            reading = self.decode_line(line)
+            if reading is None:
+                if line.strip():
+                    self.bad_lines += 1
+                continue
+            readings.append(reading)
+
+        return readings
+
+    @staticmethod
+    def decode_line(line: bytes):
+        '''
+        Decode one line without its newline, eg b"[M12]: +1.509"
+
+        Returns:
+            tuple | None: (index, microns) or None if the line is not a reading
+        '''
+        # Header "[M<index>]:"
+        header, separator, value = line.partition(b"]:")
+        if not separator or header[:2] != b"[M":
+            return None
+
+        value = value.strip()
+        try:
+            index = int(header[2:])
+            if value == NO_READING:
+                return (index, None)
+
+            # Always printed with 3dp, int() handles the optional sign
+            if value[-4:-3] != b".":
+                return None
+            return (index, int(value[:-4] + value[-3:]))
+        except ValueError:
+            return None
+
+    def reset(self):
+        self.buffer.clear()
+
+class SweepFrame:
+    '''
+    One complete sweep, array backed. Integer microns and receive times sit
+    in fixed buffers, a bitmask says which indicators reported, so a frame
+    is a few hundred bytes rather than two tuples of boxed ints, and
+    readings stay numbers from the serial line to the grade. Not changed
+    once handed over.
+
+    numpy views without a copy: np.frombuffer(frame.microns, dtype=np.int32)
+    '''
+
+    __slots__ = ("sequence", "timestamp_ns", "valid_mask", "microns", "received_ns", "started_ns")
+
+    def __init__(self, sequence: int, timestamp_ns: int, microns: array, valid_mask: int, received_ns: array, started_ns: int = None):
+        self.sequence = sequence         # Increments by one for every complete sweep, the source sweep of every value
+        self.timestamp_ns = timestamp_ns # time.monotonic_ns() when the sweep completed
+        self.microns = microns           # array("i") per in-use indicator in mux_ports_in_use order, 0 for no reading
+        self.valid_mask = valid_mask     # Bit i set when indicator i reported
+        self.received_ns = received_ns   # array("q") time.monotonic_ns() each value was received, same order
+        self.started_ns = min(received_ns, default=timestamp_ns) if started_ns is None else started_ns # First value of the sweep received
+
+    @classmethod
+    def from_values(cls, sequence: int, timestamp_ns: int, values, received_ns=None):
+        '''
+        Args:
+            values (iterable): Microns or None per indicator
+            received_ns (iterable): Receive time per indicator, defaults to timestamp_ns
+        '''
+        values = list(values)
+        valid_mask = 0
+        for slot, microns in enumerate(values):
+            if microns is not None:
+                valid_mask |= 1 << slot
+        received_ns = [timestamp_ns] * len(values) if received_ns is None else received_ns
+        return cls(sequence, timestamp_ns, array("i", [microns or 0 for microns in values]), valid_mask, array("q", received_ns))
+
+    def __len__(self) -> int:
+        return len(self.microns)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, SweepFrame):
+            return NotImplemented
+        return (self.sequence, self.timestamp_ns, self.valid_mask, self.microns, self.received_ns, self.started_ns) == \
+            (other.sequence, other.timestamp_ns, other.valid_mask, other.microns, other.received_ns, other.started_ns)
+
+    def __repr__(self) -> str:
+        return f"SweepFrame(sequence={self.sequence}, timestamp_ns={self.timestamp_ns}, values={self.values})"
+
+    def is_valid(self, slot: int) -> bool:
+        return bool(self.valid_mask >> slot & 1)
+
+    @property
+    def values(self) -> tuple:
+        '''
+        Returns:
+            tuple: Microns or None per indicator
+        '''
+        mask = self.valid_mask
+        return tuple(microns if mask >> slot & 1 else None for slot, microns in enumerate(self.microns))
+
+    def mm(self, biases: list = None, mask: int = None) -> list:
+        '''
+        Args:
+            biases (list): mm added per indicator, eg Grading.BIASES
+            mask (int): Indicators to keep, defaults to valid_mask. eg Grading.fresh_mask
+
+        Returns:
+            list: mm rounded to 3dp with the bias applied, None where there was no reading
+        '''
+        mask = self.valid_mask if mask is None else mask & self.valid_mask
+        biases = biases if biases is not None else [0.0] * len(self.microns)
+        return [round(microns / 1000 + bias, 3) if mask >> slot & 1 else None
+                for slot, (microns, bias) in enumerate(zip(self.microns, biases))]
+
+class SweepAssembler:
+    '''
+    Collects readings until every in-use MUX port has reported since the last
+    frame, then hands back one SweepFrame. Both MUX boards print interleaved,
+    so completion is tracked per port rather than by order. Every value of a
+    frame was received in its sweep window, started_ns to timestamp_ns.
+    '''
+
+    def __init__(self, mux_ports_in_use: list):
+        self.slots = {port: slot for slot, port in enumerate(mux_ports_in_use)}
+        self.microns = array("i", [0] * len(mux_ports_in_use))
+        self.received = array("q", [0] * len(mux_ports_in_use))
+        self.valid_mask = 0
+        self.complete_mask = (1 << len(mux_ports_in_use)) - 1
+        self.seen_mask = 0
+        self.started_ns = 0 # First reading since the last frame
+        self.sequence = 0
+
+    def add(self, index: int, microns, timestamp_ns: int = None):
+        '''
+        Add one decoded reading
+
+        Returns:
+            SweepFrame | None: Frame if this reading completed a sweep
+        '''
+        slot = self.slots.get(index)
+        if slot is None: # Port not in use
+            return None
+
+        if timestamp_ns is None:
+            timestamp_ns = monotonic_ns()
+
+        if self.seen_mask == 0:
+            self.started_ns = timestamp_ns
+
+        bit = 1 << slot
+        if microns is None:
+            self.microns[slot] = 0
+            self.valid_mask &= ~bit
+        else:
+            self.microns[slot] = microns
+            self.valid_mask |= bit
+        self.received[slot] = timestamp_ns
+        self.seen_mask |= bit
+        if self.seen_mask != self.complete_mask:
+            return None
+
+        # Buffers are copied, the assembler keeps filling its own
+        self.seen_mask = 0
+        self.sequence += 1
+        return SweepFrame(self.sequence, timestamp_ns, array("i", self.microns), self.valid_mask, array("q", self.received), self.started_ns)
+
+    def reset(self):
+        self.microns = array("i", [0] * len(self.microns))
+        self.received = array("q", [0] * len(self.received))
+        self.valid_mask = 0
+        self.seen_mask = 0
+
+class ControllerStream:
+    '''
+    Raw controller bytes to SweepFrames: capture, framing and sweep assembly
+    in one place for the Qt data thread (ExtractData.DataGetter) and the
+    headless engine (JigEngine.ControllerIngest), whatever reads the port.
+    '''
+
+    def __init__(self, mux_ports_in_use: list = MUX_PORTS_IN_USE, recorder=None):
+        self.framer = ReadingFramer()
+        self.assembler = SweepAssembler(mux_ports_in_use)
+        self.recorder = recorder # CaptureLog.CaptureRecorder, raw bytes for replay
+
+    def feed(self, chunk: bytes, received_ns: int) -> list:
+        '''
+        Args:
+            chunk (bytes): As read from the port, every reading in it shares received_ns
+
+        Returns:
+            list: SweepFrames completed by the chunk, usually none or one
+        '''
+        if self.recorder is not None:
+            self.recorder.write(received_ns, chunk)
+
+        frames = []
+        for index, microns in self.framer.feed(chunk):
+            # Ports not in use are skipped by the assembler
+            frame = self.assembler.add(index, microns, received_ns)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+    def reset(self):
+        # New connection, a part line or part sweep from the last one is dropped
+        self.framer.reset()
+        self.assembler.reset()
+
+    def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
@@ -0,0 +1,144 @@
+# This Python file uses the following encoding: utf-8
+
+'''
+Hands-free test trigger from the stream of sweep frames.
+
+A platform being placed pushes every indicator in by a large step (readings
+move in PLACE_DIRECTION). Once the readings stop moving (no channel drifts more
+than `settle_range` across the last `window_ms`) the platform has settled and
+the test is triggered once. Lifting the platform off is a step the other
+way, which re-arms the detector. Steps the wrong way in EMPTY (a platform that was on the
+jig at startup being lifted off) are ignored.
+
+    EMPTY --step--> PLACED --settled--> LOADED (trigger) --step--> EMPTY
+
+Thresholds are in microns and validated with test_scripts/settle_validation.py.
+'''
+
+from collections import deque
+
+# Defaults, tuned on simulated streams
+SETTLE_WINDOW_MS = 2800     # Time the readings must hold still for, 2 firmware sweeps
+SETTLE_RANGE_MICRONS = 3    # Max drift per channel over the window
+STEP_MICRONS = 200          # Move that counts as placing / lifting a platform
+MIN_CHANNELS = 8            # Channels that must agree, one may read --.---
+PLACE_DIRECTION = 1         # Sign of the step when a platform is placed
+
+EMPTY = "empty"
+PLACED = "placed"
+LOADED = "loaded"
+
+class SettleDetector:
+
+    def __init__(self, window_ms: int = SETTLE_WINDOW_MS, settle_range: int = SETTLE_RANGE_MICRONS,
+                 step: int = STEP_MICRONS, min_channels: int = MIN_CHANNELS, direction: int = PLACE_DIRECTION):
+        self.window_ns = window_ms * 1_000_000
+        self.settle_range = settle_range
+        self.step = step
+        self.min_channels = min_channels
+        self.direction = direction
+
+        self.frames = deque()  # (timestamp ns, values) covering the window
+        self.state = EMPTY
+        self.reference = None   # Settled values before the last step
+        self.lifted_from = None # Loaded values while relearning the empty jig
+
+    def reset(self):
+        self.frames.clear()
+        self.state = EMPTY
+        self.reference = None
+        self.lifted_from = None
+
+    def add(self, values: tuple, timestamp_ns: int) -> bool:
+        '''
+        Args:
+            values (tuple): Microns or None per indicator, eg SweepFrame.values
+            timestamp_ns (int): When the frame completed, eg SweepFrame.timestamp_ns
+
+        Returns:
+            bool: True on the frame where a placed platform has settled
+        '''
+        frames = self.frames
+        frames.append((timestamp_ns, values))
+        # Keep just enough frames to span the window
+        while len(frames) > 2 and timestamp_ns - frames[1][0] >= self.window_ns:
+            frames.popleft()
+        settled = self.settled_values()
+
+        if self.state == EMPTY:
+            if self.reference is None:
+                # Learn the empty jig, or a platform that was already there at startup.
+                # After a lift the first sweep with every channel off is good enough
+                if self.lifted_from is not None and self.moved(values, self.lifted_from, -self.direction) == self.valid(values):
+                    self.reference = values
+                else:
+                    self.reference = settled
+                if self.reference is not None:
+                    self.lifted_from = None
+            elif self.stepped(values, self.direction):
+                self.state = PLACED
+            elif settled is not None:
+                self.reference = settled # Follow slow drift
+            return False
+
+        if self.state == PLACED:
+            if settled is None:
+                return False
+            if not self.stepped(settled, self.direction):
+                # Taken off again before it settled
+                self.state = EMPTY
+                self.reference = settled
+                return False
+            self.state = LOADED
+            self.reference = settled
+            return True
+
+        # LOADED, wait for the platform to come off
+        if self.stepped(values, -self.direction):
+            # Relearn the empty jig, the lifting sweep is only part way off
+            self.state = EMPTY
+            self.lifted_from = self.reference
+            self.reference = None
+        return False
+
+    def stepped(self, values: tuple, direction: int) -> bool:
+        if self.reference is None:
+            return False
+        return self.moved(values, self.reference, direction) >= self.min_channels
+
+    def moved(self, values: tuple, reference: tuple, direction: int) -> int:
+        # Channels at least one step away from reference in direction
+        return sum(1 for value, before in zip(values, reference)
+                   if value is not None and before is not None and (value - before) * direction >= self.step)
+
+    def valid(self, values: tuple) -> int:
+        return sum(1 for value in values if value is not None)
+
+    def settled_values(self):
+        '''
+        Settled once no channel drifts more than settle_range between the older
+        and newer half of the window. Comparing half means rather than the raw
+        range keeps noise from holding off the trigger when sweeps are fast.
+
+        Returns:
+            tuple | None: Latest values if every channel held still over the window
+        '''
+        frames = self.frames
+        if frames[-1][0] - frames[0][0] < self.window_ns:
+            return None
+
+        half = len(frames) // 2
+        older = [values for _, values in list(frames)[:half]]
+        newer = [values for _, values in list(frames)[-half:]]
+
+        valid = 0
+        for channel in range(len(frames[-1][1])):
+            older_values = [values[channel] for values in older if values[channel] is not None]
+            newer_values = [values[channel] for values in newer if values[channel] is not None]
+            if not older_values or not newer_values:
+                continue
+            if abs(sum(newer_values) / len(newer_values) - sum(older_values) / len(older_values)) > self.settle_range:
+                return None
+            valid += 1
+
+        return frames[-1][1] if valid >= self.min_channels else None
@@ -1,11 +1,9 @@
 # This Python file uses the following encoding: utf-8
 import sys
-import pandas as pd
-from os import path
-from datetime import datetime
 
 from PySide6.QtWidgets import QApplication, QMainWindow
-from PySide6.QtCore import QThread, Signal
+from PySide6.QtCore import Qt, QThread, QTimer, Signal
+from time import monotonic_ns
 
 '''
 Qt app source code for Build Platform Measurement Jig
@@ -18,27 +16,44 @@ Project members:
 '''
 VERSION = "1.0.0"
 
-BIAS_BACK_ROW = 0.000 # Indicators 0, 1, 2
-BIAS_MIDDLE_ROW = 0.001 # Indicators 3, 4, 5
-BIAS_FRONT_ROW = 0.002 # Indicators 6, 7, 8
-
-PASS_CRITERIA = 0.035
-
 # Important:
 # You need to run the following command to generate the ui_form.py file
 #     pyside6-uic form.ui -o ui_form.py
 from ui_form import Ui_MainWindow
-from ExtractData import SerialPortGetter, DataGetter
+from ExtractData import HotplugWatcher, DataGetter
 # from ParallelismChecker import ParallelismChecker
 from qr import QRScanner
-from PostToSheet import post_to_google_sheets
+from PortDiscovery import PortDiscovery
+from CaptureLog import CaptureRecorder
+from SettleDetector import SettleDetector
+from SequentialGrader import PartGrader
+from Grading import BIASES, DATA_ERROR, MAX_READING_AGE_MS, PASS, fresh_mask, reading_ages_ms
+from Results import make_record
+from PersistenceWorker import OUTBOX, STORE, PersistenceWorker
+from Outbox import OUTBOX_FILE, Outbox
+from ResultsStore import RESULTS_DB, ResultsStore
 
 DATA_FILE = "data.csv"
+PORT_CACHE_FILE = "ports.json" # Last known controller & scanner identities
+CAPTURE_DIR = None # eg "captures", records raw controller bytes for replay (CaptureLog.py)
+QR_CONTINUOUS_SCAN = False # Scanner reads codes on its own, test uses the latest one
+AGE_REFRESH_MS = 250 # How often indicator ages are redrawn
+AUTO_TRIGGER = False # Test automatically once a placed platform settles (SettleDetector.py)
+SEQUENTIAL_GRADING = False # Average sweeps until PASS / FAIL is confident (SequentialGrader.py)
+
+def reading_text(value) -> str:
+    return "--.---" if value is None else f"{value}"
 
 class MainWindow(QMainWindow):
     get_qr_id = Signal()
+    cancel_qr_scan = Signal()
 
     connect_to_data_serial_port = Signal()
+    stop_data_getter = Signal() # Blocks until DataGetter.finish has run on the data thread
+
+    # From the persistence worker threads, queued onto the GUI thread
+    result_saved = Signal(object)
+    result_failed = Signal(object, str, str)
     
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -49,13 +64,31 @@ class MainWindow(QMainWindow):
         # Connect click/open on combo box to starting getSerialPortsThread
         # Once done, serve the results from the thread onto the UI
 
-        self.data = {}
-        self.num_valid_data = 0
+        self.readings = [] # Biased mm per indicator, None for no reading
+        self.frame = None # Latest SweepFrame
+        self.settle_detector = SettleDetector() if AUTO_TRIGGER else None
+        self.graded_data = [] # Readings the last grade was made from, saved with it
+        self.graded_result = None # GradeResult saved with them
+        self.init_persistence()
+        self.part_grader = None # Set while the part is being graded
+
+        # No sweep for this long while grading, the controller went quiet. Same bound as JigEngine's next_frame
+        self.grade_timer = QTimer(self)
+        self.grade_timer.setSingleShot(True)
+        self.grade_timer.timeout.connect(self.grade_timed_out)
 
         self.show_bias()
 
-        # Initialise serial port refresher thread
-        self.serport_getter = self.serport_thread = None
+        # Age of each indicator reading, shows which channel is lagging
+        self.age_timer = QTimer(self)
+        self.age_timer.timeout.connect(self.show_bias)
+        self.age_timer.start(AGE_REFRESH_MS)
+
+        # Serial port identities shared by the data, scanner & hotplug threads
+        self.port_discovery = PortDiscovery(PORT_CACHE_FILE)
+
+        # Initialise serial port hotplug thread
+        self.hotplug_watcher = self.hotplug_thread = None
         self.data_getter = self.data_thread = None
 
         self.data_port = None
@@ -63,8 +96,8 @@ class MainWindow(QMainWindow):
         self.qr_scanner = self.qr_scanner_thread = None
         self.init_buttons() # Test & Save buttons
         self.init_qr_scanner()
-        self.init_serport_getter()
         self.init_data_getter()
+        self.init_hotplug_watcher()
 
         # self.ui.serialport_select1.addItem("No Device Selected")
         # self.portgroup1 = 1
@@ -78,50 +111,67 @@ class MainWindow(QMainWindow):
         # Thread for receiving data from serial port
         self.portCurrent = None
 
+    # Results are saved to DATA_FILE and the upload outbox on worker threads, save_data only queues them
+    def init_persistence(self):
+        self.result_saved.connect(self.result_was_saved)
+        self.result_failed.connect(self.result_save_failed)
+        self.outbox = Outbox(OUTBOX_FILE) # Retried uploads to Google Sheets
+        self.store = ResultsStore(RESULTS_DB) # Indexed history, queried for earlier tests of a platform
+        self.persistence = PersistenceWorker(DATA_FILE, self.outbox, self.result_saved.emit, self.result_failed.emit, store=self.store)
+
     def init_buttons(self):
         # self.ui.button_test.clicked.connect(self.save_data)
         self.ui.button_test.clicked.connect(self.grade_part)
         self.ui.button_clear.clicked.connect(self.clear)
 
+    # Bias of each indicator, and the age of its reading once data arrives
     def show_bias(self):
-        self.ui.data1_bias.setTitle(f"{BIAS_BACK_ROW}")
-        self.ui.data2_bias.setTitle(f"{BIAS_BACK_ROW}")
-        self.ui.data3_bias.setTitle(f"{BIAS_BACK_ROW}")
-        self.ui.data4_bias.setTitle(f"{BIAS_MIDDLE_ROW}")
-        self.ui.data5_bias.setTitle(f"{BIAS_MIDDLE_ROW}")
-        self.ui.data6_bias.setTitle(f"{BIAS_MIDDLE_ROW}")
-        self.ui.data7_bias.setTitle(f"{BIAS_FRONT_ROW}")
-        self.ui.data8_bias.setTitle(f"{BIAS_FRONT_ROW}")
-        self.ui.data9_bias.setTitle(f"{BIAS_FRONT_ROW}")
+        bias_boxes = [self.ui.data1_bias, self.ui.data2_bias, self.ui.data3_bias,
+                      self.ui.data4_bias, self.ui.data5_bias, self.ui.data6_bias,
+                      self.ui.data7_bias, self.ui.data8_bias, self.ui.data9_bias]
+        now_ns = monotonic_ns()
+        ages = reading_ages_ms(self.frame, now_ns) if self.frame is not None else [None] * len(BIASES)
+        stale = self.frame.valid_mask & ~fresh_mask(self.frame, now_ns) if self.frame is not None else 0 # Readings grade_part would drop
+
+        for slot, (box, bias, age) in enumerate(zip(bias_boxes, BIASES, ages)):
+            if age is None:
+                box.setTitle(f"{bias}")
+            elif stale >> slot & 1:
+                box.setTitle(f"{bias} | STALE {age / 1000:.1f} s")
+            else:
+                box.setTitle(f"{bias} | {age} ms")
 
     def new_serial_port_connected(self, dataPortName):
         self.data_port = dataPortName
         self.ui.serial_handler_output.setText(dataPortName)
 
-    # Initialise getting SERIAL PORTS
-    def init_serport_getter(self):
-        self.serport_getter = SerialPortGetter() # Serial port worker
-        self.serport_thread = QThread() # Port Getter Thread
-        # self.serport_thread.setParent(self)
+    # Initialise USB hotplug events, reconnects controller & scanner when plugged in
+    def init_hotplug_watcher(self):
+        self.hotplug_watcher = HotplugWatcher(self.port_discovery) # Hotplug worker
+        self.hotplug_thread = QThread() # Hotplug Thread
 
-        self.serport_getter.moveToThread(self.serport_thread)
+        self.hotplug_watcher.moveToThread(self.hotplug_thread)
 
         # Start signal
-        self.serport_thread.started.connect(self.serport_getter.getPorts)
+        self.hotplug_thread.started.connect(self.hotplug_watcher.start)
+
+        # Device signals, queued onto the data & scanner threads
+        self.hotplug_watcher.device_added.connect(self.data_getter.deviceAdded)
+        self.hotplug_watcher.device_removed.connect(self.data_getter.deviceRemoved)
+        self.hotplug_watcher.device_added.connect(self.qr_scanner.device_added)
+        self.hotplug_watcher.device_removed.connect(self.qr_scanner.device_removed)
 
-        # Serve serial ports signal
-        # self.serport_getter.dataOut.connect(self.serveSerialPorts) # Connect data signal to receiver function
-        
         # Termination Signals
-        self.serport_getter.finished.connect(self.serport_thread.quit) # When getter is finished, tell thread to quit
-        self.serport_getter.finished.connect(self.serport_thread.wait) # When getter is finished, tell thread to quit
-        self.serport_thread.finished.connect(self.serport_thread.deleteLater) # When thread is finished, signal thread cleanup
-        self.serport_getter.finished.connect(self.serport_getter.deleteLater) # When getter is finished, signal getter cleanup
-        self.serport_thread.start()
+        self.hotplug_watcher.finished.connect(self.hotplug_thread.quit) # When watcher is finished, tell thread to quit
+        self.hotplug_watcher.finished.connect(self.hotplug_thread.wait) # Wait for thread to finish quitting
+        self.hotplug_thread.finished.connect(self.hotplug_thread.deleteLater) # When thread is finished, signal thread cleanup
+        self.hotplug_watcher.finished.connect(self.hotplug_watcher.deleteLater) # When watcher is finished, signal watcher cleanup
+        self.hotplug_thread.start()
 
     # Initialising getting DATA FROM SERIAL PORT
     def init_data_getter(self):
-        self.data_getter = DataGetter() # Serial port worker
+        recorder = CaptureRecorder(CAPTURE_DIR) if CAPTURE_DIR is not None else None
+        self.data_getter = DataGetter(self.port_discovery, recorder) # Serial port worker
         self.data_thread = QThread() # Port Getter Thread
         # self.data_thread.setParent(self)
 
@@ -132,6 +182,8 @@ class MainWindow(QMainWindow):
         self.data_getter.new_serial_port_name.connect(self.new_serial_port_connected)
 
         # Termination Signals
+        # Port and capture recorder are only touched from the data thread, closing them from here races dataAvailable
+        self.stop_data_getter.connect(self.data_getter.finish, Qt.BlockingQueuedConnection)
         self.data_getter.finished.connect(self.data_thread.quit) # When getter is finished, tell thread to quit
         self.data_getter.finished.connect(self.data_thread.wait) # Wait for thread to finish quitting
         self.data_thread.finished.connect(self.data_thread.deleteLater) # When thread is finished, signal thread cleanup
@@ -144,7 +196,8 @@ class MainWindow(QMainWindow):
 
     # Initialise QR Scanner
     def init_qr_scanner(self):
-        self.qr_scanner = QRScanner()
+        self.qr_scanner = QRScanner(self.port_discovery)
+        self.qr_scanner.continuous = QR_CONTINUOUS_SCAN
         self.qr_scanner_thread = QThread()
         # self.qr_scanner_thread.setParent(self)
 
@@ -155,6 +208,7 @@ class MainWindow(QMainWindow):
 
         # Signals
         self.get_qr_id.connect(self.qr_scanner.read_qr)
+        self.cancel_qr_scan.connect(self.qr_scanner.cancel_scan)
 
         # Termination Signals
         self.qr_scanner.finished.connect(self.qr_scanner_thread.quit) # When getter is finished, tell thread to quit
@@ -166,6 +220,11 @@ class MainWindow(QMainWindow):
     def grade_part(self):
         self.clear()
         self.ui.button_test.setText("...")
+        self.part_grader = None
+        self.grade_timer.stop()
+
+        # Nothing from the last part may be saved under this part's identifier
+        self.identifier = self.parallelism_value = self.graded_result = self.graded_data = None
 
         # if self.ui.serialport_select1.currentText() == "No Device":
         #     self.ui.grade_data.setText("No Device")
@@ -177,44 +236,75 @@ class MainWindow(QMainWindow):
             self.ui.parallelism_data.setText("No Device")
             self.ui.button_test.setText("TEST PLATFORM")
             return
-    
-        if not self.data or self.num_valid_data < 8: # Accepts 8 or 9 data points
-            self.ui.grade_data.setText("DATA ERROR")
-            self.ui.parallelism_data.setText("DATA ERROR")
+
+        # Scan runs on the scanner thread while grading, identifier arrives on show_identifier
+        self.get_qr_id.emit()
+
+        # Grading rules live in SequentialGrader.PartGrader, shared with the headless engine.
+        # The current sweep, then sequential grading carries on in display_values as sweeps arrive
+        self.part_grader = PartGrader(BIASES, SEQUENTIAL_GRADING)
+        self.grade_sweep()
+
+    # Add the latest sweep to the part's grade
+    def grade_sweep(self):
+        decided = self.part_grader.add(self.frame)
+        if decided is None:
+            self.ui.button_test.setText(f"... {self.part_grader.sweeps}")
+            self.grade_timer.start(MAX_READING_AGE_MS)
+            return
+
+        self.grade_timer.stop()
+
+        result, readings = decided
+        if self.part_grader.sequential is not None and result.grade != DATA_ERROR:
+            print(f"Sequential grade {result.grade} after {self.part_grader.sweeps} sweeps: {result.max_min} +/- {self.part_grader.sequential.uncertainty:.4f}")
+        self.part_grader = None
+        self.show_result(result, readings)
+
+    # Controller went quiet or was unplugged mid grade, DATA ERROR as the headless engine gives
+    def grade_timed_out(self):
+        if self.part_grader is None:
+            return
+
+        print(f"No sweep for {MAX_READING_AGE_MS} ms while grading")
+        self.frame = None
+        self.grade_sweep()
+
+    def show_result(self, result, readings: list):
+        self.graded_data = list(readings)
+        self.graded_result = result
+
+        if result.grade == DATA_ERROR:
+            self.cancel_qr_scan.emit()
+            self.ui.grade_data.setText(DATA_ERROR)
+            self.ui.parallelism_data.setText(DATA_ERROR)
             self.ui.button_test.setText("TEST PLATFORM")
             self.parallelism_value = None
             return
 
-        # Calculating parallelism value
-        float_data = [float(value) for value in self.data.values() if value != "--.---"]
-        max_min = round(abs(max(float_data) - min(float_data)), 3)
-        self.parallelism_value = str(max_min)
-
+        self.parallelism_value = str(result.max_min)
         self.ui.parallelism_data.setText(self.parallelism_value)
 
-        if (max_min <= PASS_CRITERIA):
-            self.ui.grade_data.setText("PASS")
-            self.ui.grade_data.setStyleSheet("background: green")
-        else:
-            self.ui.grade_data.setText("FAIL")
-            self.ui.grade_data.setStyleSheet("background: red")
-        
-        # Highlight points
-        max_index = float_data.index(max(float_data))
-        min_index = float_data.index(min(float_data))
-        self.highlight_points([max_index, min_index])
+        self.ui.grade_data.setText(result.grade)
+        self.ui.grade_data.setStyleSheet("background: green" if result.grade == PASS else "background: red")
 
-        self.get_qr_id.emit()
+        # Highlight points
+        self.highlight_points([result.max_index, result.min_index])
 
         # Reset
         self.ui.button_test.setText("TEST PLATFORM")
 
+        # Identifier came in while sweeps were still being graded
+        if self.identifier is not None:
+            self.save_data()
+
     def show_identifier(self, qr_code_text):
         self.ui.identifier_data.setText(str(qr_code_text))
         self.identifier = qr_code_text
 
-        # Save data
-        self.save_data()
+        # Save data, or once the sequential grade is decided
+        if self.part_grader is None:
+            self.save_data()
 
     def highlight_points(self, points):
         for point in points:
@@ -273,7 +363,7 @@ class MainWindow(QMainWindow):
             self.ui.data8.setText("No Data")
             self.ui.data9.setText("No Data")
 
-            self.data_getter.finish()
+            self.stop_data_getter.emit()
             self.portCurrent = None
             return
 
@@ -287,49 +377,25 @@ class MainWindow(QMainWindow):
             self.portCurrent = portName
             self.new_serial_port_name.emit(portName)
 
-    # Display received values
-    def display_values(self, data):
-        assert(type(data) is dict)
-
-        self.data = data
-
-        # Apply bias to numbers that are valid
-        self.num_valid_data = 9
-        for key, value in self.data.items():
-            # Check if value is a valid real number
-            if self.data[key] == "--.---":
-                self.num_valid_data -= 1 # Decrement number of valid data
-                continue
-
-            # Apply bias to numbers that are valid
-            match int(key):
-                case 0 | 1 | 2:
-                    self.data[key] = f"{round(float(value) + BIAS_BACK_ROW, 3)}"
-                case 3 | 4 | 5:
-                    self.data[key] = f"{round(float(value) + BIAS_MIDDLE_ROW, 3)}"
-                case 6 | 7 | 8:
-                    self.data[key] = f"{round(float(value) + BIAS_FRONT_ROW, 3)}"
-
-        for key, value in self.data.items():
-            match int(key):
-                case 0:
-                    self.ui.data1.setText(value)
-                case 1:
-                    self.ui.data2.setText(value)
-                case 2:
-                    self.ui.data3.setText(value)
-                case 3:
-                    self.ui.data4.setText(value)
-                case 4:
-                    self.ui.data5.setText(value)
-                case 5:
-                    self.ui.data6.setText(value)
-                case 6:
-                    self.ui.data7.setText(value)
-                case 7:
-                    self.ui.data8.setText(value)
-                case 8:
-                    self.ui.data9.setText(value)
+    # Display received values, one call per complete sweep frame
+    def display_values(self, frame):
+        self.frame = frame
+        self.readings = frame.mm(BIASES)
+
+        if self.part_grader is not None:
+            self.grade_sweep()
+
+        # Hands-free, the platform settled after being placed
+        if self.settle_detector is not None and self.settle_detector.add(frame.values, frame.timestamp_ns):
+            print(f"Platform settled, testing (sweep {frame.sequence})")
+            self.grade_part()
+
+        # Readings stay numbers, text only for the labels
+        data_boxes = [self.ui.data1, self.ui.data2, self.ui.data3,
+                      self.ui.data4, self.ui.data5, self.ui.data6,
+                      self.ui.data7, self.ui.data8, self.ui.data9]
+        for box, value in zip(data_boxes, self.readings):
+            box.setText(reading_text(value))
 
     def save_data(self):
         if self.parallelism_value == None:
@@ -340,65 +406,34 @@ class MainWindow(QMainWindow):
             self.ui.identifier_data.setText("No Identifier Data")
             return
 
-        date = datetime.now().strftime("%H:%M - %d/%m/%Y")
-        PlatformID = self.ui.identifier_data.text().strip()
-        grade = self.ui.grade_data.text()
-        MaxMin = self.ui.parallelism_data.text()
-        point_data = {
-            "0": "-",
-            "1": "-",
-            "2": "-",
-            "3": "-",
-            "4": "-",
-            "5": "-",
-            "6": "-",
-            "7": "-",
-            "8": "-"
-        } if self.data == {} else self.data
-
-        if path.isfile(DATA_FILE):
-            file = pd.read_csv(DATA_FILE)
-
-
-            new_row = pd.DataFrame([{'Date': f'{date}',
-                                     'PlatformID': f'{PlatformID}',
-                                     'Grade': f"{grade}", 
-                                     'MaxMin': f'{MaxMin}',
-                                     '0': f'{point_data["0"]}',
-                                     '1': f'{point_data["1"]}',
-                                     '2': f'{point_data["2"]}',
-                                     '3': f'{point_data["3"]}',
-                                     '4': f'{point_data["4"]}',
-                                     '5': f'{point_data["5"]}',
-                                     '6': f'{point_data["6"]}',
-                                     '7': f'{point_data["7"]}',
-                                     '8': f'{point_data["8"]}'}])
-            file = pd.concat([file, new_row], ignore_index=True)
-            file.to_csv(DATA_FILE, index=False)
-        else:
-            print("File does not exist")
-
-        post_json_data = {
-            "date": f'{date}',
-            "platform_id": f'{PlatformID}',
-            "grade": grade,
-            "maxmin": f'{MaxMin}',
-            "data_points": point_data
-        }
-
-        success = post_to_google_sheets(json_data=post_json_data)
-        if success:
-            print("Successfully posted to Google Sheets")
-        else:
-            print("Failed to post to Google Sheets")
-        
+        # Saved on the persistence worker, result_was_saved / result_save_failed report back
+        record = make_record(self.ui.identifier_data.text(), self.graded_result, self.graded_data)
+        self.persistence.submit(record)
+
+    def result_was_saved(self, record):
+        # Indexed lookup, cheap enough for the GUI thread
+        earlier = [result.grade for result in self.store.tests_for(record.platform_id)[1:]]
+        print(f"Saved {record.platform_id}, {self.outbox.pending()} results waiting to upload"
+              f"{f', tested before: {earlier}' if earlier else ''}")
+
+    def result_save_failed(self, record, stage, message):
+        # Outbox and database failures are in data.csv all the same, only flag a part that is not on disk
+        if stage in (OUTBOX, STORE) or self.ui.identifier_data.text() != record.platform_id:
+            return
+        self.ui.identifier_data.setText(f"{record.platform_id} NOT SAVED")
+
     def terminate_threads(self):
-        if self.serport_thread.isRunning():
-            self.serport_getter.finish()
+        if self.hotplug_thread.isRunning():
+            self.hotplug_watcher.finish()
         if self.data_thread.isRunning(): # Thread for data getter
-            self.data_getter.finish()
+            self.stop_data_getter.emit()
+            self.data_thread.quit() # finished only reaches quit through the event loop, which has stopped
+            self.data_thread.wait()
         if self.qr_scanner_thread.isRunning(): # Thread for parallelism checker
             self.qr_scanner.finish_all()
+        self.persistence.close()
+        self.outbox.close()
+        self.store.close()
         print("Threads Terminated")
 
 if __name__ == "__main__":
@@ -1,16 +1,23 @@
 from PySide6.QtSerialPort import QSerialPortInfo, QSerialPort
-from PySide6.QtCore import QObject, Signal, QByteArray, QTimer
-from time import sleep
+from PySide6.QtCore import QObject, Signal, QByteArray, QTimer, QDeadlineTimer, QElapsedTimer
 from typing import Tuple
 
-# Identification command
+from PortDiscovery import PortDiscovery, is_scanner_candidate
+import ScannerCodec
+from ScannerCodec import ScannerStreamDecoder, TriggerScan, ResponseType, RESPONSE, CODE, IDLE, CODE_IDLE_MS, NO_CONFIRM, REFUSED
 
-scanner_identify_command = QByteArray(bytearray([0x7E, 0x00, 0x07, 0x01, 0x00, 0xE0, 0x01, 0xAB, 0xCD]))
-command_mode_command = QByteArray(bytearray([0x7E, 0x00, 0x08, 0x01, 0x00, 0x00, 0x01, 0xAB, 0xCD]))
-trigger_command = QByteArray(bytearray([0x7E, 0x00, 0x08, 0x01, 0x00, 0x02, 0x01, 0xAB, 0xCD])) # Page 21
-save_setting_command = QByteArray(bytearray([0x7E, 0x00, 0x09, 0x01, 0x00, 0x00, 0x00, 0xDE, 0xC8]))
+# Commands, CRCs computed by the codec
+scanner_identify_command = QByteArray(ScannerCodec.IDENTIFY_COMMAND)
+command_mode_command = QByteArray(ScannerCodec.COMMAND_MODE_COMMAND)
+continuous_mode_command = QByteArray(ScannerCodec.CONTINUOUS_MODE_COMMAND)
+save_setting_command = QByteArray(ScannerCodec.SAVE_SETTING_COMMAND)
+restore_defaults_command = QByteArray(ScannerCodec.RESTORE_DEFAULTS_COMMAND)
 
-restore_defaults_command = QByteArray(bytearray([0x7E, 0x00, 0x09, 0x01, 0x00, 0x00, 0xFF, 0xAB, 0xCD]))
+# Bound for probing all candidate ports together, and the wait per port per round
+PROBE_TIMEOUT_MS = 150
+PROBE_SLICE_MS = 5
+
+CONTINUOUS_CODE_MAX_AGE_MS = 3000 # Continuous mode, codes older than this are not reused
 
 class QRScanner(QObject):
     #Signals
@@ -21,71 +28,133 @@ class QRScanner(QObject):
     qr_port_name = None
     scanner = None
 
-    def __init__(self, parent=None):
+    def __init__(self, discovery: PortDiscovery, parent=None):
         super().__init__(parent)
+        self.discovery = discovery
+
+        self.parser = ScannerStreamDecoder()
+        self.scan = TriggerScan() # Trigger / confirm / code exchange, shared with JigEngine
+        self.retried = False
+
+        self.pending_baud_rate = None
+        self.last_code = None
+        self.last_code_timer = QElapsedTimer()
+
+        # Timers are children so they move to the scanner thread with this object
+        self.timeout_timer = QTimer(self)
+        self.timeout_timer.setSingleShot(True)
+        self.timeout_timer.timeout.connect(self.timed_out)
+
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.timeout.connect(self.flush_code)
+
+    @property
+    def continuous(self) -> bool:
+        return self.scan.continuous
+
+    @continuous.setter
+    def continuous(self, enabled: bool):
+        self.scan.continuous = enabled
 
     def find_scanner(self) -> Tuple[bool, str]: # CONNECTED TO CONNECT SCANNER BUTTON
         # Target the right port
         if self.scanner != None:
             self.scanner.close()
 
-        ports = QSerialPortInfo.availablePorts()
+        self.discovery.refresh(QSerialPortInfo.availablePorts())
+
+        # Scanner that won last time is tried first, without probing. A failed trigger forgets it
+        known = self.discovery.lookup("scanner")
+        if known is not None:
+            print(f"Known scanner: {known.port_name} - {known.key}")
+            return True, known.port_name
+
+        # Only probe ports that could be the scanner and are not already known as something else
+        candidates = self.discovery.candidates(is_scanner_candidate)
 
         # No available ports to browse
-        if len(ports) == 0:
+        if len(candidates) == 0:
             print("No ports to scan")
             self.qr_identifier.emit("No Scanner Connected")
             return False, ""
 
-        # Browse ports
-        for port in ports:
-            # Skip ports that we are sure are not the scanner
-            if port.description() not in ["USB Serial Device", "USB Single Serial", "USBKey Module"]:
-                print(f"Skipped port: {port.portName()} - {port.description()}")
-                continue
-
-            # Check if port is opened by another process, eliminates the data port from being scanned
-            # print(port.isNull())
+        port = self.probe_ports(candidates)
+        if port is None:
+            # No scanners found
+            print("No scanner found")
+            return False, ""
 
-            print(f"Scanning port: {port.portName()} - {port.description()} (Total ports: {len(ports)})")
+        print("Scanner Found!")
+        self.discovery.remember("scanner", port)
+        return True, port.port_name
+
+    def probe_ports(self, candidates: list):
+        '''
+        Send the identify command to every candidate at once, then collect replies
+        until the first valid one or PROBE_TIMEOUT_MS. Connect time stays about one
+        round trip however many USB serial devices are plugged in.
+
+        Returns:
+            PortIdentity | None: Port that answered as the scanner
+        '''
+        probes = []
+        for identity in candidates:
+            print(f"Scanning port: {identity.port_name} - {identity.description} (Total candidates: {len(candidates)})")
             temp_port = QSerialPort()
-            temp_port.setPortName(port.portName())
+            temp_port.setPortName(identity.port_name)
             temp_port.setBaudRate(QSerialPort.Baud9600, QSerialPort.AllDirections)
             temp_port.setDataBits(QSerialPort.Data8)
             temp_port.setParity(QSerialPort.NoParity)
             temp_port.setStopBits(QSerialPort.OneStop)
             temp_port.open(QSerialPort.ReadWrite)
-            
+
             # Check if port has been opened
             if not temp_port.isOpen():
                 print(f"Failed to open port: Error {temp_port.error()}")
                 temp_port.close()
                 continue
 
-            # Send command to identify scanner once opened
+            # Send command to identify scanner once opened, all ports reply in parallel
             temp_port.write(scanner_identify_command)
-
-            # Wait and read response
-            data = []
-            if temp_port.waitForReadyRead(100):  # Wait for up to 1000 ms
-                data = list(temp_port.readAll().data())
-                data = [hex(byte) for byte in data]
-            else:
-                print("Timeout waiting for data.")
-            
+            temp_port.waitForBytesWritten(PROBE_SLICE_MS)
+            probes.append((identity, temp_port, bytearray()))
+
+        # Round robin over the ports still waiting, replies already buffered are picked up immediately
+        deadline = QDeadlineTimer(PROBE_TIMEOUT_MS)
+        found = None
+        pending = list(probes)
+        while pending and found is None and not deadline.hasExpired():
+            for probe in list(pending):
+                identity, temp_port, data = probe
+                if not temp_port.waitForReadyRead(min(PROBE_SLICE_MS, max(deadline.remainingTime(), 0))):
+                    continue
+
+                data += temp_port.readAll().data()
+                if not data.startswith(ScannerCodec.RESPONSE_HEAD[:len(data)]):
+                    pending.remove(probe) # Talks, but not the scanner protocol
+                    continue
+
+                response = ScannerCodec.decode_response(memoryview(data))
+                if response is None:
+                    continue
+
+                # Check response for scanner
+                pending.remove(probe)
+                if self.is_scanner(response):
+                    found = identity
+                    break
+
+        if found is None:
+            print("Timeout waiting for data.")
+
+        for identity, temp_port, data in probes:
             temp_port.close()
 
-            # Check response for scanner
-            if self.is_scanner(data):
-                print("Scanner Found!")
-                return True, port.portName()
-
-        # No scanners found
-        print("No scanner found")
-        return False, ""
+        return found
 
-    def is_scanner(self, data: list) -> bool:
-        return data == ['0x2', '0x0', '0x0', '0x1', '0x2', '0x13', '0x73']
+    def is_scanner(self, response: ScannerCodec.Response) -> bool:
+        return response.kind == ResponseType.SCANNER_ID
     
     def connect_scanner(self) -> bool:
         # Find scanner if not connected
@@ -94,16 +163,22 @@ class QRScanner(QObject):
 
             # No scanner found
             if not port_found:
+                self.qr_port_name = None
                 return False
             
             # Scanner found, open a new connection to it
-            self.scanner = QSerialPort()
+            self.scanner = QSerialPort(self)
             self.scanner.setPortName(self.qr_port_name)
             self.scanner.setBaudRate(QSerialPort.Baud9600, QSerialPort.AllDirections)
             self.scanner.setDataBits(QSerialPort.Data8)
             self.scanner.setParity(QSerialPort.NoParity)
             self.scanner.setStopBits(QSerialPort.OneStop)
+            self.scanner.readyRead.connect(self.data_available)
             self.scanner.open(QSerialPort.ReadWrite)
+            self.parser.reset()
+
+            if self.continuous:
+                self.scanner.write(continuous_mode_command)
 
             return True
 
@@ -111,8 +186,18 @@ class QRScanner(QObject):
             self.read_qr()
             return True
 
-    # Trigger scan and report back data
+    # Trigger scan, the code is reported on qr_identifier when it arrives
     def read_qr(self) -> bool: # CONNECTED TO SIGNAL get_qr_id
+        if self.scan.state != IDLE:
+            print("Scan already in progress")
+            return True
+
+        # Continuous mode already has a recent code, no need to wait for the next one
+        if self.continuous:
+            if self.last_code is not None and self.last_code_timer.isValid() and self.last_code_timer.elapsed() < CONTINUOUS_CODE_MAX_AGE_MS:
+                self.qr_identifier.emit(self.last_code)
+                return True
+
         if self.qr_port_name is None:
             print("No Scanner Connected, attempting to reconnect...")
             connected = self.connect_scanner()
@@ -121,36 +206,134 @@ class QRScanner(QObject):
                 self.qr_identifier.emit("Scanner Not Connected")
                 return False
 
-        # Verify scanner before doing anything
-        if not self.trigger_scanner():
-            print("Scanner Not Triggered. Attempting to reconnect...")
-
-            # Attempt to reconnect
-            connected = self.connect_scanner()
-
-            if not connected:
-                self.qr_identifier.emit("Scanner Not Connected")
-                return False
+        # Continuous mode scans on its own, just wait for the next code
+        if self.continuous:
+            self.follow(self.scan.start())
+            return True
 
-            print("Scanner Reconnected")
-            self.trigger_scanner()
+        self.retried = False
+        return self.trigger_scanner()
+
+    # Stop waiting for an ACK or a code, eg test aborted with DATA ERROR
+    def cancel_scan(self):
+        if self.scan.state == IDLE:
+            return
+
+        print("Scan cancelled")
+        self.follow(self.scan.cancel())
+
+    def set_continuous_mode(self, enabled: bool):
+        self.scan.continuous = enabled
+        self.last_code = None
+        if self.scanner is not None and self.scanner.isOpen():
+            self.scanner.write(continuous_mode_command if enabled else command_mode_command)
+
+    # Faster link to the scanner, not saved to its flash so a power cycle goes back to 9600 for probing
+    def set_baud_rate(self, baud_rate: int):
+        if self.scanner is None or not self.scanner.isOpen() or self.scan.state != IDLE:
+            return
+
+        self.pending_baud_rate = baud_rate
+        self.scanner.write(QByteArray(ScannerCodec.build_baud_rate(baud_rate)))
+
+    def data_available(self):
+        for kind, payload in self.parser.feed(self.scanner.readAll().data()):
+            self.handle(kind, payload)
+
+        # Codes are not always terminated, take what has arrived once the line goes quiet
+        if self.parser.has_pending_text():
+            self.idle_timer.start(CODE_IDLE_MS)
+
+    def flush_code(self):
+        for kind, payload in self.parser.flush():
+            self.handle(kind, payload)
+
+    def handle(self, kind: str, payload):
+        if kind == RESPONSE:
+            # Baud rate change accepted, follow the scanner to its new speed
+            if self.pending_baud_rate is not None and payload.kind == ResponseType.ACK:
+                self.scanner.setBaudRate(self.pending_baud_rate, QSerialPort.AllDirections)
+                self.pending_baud_rate = None
+                return
+
+        elif kind == CODE and self.continuous:
+            self.last_code = payload
+            self.last_code_timer.start()
+
+        step = self.scan.handle(kind, payload)
+        if step is not None:
+            if kind == RESPONSE and not step.done:
+                print("Scan trigger confirm")
+            self.follow(step)
+
+    def timed_out(self):
+        self.follow(self.scan.timed_out())
+
+    # Carry out what the scan asks for: command, timeout, result
+    def follow(self, step: ScannerCodec.ScanStep):
+        if step.write is not None and self.scanner is not None:
+            self.scanner.write(QByteArray(step.write))
+
+        if step.wait_ms == 0:
+            self.timeout_timer.stop()
+        elif step.wait_ms is not None:
+            self.timeout_timer.start(step.wait_ms)
+
+        if step.done:
+            self.scan_done(step)
+
+    def scan_done(self, step: ScannerCodec.ScanStep):
+        if step.code is not None:
+            self.qr_identifier.emit(step.code)
+
+        elif step.failure == NO_CONFIRM:
+            print("No trigger confirm, closing port. No scanner connected.")
+            self.close_scanner()
+            self.discovery.forget("scanner") # Probe every candidate next time
+
+            # Attempt to reconnect once
+            if not self.retried:
+                self.retried = True
+                print("Scanner Not Triggered. Attempting to reconnect...")
+                if self.connect_scanner():
+                    print("Scanner Reconnected")
+                    self.trigger_scanner()
+                    return
 
-        # Scan and read back data
-        if self.scanner.waitForReadyRead(2000):  # Wait for up to 1000 ms
-            data = list(self.scanner.readAll().data())
-            data = [hex(byte) for byte in data]
+            self.qr_identifier.emit("No Scanner Connected") # No response from scanner
 
-            # Send data on signal
-            ascii_string = ''.join([chr(int(h, 16)) for h in data])
-            self.qr_identifier.emit(ascii_string)
+        elif step.failure == REFUSED:
+            print("Trigger confirm failed.")
+            self.qr_identifier.emit("No QR code found")
 
-            return True
         else:
             print("Timeout waiting for data. No QR code found")
             self.qr_identifier.emit("No QR code found") # No response from scanner
 
-            return False
-        
+    # Hotplug slots
+    def device_added(self, kind, port_name):
+        if kind != "scanner" or self.qr_port_name is not None:
+            return
+
+        print(f"Scanner candidate plugged in: {port_name}")
+        self.connect_scanner()
+
+    def device_removed(self, kind, port_name):
+        if port_name != self.qr_port_name:
+            return
+
+        print(f"Scanner unplugged: {port_name}")
+        self.close_scanner()
+
+    def close_scanner(self):
+        self.timeout_timer.stop()
+        self.idle_timer.stop()
+        self.scan.reset()
+        if self.scanner is not None:
+            self.scanner.close()
+            self.scanner.deleteLater()
+        self.scanner = self.qr_port_name = None
+
     def finish_all(self):
         if self.scanner is not None:
             self.scanner.close()
@@ -160,25 +343,8 @@ class QRScanner(QObject):
         if self.scanner is None or self.qr_port_name is None:
             return False
 
-        # Send trigger command and wait for confirm response
-        self.scanner.write(trigger_command)
-        
-        data = []
-        if self.scanner.waitForReadyRead(200):  # Wait for up to 1000 ms
-            data = list(self.scanner.readAll().data())
-            data = [hex(byte) for byte in data]
-        else:
-            print("No trigger confirm, closing port. No scanner connected.")
-            self.scanner.close()
-            self.scanner = self.qr_port_name = None
-            self.qr_identifier.emit("No Scanner Connected") # No response from scanner
-            return False
-        
-        # Check if trigger command was confirmed
-        success = self.is_trigger_confirm(data)
-        print("Scan trigger confirm" if success else "Trigger confirm failed.")
-        
-        return success
-
-    def is_trigger_confirm(self, ret_data: list) -> bool:
-        return ret_data == ['0x2', '0x0', '0x0', '0x1', '0x0', '0x33', '0x31']
+        # Send trigger command, the confirm response arrives on readyRead
+        self.parser.reset()
+        self.follow(self.scan.start())
+
+        return True
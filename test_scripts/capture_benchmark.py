@@ -0,0 +1,137 @@
+import random
+import shutil
+import sys
+import tempfile
+from os import path
+from time import monotonic, perf_counter, perf_counter_ns, sleep
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from CaptureLog import CaptureRecorder, capture_files, replay
+from SerialFramer import ReadingFramer, SweepAssembler
+from framer_benchmark import MUX_PORTS_IN_USE, chunk, generate_capture
+
+'''
+Measures what the capture recorder adds to each serial read on the ingest
+thread, then replays the capture and checks every sweep comes back the same.
+
+Back to back reads keep the compressor busy the whole run, far above the
+controller's real rate, so the per-read overhead there is a worst case.
+Reads paced at READ_GAP_S while a full segment compresses show what a jig
+sees: how late the reader wakes up, against the same reads with nothing
+compressing.
+
+Usage:
+    python3 capture_benchmark.py
+'''
+
+def ingest(chunks, recorder=None) -> list:
+    # DataGetter.dataAvailable without Qt
+    framer = ReadingFramer()
+    assembler = SweepAssembler(MUX_PORTS_IN_USE)
+    frames = []
+    timestamp_ns = 0
+    for piece in chunks:
+        timestamp_ns += 1_000_000
+        if recorder is not None:
+            recorder.write(timestamp_ns, piece)
+        for index, microns in framer.feed(piece):
+            frame = assembler.add(index, microns, timestamp_ns)
+            if frame is not None:
+                frames.append(frame.values)
+    return frames
+
+def write_latency(recorder, chunks) -> list:
+    latencies = []
+    for piece in chunks:
+        start = perf_counter_ns()
+        recorder.write(0, piece)
+        latencies.append(perf_counter_ns() - start)
+    latencies.sort()
+    return latencies
+
+READ_GAP_S = 0.001
+PACED_S = 1.0
+
+def paced_wakeups(recorder, chunks, compressing: bool) -> tuple:
+    '''
+    Returns:
+        tuple: (sorted ns each paced read woke up late, sorted ns in write())
+    '''
+    index = 0
+    if compressing:
+        # Fill the first segment as fast as possible, the compressor starts on it as the reads begin
+        while recorder.current == 0:
+            recorder.write(0, chunks[index % len(chunks)])
+            index += 1
+
+    late, writes = [], []
+    end = monotonic() + PACED_S
+    while monotonic() < end:
+        start = perf_counter_ns()
+        sleep(READ_GAP_S)
+        woke = perf_counter_ns()
+        recorder.write(0, chunks[index % len(chunks)])
+        writes.append(perf_counter_ns() - woke)
+        late.append(woke - start - READ_GAP_S * 1e9)
+        index += 1
+    return sorted(late), sorted(writes)
+
+def percentiles_us(latencies: list) -> str:
+    return f"p50 {latencies[len(latencies) // 2] / 1e3:.1f} us, p99 {latencies[len(latencies) * 99 // 100] / 1e3:.1f} us, max {latencies[-1] / 1e3:.0f} us"
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    capture = generate_capture()
+    chunks = chunk(capture)
+    directory = tempfile.mkdtemp()
+    print(f"{len(capture) / 1e6:.1f} MB in {len(chunks)} reads")
+
+    try:
+        start = perf_counter()
+        expected = ingest(chunks)
+        plain = perf_counter() - start
+
+        recorder = CaptureRecorder(path.join(directory, "run"), segment_size=1024 * 1024)
+        start = perf_counter()
+        recorded = ingest(chunks, recorder)
+        with_capture = perf_counter() - start
+        recorder.close()
+
+        per_read_ns = (with_capture - plain) / len(chunks) * 1e9
+        print(f"ingest         {plain:6.2f} s")
+        print(f"ingest+capture {with_capture:6.2f} s, +{(with_capture - plain) / plain:.1%}, {per_read_ns:.0f} ns per read")
+        print(f"dropped chunks {recorder.dropped_chunks}")
+
+        recorder = CaptureRecorder(path.join(directory, "latency"), segment_size=1024 * 1024)
+        latencies = write_latency(recorder, chunks)
+        recorder.close()
+        print(f"write() back to back, {recorder.dropped_chunks} dropped while the compressor caught up: {percentiles_us(latencies)}")
+
+        for compressing in (False, True):
+            recorder = CaptureRecorder(path.join(directory, f"paced-{compressing}"))
+            late, writes = paced_wakeups(recorder, chunks, compressing)
+            recorder.close()
+            print(f"reads every {READ_GAP_S * 1e3:g} ms, {'a 4 MB segment compressing' if compressing else 'nothing compressing'}: "
+                  f"woke late {percentiles_us(late)}, write() {percentiles_us(writes)}")
+
+        files = capture_files(path.join(directory, "run"))
+        compressed = sum(path.getsize(file) for file in files)
+        print(f"{len(files)} captures, {compressed / 1e6:.2f} MB compressed ({compressed / len(capture):.0%} of raw)")
+
+        # Replay as fast as possible through a fresh framer
+        framer = ReadingFramer()
+        assembler = SweepAssembler(MUX_PORTS_IN_USE)
+        replayed = []
+
+        def feed(piece, timestamp_ns):
+            for index, microns in framer.feed(piece):
+                frame = assembler.add(index, microns, timestamp_ns)
+                if frame is not None:
+                    replayed.append(frame.values)
+
+        start = perf_counter()
+        count = replay(files, feed, speed=0)
+        print(f"replayed {count} reads in {perf_counter() - start:.2f} s, sweeps match: {replayed == recorded == expected}")
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,54 @@
+import argparse
+import subprocess
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+
+'''
+Imports each module in a fresh interpreter and reports the import time,
+peak memory and whether PySide6 got loaded. ParallelismCore must import
+without PySide6, for batch scripts and worker processes.
+
+Usage:
+    python3 core_import_check.py [--runs 5]
+'''
+
+APP_DIR = path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism")
+
+PROBE = """
+import resource, sys
+from time import perf_counter
+start = perf_counter()
+import {module}
+elapsed = perf_counter() - start
+print(elapsed * 1000, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 'PySide6' in sys.modules)
+"""
+
+def probe(module: str, runs: int):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=APP_DIR,
+                                capture_output=True, text=True, check=True).stdout.split()
+        samples.append((float(output[0]), float(output[1]), output[2] == "True"))
+    return min(sample[0] for sample in samples), max(sample[1] for sample in samples), samples[0][2]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check ParallelismCore imports without Qt")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module, fastest is reported")
+    args = parser.parse_args()
+
+    print(f"{'module':>20} | {'import ms':>9} | {'peak MB':>7} | PySide6")
+    ok = True
+    for module in ["numpy", "ParallelismCore", "ParallelismChecker"]:
+        try:
+            import_ms, peak_mb, qt = probe(module, args.runs)
+        except subprocess.CalledProcessError as error:
+            print(f"{module:>20} | import failed: {error.stderr.strip().splitlines()[-1]}")
+            ok &= module != "ParallelismCore"
+            continue
+        print(f"{module:>20} | {import_ms:9.1f} | {peak_mb:7.1f} | {'loaded' if qt else '-'}")
+        if module == "ParallelismCore":
+            ok &= not qt
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,100 @@
+import argparse
+import sys
+from os import path
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from Flatness import LEAST_SQUARES, METHODS, MINIMUM_ZONE, THREE_POINT, flatness, flatness_batch
+from RestingPlane import TOLERANCE_MM, grid_layout, resting_plane
+from parallelism_batch_benchmark import generate
+
+'''
+Checks Flatness.py and times it.
+
+    check     3x3 minimum zone against the pivot solver on every reading
+              minus every other, three point against RestingPlane, and no
+              fit narrower than the minimum zone. Repeated on 4x4 and 5x5
+              layouts, which always pivot
+    one-off   per call latency of each method, as in the GUI path
+    batch     rows per second of flatness_batch on --rows platforms, split
+              into complete rows (enumerated) and rows with a missing reading
+
+Usage:
+    python3 flatness_benchmark.py [--rows 200000] [--check 2000]
+'''
+
+def zone_width(layout, heights) -> float:
+    # Upper hull of the pairwise differences over the origin, solved from scratch
+    present = np.flatnonzero(np.isfinite(heights))
+    first, second = np.nonzero(~np.eye(len(present), dtype=bool))
+    plane = resting_plane(layout[present[first]] - layout[present[second]],
+                          heights[present[first]] - heights[present[second]], centre=(0.0, 0.0))
+    return plane.centre_height
+
+def check(layout, values) -> bool:
+    results = {method: flatness_batch(layout, values, method) for method in METHODS}
+    zone_failures = contact_failures = narrower = 0
+    for row, heights in enumerate(values):
+        zone_failures += abs(zone_width(layout, heights) - results[MINIMUM_ZONE].flatness[row]) > TOLERANCE_MM
+        try:
+            plane = resting_plane(layout, heights).coefficients
+        except ValueError:
+            plane = np.full(3, np.nan) # Centre outside the readings, the platform tips off
+        contact_failures += not np.allclose(plane, results[THREE_POINT].coefficients[row], atol=TOLERANCE_MM, equal_nan=True)
+        narrower += np.nanmin([results[LEAST_SQUARES].flatness[row], results[THREE_POINT].flatness[row]]) < results[MINIMUM_ZONE].flatness[row] - TOLERANCE_MM
+
+    widths = "  ".join(f"{method} {np.nanmean(results[method].flatness) * 1000:.1f}" for method in METHODS)
+    print(f"{len(layout):>3} indicators, {len(values)} platforms, mean flatness um: {widths}")
+    print(f"    minimum zone mismatches: {zone_failures}, three point mismatches: {contact_failures}, narrower than minimum zone: {narrower}")
+    return zone_failures == contact_failures == narrower == 0
+
+def grid_values(rows: int, columns: int, platforms: int, rng) -> np.ndarray:
+    layout = grid_layout(rows, columns)
+    tilt = rng.uniform(-0.01, 0.01, (platforms, 2))
+    values = 1.5 + tilt[:, :1] * layout[:, 0] + tilt[:, 1:] * layout[:, 1] + rng.normal(0, 0.008, (platforms, len(layout)))
+    values = np.round(values, 3)
+    values[rng.random(values.shape) < 0.02] = np.nan
+    return values
+
+def time_methods(layout, values):
+    complete = np.isfinite(values).all(axis=1)
+    print(f"{len(values)} rows, {(~complete).sum()} with a missing reading")
+    print(f"{'method':>13} | {'one-off us':>10} | {'batch rows/s':>12} | {'complete us/row':>15} | {'missing us/row':>14}")
+    for method in METHODS:
+        calls = min(len(values), 2000)
+        flatness(layout, values[0], method) # Builds the layout tables
+        start = perf_counter()
+        for heights in values[:calls]:
+            flatness(layout, heights, method)
+        one_off_s = (perf_counter() - start) / calls
+
+        start = perf_counter()
+        flatness_batch(layout, values[complete], method)
+        complete_s = perf_counter() - start
+        start = perf_counter()
+        flatness_batch(layout, values[~complete], method)
+        missing_s = perf_counter() - start
+        print(f"{method:>13} | {one_off_s * 1e6:10.1f} | {len(values) / (complete_s + missing_s):12,.0f}"
+              f" | {complete_s / max(complete.sum(), 1) * 1e6:15.2f} | {missing_s / max((~complete).sum(), 1) * 1e6:14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the flatness fits")
+    parser.add_argument("--rows", type=int, default=200_000, help="3x3 platforms timed in one batch")
+    parser.add_argument("--check", type=int, default=2000, help="Platforms per layout checked against the pivot solvers")
+    parser.add_argument("--missing", type=float, default=0.005, help="Share of --.--- readings")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    layout = grid_layout(3, 3)
+    values, valid = generate(args.rows, args.missing, args.seed)
+    values[~valid] = np.nan
+
+    ok = check(layout, values[:args.check])
+    rng = np.random.default_rng(args.seed)
+    for side in (4, 5):
+        ok &= check(grid_layout(side, side), grid_values(side, side, args.check // 10, rng))
+    time_methods(layout, values)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,121 @@
+import argparse
+import random
+import sys
+import tracemalloc
+from os import path
+from time import perf_counter
+from typing import NamedTuple
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from Grading import BIASES, MAX_READING_AGE_MS, apply_bias, fresh_mask, fresh_values, grade, reading_ages_ms
+from ParallelismCore import parse_readings, readings_data
+from SerialFramer import MUX_PORTS_IN_USE, SweepAssembler, SweepFrame
+
+'''
+Memory per SweepFrame and time per sweep from the assembler to a grade,
+against the tuple frame and string round trips they replace:
+
+    before  tuples of boxed ints, bias applied and formatted to
+            {"0": "1.509", ...} for display, parsed back for the grade and
+            ParallelismChecker.receive
+    now     array backed frame, SweepFrame.mm() floats straight to the grade,
+            text only for the labels
+
+Usage:
+    python3 frame_benchmark.py [--frames 100000]
+'''
+
+class TupleFrame(NamedTuple):
+    sequence: int
+    timestamp_ns: int
+    values: tuple
+    received_ns: tuple
+
+def readings(frames: int, seed: int) -> list:
+    # (port, microns) in arrival order, ~2% missing
+    rng = random.Random(seed)
+    stream = []
+    for _ in range(frames):
+        for port in MUX_PORTS_IN_USE:
+            stream.append((port, None if rng.random() < 0.02 else rng.randint(1400, 1600)))
+    return stream
+
+def frame_bytes(make, frames: int) -> float:
+    tracemalloc.start()
+    kept = [make(sequence) for sequence in range(frames)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size / frames
+
+def tuple_frame(sequence: int) -> TupleFrame:
+    # Fresh ints as decoded off the serial line, not the small int cache
+    values = tuple(None if slot == 3 else 1_400_000 + sequence * 9 + slot for slot in range(9))
+    return TupleFrame(sequence, 10**15 + sequence, values, tuple(10**15 + sequence * 9 + slot for slot in range(9)))
+
+def array_frame(sequence: int) -> SweepFrame:
+    values = [None if slot == 3 else 1_400_000 + sequence * 9 + slot for slot in range(9)]
+    return SweepFrame.from_values(sequence, 10**15 + sequence, values, [10**15 + sequence * 9 + slot for slot in range(9)])
+
+def tuple_fresh_values(frame: TupleFrame, now_ns: int) -> tuple:
+    # Grading.fresh_values on tuple frames
+    return tuple(None if age > MAX_READING_AGE_MS else microns for microns, age in zip(frame.values, reading_ages_ms(frame, now_ns)))
+
+def before(frames: list, now_ns: int) -> int:
+    graded = 0
+    for frame in frames:
+        # display_values / set_readings, then grade_part and ParallelismChecker.receive
+        values = frame.values
+        data = {str(key): "--.---" if value is None else f"{value}" for key, value in enumerate(apply_bias(values))}
+        fresh = apply_bias(tuple_fresh_values(frame, now_ns))
+        graded_data = {str(key): "--.---" if value is None else f"{value}" for key, value in enumerate(fresh)}
+        parse_readings(graded_data)
+        graded += grade([None if value == "--.---" else float(value) for value in graded_data.values()]).max_min is not None
+        labels = list(data.values())
+    return graded
+
+def now(frames: list, now_ns: int) -> int:
+    graded = 0
+    for frame in frames:
+        shown = frame.mm(BIASES)
+        fresh = frame.mm(BIASES, fresh_mask(frame, now_ns))
+        readings_data(fresh)
+        graded += grade(fresh).max_min is not None
+        labels = ["--.---" if value is None else f"{value}" for value in shown]
+    return graded
+
+def run(frames: int, seed: int) -> bool:
+    stream = readings(frames, seed)
+
+    assembler = SweepAssembler(MUX_PORTS_IN_USE)
+    start = perf_counter()
+    assembled = [frame for frame in (assembler.add(port, microns, sequence) for sequence, (port, microns) in enumerate(stream)) if frame is not None]
+    assemble_s = perf_counter() - start
+    legacy = [TupleFrame(frame.sequence, frame.timestamp_ns, frame.values, tuple(frame.received_ns)) for frame in assembled]
+
+    now_ns = len(stream)
+    start = perf_counter()
+    graded_before = before(legacy, now_ns)
+    before_s = perf_counter() - start
+    start = perf_counter()
+    graded_now = now(assembled, now_ns)
+    now_s = perf_counter() - start
+
+    tuple_bytes = frame_bytes(tuple_frame, min(frames, 20000))
+    array_bytes = frame_bytes(array_frame, min(frames, 20000))
+    same = all(apply_bias(fresh_values(frame, now_ns)) == frame.mm(BIASES, fresh_mask(frame, now_ns)) for frame in assembled)
+
+    print(f"{len(assembled)} frames assembled in {assemble_s:.3f} s, {len(assembled) / assemble_s:,.0f} frames/s")
+    print(f"Memory per frame:  tuples {tuple_bytes:6.0f} B  arrays {array_bytes:6.0f} B  ({tuple_bytes / array_bytes:.1f}x smaller)")
+    print(f"Display + grade:   before {before_s / len(assembled) * 1e6:6.1f} us  now {now_s / len(assembled) * 1e6:6.1f} us per sweep ({before_s / now_s:.1f}x)")
+    print(f"Same readings and grades: {same and graded_before == graded_now}")
+    return same and graded_before == graded_now
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the array backed sweep frame")
+    parser.add_argument("--frames", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sys.exit(0 if run(args.frames, args.seed) else 1)
@@ -0,0 +1,110 @@
+import random
+import sys
+from os import path
+from re import sub
+from time import perf_counter
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from SerialFramer import ReadingFramer, SweepAssembler
+
+'''
+Pushes megabytes of controller output through the serial line framer and the
+old split() + re.sub() parser, reports throughput against the firmware rate.
+
+Usage:
+    python3 framer_benchmark.py [capture_file]
+Without a capture file, output is generated in the firmware format.
+'''
+
+MUX_PORTS = [1, 2, 3, 4, 5, 6, 7, 9, 10, 11, 12, 13, 14, 15] # Every port the firmware prints
+MUX_PORTS_IN_USE = [1, 2, 4, 5, 6, 9, 10, 12, 13]
+TARGET_BYTES = 8 * 1024 * 1024
+
+# Firmware waits 50 + 50 + 100 ms per port, 7 ports per MUX board
+FIRMWARE_SWEEP_SECONDS = 7 * 0.2
+
+def generate_capture(target_bytes=TARGET_BYTES) -> bytes:
+    lines = []
+    size = 0
+    while size < target_bytes:
+        for index in MUX_PORTS:
+            if index not in MUX_PORTS_IN_USE or random.random() < 0.02:
+                line = f"[M{index}]: --.---\n"
+            else:
+                line = f"[M{index}]: {random.choice('+-')}{random.uniform(0, 2):.3f}\n"
+            lines.append(line)
+            size += len(line)
+    return "".join(lines).encode()
+
+def chunk(capture: bytes, max_chunk=64) -> list:
+    # Serial reads hand over arbitrary slices, lines get split across them
+    chunks = []
+    position = 0
+    while position < len(capture):
+        size = random.randint(1, max_chunk)
+        chunks.append(capture[position:position + size])
+        position += size
+    return chunks
+
+def run_framer(chunks) -> int:
+    framer = ReadingFramer()
+    count = 0
+    for piece in chunks:
+        for index, microns in framer.feed(piece):
+            if index in MUX_PORTS_IN_USE:
+                count += 1
+    return count
+
+def run_assembler(chunks) -> int:
+    # Framer + sweep assembly, count is signals that would be emitted
+    framer = ReadingFramer()
+    assembler = SweepAssembler(MUX_PORTS_IN_USE)
+    count = 0
+    for piece in chunks:
+        for index, microns in framer.feed(piece):
+            if assembler.add(index, microns, 0) is not None:
+                count += 1
+    return count * len(MUX_PORTS_IN_USE) # Scaled to readings for comparison
+
+def run_legacy(chunks) -> int:
+    # Parser from DataGetter.dataAvailable before the framer
+    count = 0
+    for piece in chunks:
+        index = None
+        for string in piece.decode(errors="replace").strip().split():
+            if string.startswith("[M") and string.endswith("]:"):
+                index = int(sub(r'[\[\]:M]', '', string))
+            else:
+                if index not in MUX_PORTS_IN_USE:
+                    continue
+                count += 1
+    return count
+
+def bench(name, function, chunks, total_bytes, lines_expected):
+    start = perf_counter()
+    count = function(chunks)
+    elapsed = perf_counter() - start
+
+    sweeps_per_second = (count / len(MUX_PORTS_IN_USE)) / elapsed
+    print(f"{name:<8} | {total_bytes / elapsed / 1e6:8.2f} MB/s | {count:>9} readings ({count / lines_expected:6.1%}) | "
+          f"{sweeps_per_second:10.0f} sweeps/s | {sweeps_per_second * FIRMWARE_SWEEP_SECONDS:8.0f}x firmware rate")
+
+
+if __name__ == "__main__":
+    random.seed(0)
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as file:
+            capture = file.read()
+    else:
+        capture = generate_capture()
+
+    lines_expected = sum(capture.count(f"[M{index}]:".encode()) for index in MUX_PORTS_IN_USE)
+    chunks = chunk(capture)
+    print(f"{len(capture) / 1e6:.1f} MB, {lines_expected} readings in use, {len(chunks)} reads")
+
+    bench("framer", run_framer, chunks, len(capture), lines_expected)
+    bench("frames", run_assembler, chunks, len(capture), lines_expected)
+    bench("legacy", run_legacy, chunks, len(capture), lines_expected)
+
+    print(f"dataOut signals: {lines_expected} per reading before, {lines_expected // len(MUX_PORTS_IN_USE)} per sweep frame now")
@@ -0,0 +1,164 @@
+import argparse
+import random
+import sys
+from bisect import bisect_right
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from CaptureLog import replay
+from Grading import BIASES, DATA_ERROR, MAX_READING_AGE_MS, MIN_VALID_READINGS, fresh_mask, grade
+from SerialFramer import MUX_PORTS_IN_USE, ControllerStream
+
+'''
+Replays controller lines with the firmware's timing and grades the latest
+frame at random test presses, as MainWindow.grade_part does, to check the
+freshness rule never turns a working jig's sweep into a DATA ERROR.
+
+Each MUX board runs the mux_thread.c loop over ports 1-7 on its own: 50 ms
+select settle, query at 38400 baud, 50 ms reply wait, read, 100 ms gap, with
+10 ms FreeRTOS ticks, the odd slow read and USB latency to the host. Every
+indicator on the platform reports, so any DATA ERROR is a false one. The old
+rule (any value older than 2 s) is graded alongside for comparison.
+
+Then one MUX board stops, as a hung thread would, and every press from
+MAX_READING_AGE_MS after that has to be a DATA ERROR.
+
+Usage:
+    python3 freshness_validation.py [--presses 1700] [--minutes 30]
+    python3 freshness_validation.py --capture captures/capture-*.cap.gz
+'''
+
+TICK_S = 0.010
+QUERY_S = 8 * 11 / 38400 # 8 byte query, 8N2
+OLD_MAX_AGE_MS = 2000
+
+def board_lines(board: int, start_s: float, end_s: float, heights: dict, rng: random.Random) -> list:
+    '''
+    Returns:
+        list: (host receive time s, line bytes) for one MUX board from start_s until it stops at end_s
+    '''
+    lines = []
+    t = start_s
+    while True:
+        for port in range(1, 8):
+            t += 0.050 - rng.uniform(0, TICK_S) # vTaskDelay rounds to the tick
+            t += QUERY_S + 0.050 - rng.uniform(0, TICK_S)
+            t += rng.uniform(0.030, 0.050) if rng.random() < 0.02 else rng.uniform(0.0005, 0.003) # Reply read
+            if t >= end_s:
+                return lines
+
+            index = board * 8 + port
+            if index in heights:
+                value = heights[index] + round(rng.gauss(0, 0.5))
+                line = f"[M{index}]: {'-' if value < 0 else '+'}{abs(value) / 1000:.3f}\n"
+            else:
+                line = f"[M{index}]: --.---\n"
+            lines.append((t + rng.uniform(0.001, 0.008), line.encode())) # USB CDC to the host
+            t += 0.100 - rng.uniform(0, TICK_S)
+
+def controller_lines(duration_s: float, seed: int, stop_board_s: float = None) -> list:
+    rng = random.Random(seed)
+    heights = {index: 1500 + rng.randint(0, 30) for index in MUX_PORTS_IN_USE}
+    lines = []
+    for board in (0, 1):
+        end_s = stop_board_s if board == 1 and stop_board_s is not None else duration_s
+        lines += board_lines(board, rng.uniform(0, 1.4), end_s, heights, rng)
+    lines.sort()
+    return lines
+
+def assemble(chunks) -> list:
+    # As DataGetter.dataAvailable, every reading of a chunk shares its receive time
+    stream = ControllerStream(MUX_PORTS_IN_USE)
+    frames = []
+    for timestamp_ns, chunk in chunks:
+        frames += stream.feed(chunk, timestamp_ns)
+    return frames
+
+def old_mask(frame, now_ns: int) -> int:
+    # Rule before, every value on its own against a fixed 2 s
+    mask = frame.valid_mask
+    for slot, received_ns in enumerate(frame.received_ns):
+        if now_ns - received_ns > OLD_MAX_AGE_MS * 1_000_000:
+            mask &= ~(1 << slot)
+    return mask
+
+def press_grades(frames: list, presses_ns: list, mask) -> list:
+    '''
+    Returns:
+        list: (press time ns, latest frame or None, grade) per press
+    '''
+    completed = [frame.timestamp_ns for frame in frames]
+    grades = []
+    for press_ns in presses_ns:
+        latest = bisect_right(completed, press_ns) - 1
+        frame = frames[latest] if latest >= 0 else None
+        readings = frame.mm(BIASES, mask(frame, press_ns)) if frame is not None else []
+        grades.append((press_ns, frame, grade(readings).grade))
+    return grades
+
+def false_errors(grades: list) -> int:
+    # DATA ERROR on a sweep every indicator of which reported
+    return sum(1 for _, frame, result in grades if result == DATA_ERROR and frame is not None and bin(frame.valid_mask).count("1") >= MIN_VALID_READINGS)
+
+def run(presses: int, minutes: float, seed: int) -> bool:
+    duration_s = minutes * 60
+    rng = random.Random(seed)
+    frames = assemble((round(t * 1e9), line) for t, line in controller_lines(duration_s, seed))
+    sweeps = [(later.timestamp_ns - earlier.timestamp_ns) / 1e6 for earlier, later in zip(frames, frames[1:])]
+    ages = [(frame.timestamp_ns - frame.started_ns) / 1e6 for frame in frames]
+    print(f"{len(frames)} frames in {minutes:g} min, {sum(sweeps) / len(sweeps):.0f} ms apart (max {max(sweeps):.0f}), "
+          f"oldest value {max(ages):.0f} ms old on completion")
+
+    # Presses anywhere in the run once the first frame is in
+    presses_ns = sorted(rng.randrange(frames[0].timestamp_ns, round(duration_s * 1e9)) for _ in range(presses))
+    old = false_errors(press_grades(frames, presses_ns, old_mask))
+    new = false_errors(press_grades(frames, presses_ns, fresh_mask))
+    print(f"False DATA ERRORs over {presses} presses: {OLD_MAX_AGE_MS} ms per value {old} ({old / presses:.0%}), "
+          f"fresh_mask {new} ({new / presses:.0%})")
+
+    # MUX board 2 hangs half way through, presses every 50 ms for a while after
+    stop_s = duration_s / 2
+    frames = assemble((round(t * 1e9), line) for t, line in controller_lines(duration_s, seed + 1, stop_board_s=stop_s))
+    stop_ns = round(stop_s * 1e9)
+    around_stop_ns = range(stop_ns, stop_ns + 2 * MAX_READING_AGE_MS * 1_000_000, 50_000_000)
+    grades = press_grades(frames, sorted([*presses_ns, *around_stop_ns]), fresh_mask)
+    accepted_after = [press_ns for press_ns, _, result in grades if press_ns > stop_ns and result != DATA_ERROR]
+    caught = all(press_ns < stop_ns + MAX_READING_AGE_MS * 1_000_000 for press_ns in accepted_after)
+    last_ms = (max(accepted_after) - stop_ns) / 1e6 if accepted_after else 0
+    before = false_errors([entry for entry in grades if entry[0] < stop_ns])
+    print(f"MUX board stopped: last press graded {last_ms:.0f} ms after (limit {MAX_READING_AGE_MS} ms), "
+          f"every later press a DATA ERROR: {caught}, false DATA ERRORs before it stopped: {before}")
+
+    return new == 0 and before == 0 and caught
+
+def run_capture(file_names: list, presses: int, seed: int):
+    # Recorded controller stream, presses spread over it
+    chunks = []
+    replay(file_names, lambda chunk, timestamp_ns: chunks.append((timestamp_ns, chunk)), speed=0)
+    frames = assemble(chunks)
+    if not frames:
+        print("No complete sweeps in the capture")
+        return False
+
+    rng = random.Random(seed)
+    presses_ns = sorted(rng.randrange(frames[0].timestamp_ns, frames[-1].timestamp_ns + 1) for _ in range(presses))
+    old = false_errors(press_grades(frames, presses_ns, old_mask))
+    new = false_errors(press_grades(frames, presses_ns, fresh_mask))
+    print(f"{len(frames)} frames, {presses} presses, DATA ERRORs on sweeps with {MIN_VALID_READINGS}+ readings: "
+          f"{OLD_MAX_AGE_MS} ms per value {old}, fresh_mask {new} (the controller going quiet counts too)")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate reading freshness against firmware-timed controller output")
+    parser.add_argument("--capture", nargs="*", help="Replay recorded captures instead of the firmware model")
+    parser.add_argument("--presses", type=int, default=1700)
+    parser.add_argument("--minutes", type=float, default=30, help="Length of the simulated run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.capture:
+        ok = run_capture(args.capture, args.presses, args.seed)
+    else:
+        ok = run(args.presses, args.minutes, args.seed)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,93 @@
+import argparse
+import sys
+from os import path
+from time import monotonic, sleep
+
+from PySide6.QtCore import QCoreApplication
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from ExtractData import HotplugWatcher
+from Hotplug import FakeUeventSource
+from PortDiscovery import PortDiscovery, is_scanner_candidate
+
+'''
+Drives HotplugWatcher with FakeUeventSource under a QCoreApplication, the
+same datagrams the udev netlink socket carries, and checks which devices
+come out of device_added / device_removed and what PortDiscovery holds after.
+
+Plugs in the CH343 controller, the barcode scanner, an FTDI adapter and a
+non tty event that must all be told apart, then unplugs the controller and
+plugs it back in on another port, where the remembered role has to follow it.
+
+Usage:
+    python3 hotplug_test.py [--timeout 2]
+'''
+
+CONTROLLER = {"ID_VENDOR_ID": "1a86", "ID_MODEL_ID": "55d3", "ID_SERIAL_SHORT": "5434012345",
+              "ID_VENDOR": "wch.cn", "ID_MODEL": "USB-Enhanced-SERIAL_CH343"}
+SCANNER = {"ID_VENDOR_ID": "26f1", "ID_MODEL_ID": "5650", "ID_SERIAL_SHORT": "",
+           "ID_VENDOR": "USBKey_Chip", "ID_MODEL": "USBKey_Module"}
+UNRELATED = {"ID_VENDOR_ID": "0403", "ID_MODEL_ID": "6001", "ID_SERIAL_SHORT": "A10K3XYZ",
+             "ID_VENDOR": "FTDI", "ID_MODEL": "FT232R_USB_UART"}
+
+def pump(app: QCoreApplication, signals: list, expected: int, timeout_s: float) -> bool:
+    # Until the watcher has emitted expected signals in all, the notifier only fires from the event loop
+    deadline = monotonic() + timeout_s
+    while len(signals) < expected and monotonic() < deadline:
+        app.processEvents()
+        sleep(0.005)
+    app.processEvents()
+    return len(signals) == expected
+
+def check(name: str, ok: bool) -> bool:
+    print(f"{name}: {ok}")
+    return ok
+
+def run(timeout_s: float) -> bool:
+    app = QCoreApplication.instance() or QCoreApplication([])
+    discovery = PortDiscovery()
+    source = FakeUeventSource()
+    watcher = HotplugWatcher(discovery, source)
+
+    signals = []
+    watcher.device_added.connect(lambda kind, port_name: signals.append(("add", kind, port_name)))
+    watcher.device_removed.connect(lambda kind, port_name: signals.append(("remove", kind, port_name)))
+    watcher.start()
+
+    source.push("add", "ttyACM0", **CONTROLLER)
+    source.push("add", "ttyACM1", **SCANNER)
+    source.push("add", "ttyUSB0", **UNRELATED)
+    source.push("add", "1-1.2:1.0", SUBSYSTEM="usb", **CONTROLLER) # USB interface, not a tty
+    ok = check("Controller and scanner announced, others ignored", pump(app, signals, 2, timeout_s)
+               and signals == [("add", "controller", "ttyACM0"), ("add", "scanner", "ttyACM1")])
+    ok &= check("Every tty present in discovery", sorted(discovery.present) == ["ttyACM0", "ttyACM1", "ttyUSB0"])
+    ok &= check("Scanner candidates", [identity.port_name for identity in discovery.candidates(is_scanner_candidate)] == ["ttyACM1"])
+
+    # Controller confirmed, then unplugged. The remove carries no identity, the source remembers the add
+    discovery.remember("controller", discovery.get("ttyACM0"))
+    source.push("remove", "ttyACM0")
+    ok &= check("Controller removed", pump(app, signals, 3, timeout_s) and signals[2] == ("remove", "controller", "ttyACM0"))
+    ok &= check("Gone from discovery", discovery.get("ttyACM0") is None and discovery.lookup("controller") is None)
+
+    # Back on another port, same serial number
+    source.push("add", "ttyACM2", **CONTROLLER)
+    ok &= check("Controller back on ttyACM2", pump(app, signals, 4, timeout_s) and signals[3] == ("add", "controller", "ttyACM2"))
+    found = discovery.lookup("controller")
+    ok &= check("Remembered role follows it", found is not None and found.port_name == "ttyACM2")
+
+    source.push("remove", "ttyUSB0")
+    ok &= check("Unrelated removal ignored", not pump(app, signals, 5, 0.2) and discovery.get("ttyUSB0") is None)
+
+    watcher.finish()
+    source.close()
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive the hotplug watcher with fake device events")
+    parser.add_argument("--timeout", type=float, default=2.0, help="Seconds to wait for each signal")
+    args = parser.parse_args()
+
+    ok = run(args.timeout)
+    print(f"Hotplug events classified: {ok}")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+import sys
+from os import path
+from time import monotonic_ns, sleep
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from JigEngine import JigHost, StationConfig
+from serial_simulator import ControllerSimulator, FIRMWARE_LINE_INTERVAL
+
+'''
+One JigHost driving 1 to 16 simulated controllers. Simulators run in another
+process so they do not share the GIL with the engine being measured.
+
+Reports per station count:
+    frames      sweeps received / sweeps the simulators sent
+    ingest      read to SweepFrame handed over, p50 / p99
+    loop lag    how late a 1 ms timer fires, what a new read would wait, p50 / p99
+    grade       test_part() on every station at once, p50 / p99
+
+Usage:
+    python3 multi_jig_benchmark.py [rate]
+'''
+
+STATION_COUNTS = [1, 2, 4, 8, 16]
+RUN_SECONDS = 3.0
+GRADE_INTERVAL_S = 0.05
+LINES_PER_SWEEP = 14
+
+def run_simulators(count, rate, connection):
+    controllers = [ControllerSimulator(rate=rate, jitter=0.1, fragment=0.2, seed=station) for station in range(count)]
+    for controller in controllers:
+        controller.start()
+    connection.send([controller.name for controller in controllers])
+
+    connection.recv() # Stop
+    for controller in controllers:
+        controller.stop()
+    connection.send("stopped")
+
+def percentiles(samples: list) -> str:
+    if not samples:
+        return "      -"
+    samples = sorted(samples)
+    return f"{samples[len(samples) // 2] / 1e3:7.0f} / {samples[len(samples) * 99 // 100] / 1e3:7.0f} us"
+
+async def measure(port_names: list):
+    host = JigHost([StationConfig(f"S{index}", port_name, data_file="/dev/null") for index, port_name in enumerate(port_names)], results_db=None)
+
+    ingest = []
+    frames = 0
+
+    def on_frame(frame):
+        nonlocal frames
+        frames += 1
+        ingest.append(monotonic_ns() - frame.timestamp_ns)
+
+    for engine in host.engines.values():
+        engine.on_frame = on_frame
+    host.start()
+    await asyncio.sleep(0.2) # Connect and fill the first sweep
+    ingest.clear()
+    frames = 0
+
+    lag = []
+    grade = []
+    end = monotonic_ns() + int(RUN_SECONDS * 1e9)
+    next_grade = monotonic_ns()
+    while monotonic_ns() < end:
+        start = monotonic_ns()
+        await asyncio.sleep(0.001)
+        lag.append(monotonic_ns() - start - 1_000_000)
+
+        if monotonic_ns() >= next_grade:
+            next_grade += int(GRADE_INTERVAL_S * 1e9)
+            start = monotonic_ns()
+            await asyncio.gather(*(host.test_part(name) for name in host.engines))
+            grade.append(monotonic_ns() - start)
+
+    await host.stop()
+    return frames, ingest, lag, grade
+
+
+if __name__ == "__main__":
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+    sweeps_per_second = 1 / (FIRMWARE_LINE_INTERVAL / rate * LINES_PER_SWEEP)
+    print(f"{rate:.0f}x firmware rate, {sweeps_per_second:.0f} sweeps/s per controller, {RUN_SECONDS:.0f} s per run")
+    print(f"{'stations':>8} | {'frames':>17} | {'ingest p50 / p99':>20} | {'loop lag p50 / p99':>20} | {'grade p50 / p99':>20}")
+
+    for count in STATION_COUNTS:
+        parent, child = multiprocessing.Pipe()
+        simulators = multiprocessing.Process(target=run_simulators, args=(count, rate, child))
+        simulators.start()
+        port_names = parent.recv()
+
+        frames, ingest, lag, grade = asyncio.run(measure(port_names))
+        parent.send("stop")
+        parent.recv()
+        simulators.join()
+        sleep(0.1)
+
+        expected = count * sweeps_per_second * RUN_SECONDS
+        print(f"{count:>8} | {frames:>7} / {expected:7.0f} | {percentiles(ingest):>20} | {percentiles(lag):>20} | {percentiles(grade):>20}")
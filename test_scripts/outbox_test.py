@@ -0,0 +1,268 @@
+import argparse
+import json
+import random
+import shutil
+import sys
+import tempfile
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from Grading import PASS, GradeResult
+from Outbox import Outbox
+from PostToSheet import BATCH_ACCEPTED, SCRIPT_ERROR_PAGE, post_each, post_rows, sheet_reachable
+from Results import make_record
+
+'''
+Outbox against a local stand-in for the Google Sheets script. As deployed
+it takes one result per request and answers 200 with the Apps Script error
+page when doPost throws, eg on a {"rows": [...]} body. Redeployed for
+batches it takes {"rows": [...]}, skips ids it already has and answers
+{"result": "success"}. Either can be told to add latency and fail:
+
+    error   500 before appending anything
+    threw   200 with the error page, nothing appended
+    lost    appends the rows then answers 500, as if the response was lost
+    drop    closes the connection without an answer
+
+Checks round trips with and without batching during a busy shift, that every
+result lands exactly once through injected failures, that neither a thrown
+doPost nor batches sent to the deployed script lose results, and that
+results added while the sheet is unreachable survive a restart and upload
+once it is back, with flush() or by the uploader noticing on its own.
+
+Usage:
+    python3 outbox_test.py [--results 300] [--latency-ms 10]
+'''
+
+class StandInSheet:
+    def __init__(self, latency_s: float = 0.0, failure_rates: dict = None, seed: int = 0, batches: bool = True):
+        self.batches = batches # Redeployed script, otherwise as deployed
+        self.latency_s = latency_s
+        self.failure_rates = failure_rates or {}
+        self.rng = random.Random(seed)
+        self.lock = Lock()
+        self.rows = {}          # id (platform_id without one) -> row, what the sheet holds
+        self.requests = 0
+        self.duplicates = 0     # Rows sent again after a lost response, skipped
+        self.server = None
+        self.port = 0
+
+    def start(self):
+        sheet = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                sleep(sheet.latency_s)
+                failure = sheet.failure()
+                if failure == "drop":
+                    self.close_connection = True
+                    return
+                if sheet.batches != ("rows" in body):
+                    failure = "threw" # doPost reads fields the body does not have
+                if failure in (None, "lost"):
+                    sheet.append(body["rows"] if sheet.batches else [body])
+
+                answer = b""
+                if failure == "threw":
+                    answer = f"<!DOCTYPE html><html><head>{SCRIPT_ERROR_PAGE}</head><body>TypeError (line 12)</body></html>".encode()
+                elif failure is None:
+                    answer = json.dumps(BATCH_ACCEPTED).encode() if sheet.batches else b"Success"
+                self.send_response(200 if failure in (None, "threw") else 500)
+                self.send_header("Content-Length", str(len(answer)))
+                self.end_headers()
+                self.wfile.write(answer)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def failure(self):
+        with self.lock:
+            self.requests += 1
+            draw = self.rng.random()
+            for kind, rate in self.failure_rates.items():
+                if draw < rate:
+                    return kind
+                draw -= rate
+            return None
+
+    def append(self, rows: list):
+        with self.lock:
+            for row in rows:
+                key = row.get("id", row["platform_id"])
+                if key in self.rows:
+                    self.duplicates += 1
+                else:
+                    self.rows[key] = row
+
+    def platform_ids(self) -> list:
+        with self.lock:
+            return sorted(row["platform_id"] for row in self.rows.values())
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/exec"
+
+def platform_ids(results: int) -> list:
+    return [f"PN{index:08d}" for index in range(results)]
+
+def record(index: int):
+    return make_record(f"PN{index:08d}", GradeResult(PASS, 0.021, 0, 8), [1.5 + slot / 1000 for slot in range(9)])
+
+def wait_until(condition, timeout_s: float) -> bool:
+    deadline = monotonic() + timeout_s
+    while not condition():
+        if monotonic() > deadline:
+            return False
+        sleep(0.02)
+    return True
+
+def sender(sheet: StandInSheet, batched: bool, timeout=(1.0, 5.0)):
+    return partial(post_rows if batched else post_each, url=sheet.url, timeout=timeout)
+
+def shift(directory: str, name: str, sheet: StandInSheet, results: int, interval_s: float, batched: bool = True, **options):
+    # Results arrive every interval_s, returns (keys, seconds to upload them all)
+    outbox = Outbox(path.join(directory, f"{name}.db"), sender(sheet, batched), batched=batched, **options)
+    start = monotonic()
+    keys = []
+    for index in range(results):
+        keys.append(outbox.add(record(index)))
+        sleep(interval_s)
+    drained = wait_until(lambda: outbox.pending() == 0, 120)
+    elapsed = monotonic() - start
+    outbox.close()
+    return keys if drained else None, elapsed
+
+def check_batching(directory: str, results: int, latency_s: float) -> bool:
+    counts = {}
+    for name, batched in [("one per request", False), ("batched", True)]:
+        sheet = StandInSheet(latency_s, batches=batched)
+        sheet.start()
+        keys, elapsed = shift(directory, name.replace(" ", "-"), sheet, results, 0.005, batched, batch_rows=50, linger_s=0.5)
+        sheet.stop()
+        counts[name] = sheet.requests
+        print(f"{name:>16}: {sheet.requests:5d} requests for {results} results, all on the sheet {elapsed:.1f} s after the first")
+        if keys is None or sheet.platform_ids() != platform_ids(results):
+            print(f"{name}: results missing from the sheet")
+            return False
+    print(f"Round trips cut {counts['one per request'] / counts['batched']:.0f}x")
+    return counts["batched"] * 10 <= counts["one per request"]
+
+def check_failures(directory: str, results: int, latency_s: float) -> bool:
+    sheet = StandInSheet(latency_s, {"error": 0.1, "threw": 0.1, "lost": 0.15, "drop": 0.1}, seed=1)
+    sheet.start()
+    keys, elapsed = shift(directory, "flaky", sheet, results, 0.002, batch_rows=20, linger_s=0.1, backoff_base_s=0.05, backoff_max_s=0.5)
+    sheet.stop()
+    once = keys is not None and len(sheet.rows) == len(keys) and set(sheet.rows) == set(keys)
+    print(f"Flaky sheet: {sheet.requests} requests, {sheet.duplicates} resent rows skipped by id, every result once: {once}")
+    return once and sheet.duplicates > 0
+
+def check_script_errors(directory: str, results: int) -> bool:
+    # Deployed script throwing now and then, every result still goes in once
+    sheet = StandInSheet(failure_rates={"threw": 0.3}, seed=2, batches=False)
+    sheet.start()
+    keys, elapsed = shift(directory, "threw", sheet, results, 0.001, batched=False, backoff_base_s=0.02, backoff_max_s=0.1)
+    sheet.stop()
+    once = keys is not None and sheet.platform_ids() == platform_ids(results) and sheet.duplicates == 0
+    print(f"Script errors: {sheet.requests} requests for {results} results, every result once: {once}")
+
+    # Batches sent before the script is redeployed, 200 with the error page every time
+    sheet = StandInSheet(batches=False)
+    sheet.start()
+    outbox = Outbox(path.join(directory, "early-batches.db"), sender(sheet, True), batched=True, linger_s=0, backoff_base_s=0.02, backoff_max_s=0.1)
+    for index in range(results):
+        outbox.add(record(index))
+    refused = wait_until(lambda: sheet.requests >= 5, 10)
+    kept = outbox.pending()
+    outbox.close(timeout_s=1)
+    sheet.stop()
+    print(f"Batches to the deployed script: {sheet.requests} refused, {kept} of {results} results kept")
+    return once and refused and kept == results and not sheet.rows
+
+def check_outage(directory: str, results: int) -> bool:
+    db_file = path.join(directory, "outage.db")
+    sheet = StandInSheet()
+    sheet.start()
+    sheet.stop() # Sheet unreachable, connections refused
+    send = sender(sheet, True, timeout=(0.5, 1.0))
+
+    # Long backoff, only flush() brings the upload forward
+    outbox = Outbox(db_file, send, linger_s=0, backoff_base_s=30, backoff_max_s=60, batched=True)
+    keys = [outbox.add(record(index)) for index in range(results)]
+    sleep(0.5)
+    kept = outbox.pending()
+    outbox.close(timeout_s=2)
+    print(f"Outage: {kept} of {results} results held, {outbox.failures} failed attempts")
+
+    # Restart while still offline, then the network comes back
+    outbox = Outbox(db_file, send, linger_s=0, backoff_base_s=30, backoff_max_s=60, batched=True)
+    survived = outbox.pending()
+    sleep(0.5)
+    sheet.start()
+    start = monotonic()
+    outbox.flush()
+    drained = wait_until(lambda: outbox.pending() == 0, 10)
+    elapsed = monotonic() - start
+    outbox.close()
+    sheet.stop()
+
+    ok = kept == results and survived == results and drained and set(sheet.rows) == set(keys)
+    print(f"Restart: {survived} results still waiting, uploaded in {sheet.requests} requests {elapsed:.2f} s after flush(): {ok}")
+    return ok
+
+def check_reconnect(directory: str, results: int) -> bool:
+    sheet = StandInSheet()
+    sheet.start()
+    sheet.stop()
+
+    # Minutes of backoff, nobody calls flush(), the probe has to notice the sheet is back
+    outbox = Outbox(path.join(directory, "reconnect.db"), sender(sheet, True, timeout=(0.5, 1.0)), linger_s=0,
+                    backoff_base_s=60, backoff_max_s=300, batched=True,
+                    probe=partial(sheet_reachable, sheet.url, 0.5), probe_interval_s=0.2)
+    keys = [outbox.add(record(index)) for index in range(results)]
+    sleep(0.5)
+    kept = outbox.pending()
+    sheet.start()
+    start = monotonic()
+    drained = wait_until(lambda: outbox.pending() == 0, 5)
+    elapsed = monotonic() - start
+    outbox.close()
+    sheet.stop()
+
+    ok = kept == results and drained and set(sheet.rows) == set(keys)
+    print(f"Network back during a 60 s+ backoff: {kept} results uploaded {elapsed:.2f} s later without flush(): {ok}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Outbox against a stand-in Google Sheets endpoint")
+    parser.add_argument("--results", type=int, default=300)
+    parser.add_argument("--latency-ms", type=float, default=10, help="Stand-in sheet latency per request")
+    parser.add_argument("--dir", default=None, help="Where to keep the outboxes, defaults to a temporary directory")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=args.dir)
+    try:
+        ok = check_batching(directory, args.results, args.latency_ms / 1000)
+        ok &= check_failures(directory, args.results, args.latency_ms / 1000)
+        ok &= check_script_errors(directory, args.results)
+        ok &= check_outage(directory, args.results)
+        ok &= check_reconnect(directory, args.results)
+    finally:
+        shutil.rmtree(directory)
+    sys.exit(0 if ok else 1)
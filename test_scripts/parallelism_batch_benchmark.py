@@ -0,0 +1,87 @@
+import argparse
+import sys
+from os import path
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from ParallelismCore import compute, compute_batch
+
+'''
+Grades --rows simulated platforms with compute_batch, and a sample of them
+one at a time through ParallelismCore.compute, checks both give the
+same contact triangle, plane, parallelism and flatness for every sampled row
+and reports rows per second.
+
+Readings are rounded to the indicator's 1 um resolution so ties, which the
+dict sorting breaks by index, come up often. --missing sets the share of
+"--.---" readings.
+
+Usage:
+    python3 parallelism_batch_benchmark.py [--rows 1000000] [--sample 20000]
+'''
+
+def generate(rows: int, missing: float, seed: int):
+    rng = np.random.default_rng(seed)
+    # Tilted and warped platforms around 1.5 mm, up to ~60 um max-min
+    tilt = rng.uniform(-0.01, 0.01, (rows, 2))
+    x = np.array([0, 1, 2, 0, 1, 2, 0, 1, 2])
+    y = np.array([2, 2, 2, 1, 1, 1, 0, 0, 0])
+    values = 1.5 + tilt[:, :1] * x + tilt[:, 1:] * y + rng.normal(0, 0.008, (rows, 9))
+    values = np.round(values, 3)
+    valid = rng.random((rows, 9)) >= missing
+    return values, valid
+
+def compute_one(values, valid):
+    # ParallelismCore.compute on one row, None where it reports DATA ERROR or finds no p3
+    if not valid.all():
+        return None
+    try:
+        result = compute({str(index): float(value) for index, value in enumerate(values)})
+    except IndexError:
+        return None # No p3 candidate
+    return list(result.points.keys()), result.plane, result.parallelism, result.flatness
+
+def same(expected, result, row: int) -> bool:
+    if expected is None:
+        return not result.valid[row]
+    points, plane, parallelism_value, flatness_value = expected
+    with np.errstate(invalid="ignore"):
+        return (bool(result.valid[row])
+                and list(result.points[row]) == points
+                and np.array_equal(result.planes[row], np.array(plane, dtype=float), equal_nan=True)
+                and result.parallelism[row] == parallelism_value
+                and np.array_equal(result.flatness[row], flatness_value, equal_nan=True))
+
+def run(rows: int, sample: int, missing: float, seed: int):
+    values, valid = generate(rows, missing, seed)
+
+    start = perf_counter()
+    result = compute_batch(values, valid)
+    batch_s = perf_counter() - start
+
+    sample = min(sample, rows)
+    start = perf_counter()
+    expected = [compute_one(values[row], valid[row]) for row in range(sample)]
+    scalar_s = perf_counter() - start
+
+    mismatches = [row for row in range(sample) if not same(expected[row], result, row)]
+
+    print(f"{rows} rows, {missing:.1%} missing readings, {result.valid.sum()} valid")
+    print(f"compute_batch: {batch_s:8.3f} s  {rows / batch_s:12,.0f} rows/s")
+    print(f"per platform:  {scalar_s:8.3f} s  {sample / scalar_s:12,.0f} rows/s  ({sample} rows, {rows / (sample / scalar_s):.0f} s for all)")
+    print(f"Speedup: {(rows / batch_s) / (sample / scalar_s):.0f}x")
+    print(f"Mismatches in {sample} sampled rows: {len(mismatches)} {mismatches[:10]}")
+    return not mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark and check the vectorized parallelism batch")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--sample", type=int, default=20000, help="Rows also computed one at a time and compared")
+    parser.add_argument("--missing", type=float, default=0.005, help="Share of --.--- readings")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sys.exit(0 if run(args.rows, args.sample, args.missing, args.seed) else 1)
@@ -0,0 +1,127 @@
+import argparse
+import csv
+import shutil
+import sys
+import tempfile
+from os import path
+from threading import Event
+from time import perf_counter, sleep
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from Grading import PASS, GradeResult
+from Outbox import Outbox
+from PersistenceWorker import QUEUE, PersistenceWorker
+from Results import ResultsWriter, make_record, to_json
+
+'''
+Time spent on the caller's (GUI) thread per save: the synchronous save_data
+(append the row, then post and wait for the sheet) against
+PersistenceWorker.submit(), with the upload slowed down to stand in for a
+slow network. Then checks every row reached the file and the outbox, every
+record got exactly one callback, and that a full queue fails the record
+instead of blocking.
+
+Usage:
+    python3 persistence_benchmark.py [--saves 200] [--post-ms 300]
+'''
+
+def record(index: int):
+    return make_record(f"PN{index:08d}", GradeResult(PASS, 0.021, 0, 8), [1.5 + slot / 1000 for slot in range(9)])
+
+def slow_post(delay_s: float, posted: list = None):
+    # Stands in for post_to_google_sheets / post_rows on a slow connection
+    def post(json_data) -> bool:
+        sleep(delay_s)
+        if posted is not None:
+            posted.extend(json_data)
+        return True
+    return post
+
+def percentile(times: list, share: float) -> float:
+    times = sorted(times)
+    return times[min(len(times) - 1, int(len(times) * share))] * 1e6
+
+def synchronous(file_name: str, saves: int, post) -> list:
+    # MainWindow.save_data before the worker
+    times = []
+    with ResultsWriter(file_name) as writer:
+        for index in range(saves):
+            start = perf_counter()
+            writer.append(record(index))
+            post(to_json(record(index)))
+            times.append(perf_counter() - start)
+    return times
+
+def write_behind(file_name: str, saves: int, post):
+    times = []
+    saved, failed = [], []
+    outbox = Outbox(f"{file_name}.outbox", post, linger_s=0.2, batched=True)
+    worker = PersistenceWorker(file_name, outbox, saved.append, lambda record, stage, message: failed.append((record, stage)))
+    for index in range(saves):
+        item = record(index)
+        start = perf_counter()
+        worker.submit(item)
+        times.append(perf_counter() - start)
+    closing = perf_counter()
+    worker.close()
+    outbox.close(timeout_s=60)
+    return times, perf_counter() - closing, saved, failed
+
+def data_rows(file_name: str) -> list:
+    with open(file_name, newline="") as file:
+        return list(csv.reader(file))[1:]
+
+def check_full_queue(directory: str) -> bool:
+    # A stalled disk stage must turn extra saves away, not block the caller
+    release = Event()
+    failed = []
+    worker = PersistenceWorker(path.join(directory, "full.csv"), on_failed=lambda record, stage, message: failed.append(stage), queue_size=4)
+    append = worker.writer.append
+    worker.writer.append = lambda item: release.wait() and append(item)
+
+    start = perf_counter()
+    accepted = [worker.submit(record(index)) for index in range(10)]
+    elapsed = perf_counter() - start
+    release.set()
+    worker.close()
+
+    rows = len(data_rows(path.join(directory, "full.csv")))
+    ok = elapsed < 0.05 and failed == [QUEUE] * accepted.count(False) and rows == accepted.count(True)
+    print(f"Full queue: {accepted.count(True)} accepted, {accepted.count(False)} turned away in {elapsed * 1000:.2f} ms, {rows} rows written: {ok}")
+    return ok
+
+def run(saves: int, post_ms: float, directory: str) -> bool:
+    post = slow_post(post_ms / 1000)
+    sync_count = max(1, min(saves, int(5000 / max(post_ms, 1))))
+    sync_times = synchronous(path.join(directory, "sync.csv"), sync_count, post)
+
+    file_name = path.join(directory, "data.csv")
+    posted = []
+    times, drain_s, saved, failed = write_behind(file_name, saves, slow_post(post_ms / 1000, posted))
+
+    print(f"{'caller thread per save':>24} | {'p50 us':>10} | {'p99 us':>10}")
+    print(f"{'synchronous':>24} | {percentile(sync_times, 0.5):10.0f} | {percentile(sync_times, 0.99):10.0f}")
+    print(f"{'PersistenceWorker':>24} | {percentile(times, 0.5):10.1f} | {percentile(times, 0.99):10.1f}")
+    print(f"Uploads drained {drain_s:.1f} s after the last save")
+
+    rows = [row[1] for row in data_rows(file_name)]
+    in_order = rows == [f"PN{index:08d}" for index in range(saves)]
+    callbacks = len(saved) == saves and not failed
+    uploaded = [row["platform_id"] for row in posted] == rows
+    print(f"Rows written in order: {in_order}, one callback per record: {callbacks}, all uploaded: {uploaded}")
+    return in_order and callbacks and uploaded and check_full_queue(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark write-behind result saving")
+    parser.add_argument("--saves", type=int, default=200)
+    parser.add_argument("--post-ms", type=float, default=20, help="Delay of each stand-in upload")
+    parser.add_argument("--dir", default=None, help="Where to write, defaults to a temporary directory")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=args.dir)
+    try:
+        ok = run(args.saves, args.post_ms, directory)
+    finally:
+        shutil.rmtree(directory)
+    sys.exit(0 if ok else 1)
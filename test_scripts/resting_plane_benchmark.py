@@ -0,0 +1,124 @@
+import argparse
+import itertools
+import sys
+import warnings
+from os import path
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from RestingPlane import TOLERANCE_MM, grid_layout, plane_heights, resting_plane
+from parallelism_batch_benchmark import compute_one, generate
+
+'''
+Checks RestingPlane.resting_plane and times it on dense grids.
+
+    3x3       against ParallelismCore's contact triangle on simulated
+              platforms. Where the old triangle is a possible rest (no
+              reading above its plane) the height over the centre must match
+    exact     against every triangle around the centre on small grids
+    dense     solve time and pivots from 3x3 up to --max-side squared
+              indicators over a 200 x 120 mm platform
+
+Usage:
+    python3 resting_plane_benchmark.py [--platforms 20000] [--max-side 200]
+'''
+
+PLATFORM_MM = (200.0, 120.0)
+
+def compare_3x3(platforms: int, seed: int):
+    values, _ = generate(platforms, 0.0, seed)
+    layout = grid_layout(3, 3)
+    columns = np.column_stack((layout, np.ones(9)))
+
+    impossible = same_height = same_points = 0
+    for row in values:
+        points, _, _, _ = compute_one(row, np.ones(9, dtype=bool))
+        old = np.linalg.solve(columns[points], row[points]) # Old plane as z = a x + b y + c
+        plane = resting_plane(layout, row)
+        if (row - columns @ old).max() > TOLERANCE_MM:
+            impossible += 1
+            continue
+        same_height += abs(old @ [1, 1, 1] - plane.centre_height) <= TOLERANCE_MM
+        same_points += set(points) == set(plane.points)
+
+    possible = platforms - impossible
+    print(f"3x3, {platforms} platforms")
+    print(f"  Old triangle has a reading above its plane: {impossible / platforms:.1%}")
+    print(f"  Otherwise same height over the centre: {same_height / possible:.1%}, same contacts: {same_points / possible:.1%}")
+    return same_height == possible
+
+def best_triangle_height(layout, heights, centre) -> float:
+    # Highest plane over the centre through any three indicators around it
+    best = -np.inf
+    for triangle in itertools.combinations(range(len(heights)), 3):
+        corners = np.column_stack((layout[list(triangle)], np.ones(3)))
+        if abs(np.linalg.det(corners)) < 1e-6:
+            continue
+        weights = np.linalg.solve(corners.T, [centre[0], centre[1], 1.0])
+        if (weights >= -1e-12).all():
+            best = max(best, weights @ heights[list(triangle)])
+    return best
+
+def check_exact(trials: int, rng) -> bool:
+    failures = 0
+    for rows, columns in [(3, 3), (3, 4), (4, 4), (4, 5)]:
+        layout = grid_layout(rows, columns, PLATFORM_MM[0] / (columns - 1), PLATFORM_MM[1] / (rows - 1))
+        for _ in range(trials):
+            heights = np.round(rng.normal(1.5, 0.01, len(layout)), 3)
+            heights[rng.random(len(layout)) < 0.05] = np.nan
+            try:
+                plane = resting_plane(layout, heights)
+            except ValueError:
+                continue
+            present = np.isfinite(heights)
+            expected = best_triangle_height(layout[present], heights[present], layout.mean(axis=0))
+            failures += abs(expected - plane.centre_height) > TOLERANCE_MM
+    print(f"Exact against every triangle, {trials} platforms per grid up to 4x5: {failures} failures")
+    return failures == 0
+
+def surface(layout, rng) -> np.ndarray:
+    # Tilted, bowed platform with 1 um resolution readings
+    x = layout[:, 0] / PLATFORM_MM[0] - 0.5
+    y = layout[:, 1] / PLATFORM_MM[1] - 0.5
+    tilt = rng.uniform(-0.03, 0.03, 2)
+    bow = rng.uniform(-0.02, 0.02, 2)
+    heights = 1.5 + tilt[0] * x + tilt[1] * y + bow[0] * x * x + bow[1] * y * y + rng.normal(0, 0.002, len(layout))
+    return np.round(heights, 3)
+
+def benchmark_dense(max_side: int, trials: int, rng) -> bool:
+    print(f"{'grid':>9} | {'indicators':>10} | {'solve ms':>9} | {'pivots mean / max':>17} | {'above plane':>11}")
+    violations = 0
+    side = 3
+    while side <= max_side:
+        layout = grid_layout(side, side, PLATFORM_MM[0] / (side - 1), PLATFORM_MM[1] / (side - 1))
+        runs = max(3, trials * 25 // side)
+        platforms = [surface(layout, rng) for _ in range(runs)]
+
+        start = perf_counter()
+        planes = [resting_plane(layout, heights) for heights in platforms]
+        elapsed = perf_counter() - start
+
+        pivots = [plane.pivots for plane in planes]
+        above = sum((heights - plane_heights(plane, layout)).max() > TOLERANCE_MM for heights, plane in zip(platforms, planes))
+        violations += above
+        print(f"{side:>4}x{side:<4} | {side * side:>10} | {elapsed / runs * 1000:9.3f} | {np.mean(pivots):8.1f} / {max(pivots):6} | {above:>11}")
+        side = side * 2 if side >= 5 else side + 1
+    return violations == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the resting plane solver")
+    parser.add_argument("--platforms", type=int, default=20000, help="3x3 platforms compared with ParallelismCore")
+    parser.add_argument("--trials", type=int, default=200, help="Platforms per small grid checked against every triangle")
+    parser.add_argument("--max-side", type=int, default=200, help="Largest grid side timed")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore", RuntimeWarning) # Old plane_z divides by zero on flat triangles
+    rng = np.random.default_rng(args.seed)
+    ok = compare_3x3(args.platforms, args.seed)
+    ok &= check_exact(args.trials, rng)
+    ok &= benchmark_dense(args.max_side, args.trials, rng)
+    sys.exit(0 if ok else 1)
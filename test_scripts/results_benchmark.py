@@ -0,0 +1,121 @@
+import argparse
+import csv
+import os
+import shutil
+import sys
+import tempfile
+from os import path
+from time import perf_counter
+
+import pandas as pd
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from Grading import FAIL, GradeResult
+from Results import COLUMNS, ResultsWriter, csv_row, make_record
+
+'''
+Save latency against history length: the pandas path MainWindow.save_data
+used (read_csv, concat one row, rewrite data.csv) against ResultsWriter
+appends, batched fsync and fsync on every row. Then checks crash recovery:
+a cut off row or header is dropped on open and the file reads as whole rows.
+
+Usage:
+    python3 results_benchmark.py [--sizes 1000 10000 100000 300000] [--dir /tmp]
+'''
+
+def record(index: int):
+    readings = [round(1.5 + (index * 7 + slot) % 40 / 1000, 3) for slot in range(9)]
+    return make_record(f"PN{index:08d}", GradeResult(FAIL, 0.039, 0, 8), readings)
+
+def history(file_name: str, rows: int):
+    with open(file_name, "wb") as file:
+        file.write(",".join(COLUMNS).encode() + b"\n")
+        file.write(b"".join(csv_row(record(index)) for index in range(rows)))
+
+def pandas_save(file_name: str, index: int):
+    # MainWindow.save_data before ResultsWriter
+    new = record(index)
+    file = pd.read_csv(file_name)
+    new_row = pd.DataFrame([dict(zip(COLUMNS, [new.date, new.platform_id, new.grade, new.max_min, *new.points]))])
+    file = pd.concat([file, new_row], ignore_index=True)
+    file.to_csv(file_name, index=False)
+
+def time_saves(save, count: int) -> list:
+    times = []
+    for index in range(count):
+        start = perf_counter()
+        save(index)
+        times.append(perf_counter() - start)
+    return sorted(times)
+
+def percentile(times: list, share: float) -> float:
+    return times[min(len(times) - 1, int(len(times) * share))] * 1000
+
+def benchmark(sizes: list, directory: str, appends: int):
+    print(f"{'rows':>8} | {'pandas ms p50':>13} | {'append ms p50 / p99':>19} | {'fsync each ms p50 / p99':>23}")
+    for rows in sizes:
+        file_name = path.join(directory, "data.csv")
+        history(file_name, rows)
+
+        pandas_times = time_saves(lambda index: pandas_save(file_name, rows + index), 3 if rows > 10000 else 10)
+
+        history(file_name, rows)
+        with ResultsWriter(file_name) as writer:
+            batched = time_saves(lambda index: writer.append(record(index)), appends)
+        with ResultsWriter(file_name, sync_rows=1) as writer:
+            each = time_saves(lambda index: writer.append(record(index)), appends // 4)
+
+        print(f"{rows:>8} | {percentile(pandas_times, 0.5):13.1f} | {percentile(batched, 0.5):8.3f} / {percentile(batched, 0.99):8.3f} |"
+              f" {percentile(each, 0.5):10.3f} / {percentile(each, 0.99):10.3f}")
+
+def rows_in(file_name: str) -> list:
+    with open(file_name, newline="") as file:
+        return list(csv.reader(file))
+
+def check_recovery(directory: str) -> bool:
+    file_name = path.join(directory, "recover.csv")
+    ok = True
+
+    # Crash part way through a row
+    history(file_name, 100)
+    with open(file_name, "ab") as file:
+        file.write(csv_row(record(100))[:25])
+    with ResultsWriter(file_name) as writer:
+        dropped = writer.recovered_bytes
+        writer.append(record(101))
+    rows = rows_in(file_name)
+    whole = len(rows) == 102 and all(len(row) == len(COLUMNS) for row in rows) and rows[-1][1] == "PN00000101"
+    print(f"Partial row: dropped {dropped} bytes, {len(rows) - 1} whole rows after: {whole}")
+    ok &= dropped == 25 and whole
+
+    # Crash part way through the header of a new file
+    with open(file_name, "wb") as file:
+        file.write(b"Date,Platfo")
+    with ResultsWriter(file_name) as writer:
+        writer.append(record(0))
+    rows = rows_in(file_name)
+    print(f"Partial header: rewritten {rows[0] == COLUMNS}, {len(rows) - 1} row")
+    ok &= rows[0] == COLUMNS and len(rows) == 2
+
+    # New file, header appears whole with no temporary left behind
+    os.remove(file_name)
+    with ResultsWriter(file_name) as writer:
+        writer.append(record(0))
+    ok &= rows_in(file_name)[0] == COLUMNS and not path.exists(f"{file_name}.tmp")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the append-only results writer")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 300000], help="Rows already in data.csv")
+    parser.add_argument("--appends", type=int, default=400, help="Rows appended per size")
+    parser.add_argument("--dir", default=None, help="Where to write, defaults to a temporary directory")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=args.dir)
+    try:
+        benchmark(args.sizes, directory, args.appends)
+        ok = check_recovery(directory)
+    finally:
+        shutil.rmtree(directory)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,83 @@
+import argparse
+import random
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from Grading import PASS, PASS_CRITERIA, grade
+from SequentialGrader import FALSE_ACCEPT_RATE, MAX_SWEEPS, SequentialGrader
+
+'''
+Grades simulated platforms with the single sweep rule and the sequential
+grader, reports false accepts / rejects and the sweeps each one took.
+
+Platforms have a true max-min spread around PASS_CRITERIA, readings are
+rounded to the indicator's 1 um resolution after gaussian noise.
+
+Usage:
+    python3 sequential_validation.py [--parts 20000] [--noise 0.0008]
+'''
+
+CHANNELS = 9
+
+def make_part(rng, spread_mm: float) -> list:
+    # Heights with exactly spread_mm between the highest and lowest indicator
+    heights = [rng.uniform(0, spread_mm) for _ in range(CHANNELS)]
+    low, high = rng.sample(range(CHANNELS), 2)
+    heights[low] = 0.0
+    heights[high] = spread_mm
+    return [2.0 + height for height in heights]
+
+def sweep(rng, heights: list, noise: float) -> list:
+    return [round(height + rng.gauss(0, noise), 3) for height in heights]
+
+def run(parts: int, noise: float, low: float, high: float, seed: int, false_accept_rate: float, max_sweeps: int):
+    rng = random.Random(seed)
+    results = {"single": [0, 0, 0], "sequential": [0, 0, 0]} # false accepts, false rejects, sweeps
+    good = bad = 0
+    marginal_sweeps = []
+
+    for _ in range(parts):
+        spread = rng.uniform(low, high)
+        heights = make_part(rng, spread)
+        truly_good = spread <= PASS_CRITERIA
+        good += truly_good
+        bad += not truly_good
+
+        single = grade(sweep(rng, heights, noise)).grade == PASS
+        results["single"][0] += single and not truly_good
+        results["single"][1] += truly_good and not single
+        results["single"][2] += 1
+
+        grader = SequentialGrader(false_accept_rate=false_accept_rate, max_sweeps=max_sweeps)
+        decision = None
+        while decision is None:
+            decision = grader.add(sweep(rng, heights, noise))
+        passed = decision.grade == PASS
+        results["sequential"][0] += passed and not truly_good
+        results["sequential"][1] += truly_good and not passed
+        results["sequential"][2] += grader.sweeps
+        if abs(spread - PASS_CRITERIA) < 0.002:
+            marginal_sweeps.append(grader.sweeps)
+
+    print(f"{parts} parts, true max-min {low * 1000:.0f}-{high * 1000:.0f} um, noise {noise * 1000:.1f} um, criteria {PASS_CRITERIA * 1000:.0f} um, "
+          f"false accept rate {false_accept_rate:.1%} over {max_sweeps} sweeps")
+    print(f"{'':>10} | {'false accept':>12} | {'false reject':>12} | {'mean sweeps':>11}")
+    for name, (false_accepts, false_rejects, sweeps) in results.items():
+        print(f"{name:>10} | {false_accepts / bad:12.2%} | {false_rejects / good:12.2%} | {sweeps / parts:11.2f}")
+    if marginal_sweeps:
+        print(f"Within 2 um of the criteria: {sum(marginal_sweeps) / len(marginal_sweeps):.2f} sweeps on average")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare single sweep and sequential grading")
+    parser.add_argument("--parts", type=int, default=20000)
+    parser.add_argument("--noise", type=float, default=0.0008, help="Reading noise, mm standard deviation")
+    parser.add_argument("--low", type=float, default=0.015, help="Smallest true max-min, mm")
+    parser.add_argument("--high", type=float, default=0.055, help="Largest true max-min, mm")
+    parser.add_argument("--false-accept", type=float, default=FALSE_ACCEPT_RATE, help="SequentialGrader false_accept_rate")
+    parser.add_argument("--max-sweeps", type=int, default=MAX_SWEEPS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.parts, args.noise, args.low, args.high, args.seed, args.false_accept, args.max_sweeps)
@@ -0,0 +1,241 @@
+import argparse
+import os
+import random
+import select
+import sys
+import threading
+import tty
+from os import path
+from time import monotonic, sleep
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+import ScannerCodec
+
+'''
+Hardware-free stand-ins for the indicator controller and the barcode scanner.
+
+Each device gets a pseudo-terminal. The app (or anything else) opens the
+printed /dev/pts path, or a fixed symlink given with --link:
+
+    python3 serial_simulator.py --rate 50 --dropout 0.01 --fragment 0.2
+    PPQC_CONTROLLER_PORT=/tmp/ppqc-controller PPQC_SCANNER_PORT=/tmp/ppqc-scanner python3 main.py
+
+Controller output matches indicator-controller/src/mux_thread.c: both MUX
+boards print "[Mn]: +x.xxx" (or "--.---") for ports 1-7 and 9-15, interleaved.
+'''
+
+MUX_PORTS = [[1, 2, 3, 4, 5, 6, 7], [9, 10, 11, 12, 13, 14, 15]]
+MUX_PORTS_IN_USE = [1, 2, 4, 5, 6, 9, 10, 12, 13]
+
+# Firmware waits 50 + 50 + 100 ms per port, each MUX board prints every 200 ms
+FIRMWARE_LINE_INTERVAL = 0.2 / len(MUX_PORTS)
+
+def open_pty(link: str = None):
+    '''
+    Returns:
+        tuple: (master fd, path the app should open, slave fd)
+    '''
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+
+    if link is not None:
+        if path.lexists(link):
+            os.remove(link)
+        os.symlink(name, link)
+        name = link
+
+    # Keep the slave open so the pty survives the app closing and reopening it
+    return master, name, slave
+
+class ControllerSimulator:
+    '''
+    Streams micrometer readings at rate x the firmware sweep rate
+    '''
+
+    def __init__(self, rate=1.0, jitter=0.0, dropout=0.0, fragment=0.0, noise=0.0005, heights=None, replay=None, link=None, seed=None):
+        self.rate = rate
+        self.jitter = jitter
+        self.dropout = dropout
+        self.fragment = fragment
+        self.noise = noise
+        self.random = random.Random(seed)
+
+        # Surface under the indicators, mm, in mux_ports_in_use order
+        self.heights = heights or [round(self.random.uniform(1.5, 1.7), 3) for _ in MUX_PORTS_IN_USE]
+        self.replay = replay
+
+        self.master, self.name, self.slave = open_pty(link)
+        self.running = False
+        self.thread = None
+        self.lines_written = 0
+
+    def set_heights(self, heights: list):
+        # Eg a platform being placed, seen from the next line on
+        self.heights = list(heights)
+
+    def lines(self):
+        if self.replay is not None:
+            # Recorded output, one capture line at a time, looped
+            with open(self.replay, "rb") as file:
+                capture = file.read().splitlines(keepends=True)
+            while True:
+                yield from capture
+
+        while True:
+            for mux_0, mux_1 in zip(*MUX_PORTS):
+                for port in (mux_0, mux_1):
+                    yield self.format_line(port)
+
+    def format_line(self, port: int) -> bytes:
+        if port not in MUX_PORTS_IN_USE or self.random.random() < self.dropout:
+            return f"[M{port}]: --.---\n".encode()
+
+        value = self.heights[MUX_PORTS_IN_USE.index(port)] + self.random.gauss(0, self.noise)
+        return f"[M{port}]: {'-' if value < 0 else '+'}{abs(value):.3f}\n".encode()
+
+    def write(self, data: bytes):
+        try:
+            os.write(self.master, data)
+        except OSError: # Nobody reading, pty buffer full
+            pass
+
+    def run(self):
+        interval = FIRMWARE_LINE_INTERVAL / self.rate
+        due = monotonic()
+        for line in self.lines():
+            if not self.running:
+                break
+
+            due += interval * (1 + self.jitter * self.random.uniform(-1, 1))
+            delay = due - monotonic()
+            if delay > 0.001:
+                sleep(delay)
+
+            # Split the line so the reader sees it across several reads
+            if self.fragment and self.random.random() < self.fragment and len(line) > 2:
+                cut = self.random.randint(1, len(line) - 1)
+                self.write(line[:cut])
+                sleep(0.002)
+                self.write(line[cut:])
+            else:
+                self.write(line)
+            self.lines_written += 1
+
+    def start(self):
+        os.set_blocking(self.master, False)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+class ScannerSimulator:
+    '''
+    Answers identify/trigger/mode commands and scans codes after scan_delay
+    '''
+
+    def __init__(self, codes=None, scan_delay=0.1, no_read=0.0, link=None, seed=None):
+        self.codes = codes or ["PLATFORM-0001"]
+        self.scan_delay = scan_delay
+        self.no_read = no_read
+        self.random = random.Random(seed)
+        self.continuous = False
+        self.code_index = 0
+
+        self.master, self.name, self.slave = open_pty(link)
+        self.running = False
+        self.thread = None
+
+    def next_code(self) -> bytes:
+        code = self.codes[self.code_index % len(self.codes)]
+        self.code_index += 1
+        return f"{code}\r\n".encode()
+
+    def handle(self, command: ScannerCodec.Command):
+        ok = ScannerCodec.build_response(ScannerCodec.STATUS_OK, b"\x00")
+
+        if command.command_type == ScannerCodec.TYPE_READ and command.address == ScannerCodec.ZONE_IDENTITY:
+            os.write(self.master, ScannerCodec.build_response(ScannerCodec.STATUS_OK, b"\x02"))
+
+        elif command.command_type == ScannerCodec.TYPE_WRITE and command.address == ScannerCodec.ZONE_TRIGGER:
+            os.write(self.master, ok)
+            if command.data[:1] == b"\x01" and self.random.random() >= self.no_read:
+                sleep(self.scan_delay)
+                os.write(self.master, self.next_code())
+
+        elif command.command_type == ScannerCodec.TYPE_WRITE and command.address == ScannerCodec.ZONE_MODE:
+            self.continuous = command.data[:1] == bytes([ScannerCodec.MODE_CONTINUOUS])
+            os.write(self.master, ok)
+
+        else:
+            os.write(self.master, ok)
+
+    def run(self):
+        buffer = bytearray()
+        while self.running:
+            timeout = self.scan_delay if self.continuous else 0.1
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            if not readable:
+                if self.continuous:
+                    os.write(self.master, self.next_code())
+                continue
+
+            try:
+                buffer += os.read(self.master, 256)
+            except OSError:
+                continue
+
+            while True:
+                command, consumed = ScannerCodec.decode_command(memoryview(buffer))
+                if consumed == 0:
+                    break
+                del buffer[:consumed]
+                if command is not None:
+                    self.handle(command)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the indicator controller and barcode scanner on ptys")
+    parser.add_argument("--rate", type=float, default=1.0, help="Multiple of the firmware sweep rate")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Line interval jitter, fraction of the interval")
+    parser.add_argument("--dropout", type=float, default=0.0, help="Probability a reading is --.---")
+    parser.add_argument("--fragment", type=float, default=0.0, help="Probability a line is split across two writes")
+    parser.add_argument("--noise", type=float, default=0.0005, help="Reading noise, mm standard deviation")
+    parser.add_argument("--replay", help="Replay a raw controller capture instead of generating readings")
+    parser.add_argument("--codes", nargs="*", default=["PLATFORM-0001"], help="Codes the scanner reads in turn")
+    parser.add_argument("--controller-link", default="/tmp/ppqc-controller")
+    parser.add_argument("--scanner-link", default="/tmp/ppqc-scanner")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    controller = ControllerSimulator(args.rate, args.jitter, args.dropout, args.fragment, args.noise,
+                                     replay=args.replay, link=args.controller_link, seed=args.seed)
+    scanner = ScannerSimulator(args.codes, link=args.scanner_link, seed=args.seed)
+    controller.start()
+    scanner.start()
+
+    print(f"Controller: {controller.name} -> {os.ttyname(controller.slave)}")
+    print(f"Scanner:    {scanner.name} -> {os.ttyname(scanner.slave)}")
+    print(f"PPQC_CONTROLLER_PORT={controller.name} PPQC_SCANNER_PORT={scanner.name} python3 main.py")
+
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        controller.stop()
+        scanner.stop()
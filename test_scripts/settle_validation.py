@@ -0,0 +1,150 @@
+import argparse
+import math
+import random
+import sys
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from CaptureLog import replay
+from SerialFramer import MUX_PORTS_IN_USE, ReadingFramer, SweepAssembler
+from SettleDetector import SettleDetector
+
+'''
+Runs SettleDetector over simulated place / settle / lift cycles for a grid of
+thresholds and reports how it does against the true settle time of every
+platform. Premature triggers show up as grading error, slow ones as delay.
+
+Each placement pushes every indicator in by ~2 mm, then every channel decays
+to its final height with its own overshoot and time constant. Readings are
+integer microns with noise and --.--- dropouts, each channel read at its own
+time within the sweep, as the firmware does.
+
+Usage:
+    python3 settle_validation.py [--sweep 1.4] [--cycles 300]
+    python3 settle_validation.py --capture captures/capture-0.cap.gz ...
+'''
+
+CHANNELS = len(MUX_PORTS_IN_USE)
+TOLERANCE_MICRONS = 1 # Settled once every channel is this close to its final height
+
+WINDOWS_MS = [1400, 2800, 4200]
+SETTLE_RANGES = [1, 2, 3, 5, 8]
+
+def simulate(cycles: int, sweep_s: float, noise: float, dropout: float, seed: int = 0):
+    '''
+    Returns:
+        tuple: (frames as (time, values), placements as (placed, settled, removed, final heights))
+    '''
+    rng = random.Random(seed)
+    empty = [rng.randint(-50, 50) for _ in range(CHANNELS)]
+    frames = []
+    placements = []
+    t = 0.0
+
+    def reading(value):
+        return None if rng.random() < dropout else round(value + rng.gauss(0, noise))
+
+    for _ in range(cycles):
+        # Empty jig for a while
+        end = t + rng.uniform(3, 10)
+        while t < end:
+            frames.append((t, tuple(reading(value) for value in empty)))
+            t += sweep_s
+
+        placed = t + rng.uniform(0, sweep_s)
+        final = [value + 2000 + rng.randint(-30, 30) for value in empty]
+        overshoot = [rng.choice([-1, 1]) * rng.uniform(5, 40) for _ in range(CHANNELS)]
+        tau = [rng.uniform(0.2, 2.5) for _ in range(CHANNELS)]
+        settled = placed + max(time_constant * math.log(abs(amount) / TOLERANCE_MICRONS) for amount, time_constant in zip(overshoot, tau))
+        removed = settled + rng.uniform(3, 12)
+        placements.append((placed, settled, removed, final))
+
+        while t < removed:
+            values = []
+            for channel in range(CHANNELS):
+                read_at = t + channel * sweep_s / CHANNELS
+                if read_at < placed:
+                    values.append(reading(empty[channel]))
+                else:
+                    values.append(reading(final[channel] + overshoot[channel] * math.exp(-(read_at - placed) / tau[channel])))
+            frames.append((t, tuple(values)))
+            t += sweep_s
+
+    return frames, placements
+
+def evaluate(frames, placements, window_ms: int, settle_range: int):
+    detector = SettleDetector(window_ms=window_ms, settle_range=settle_range)
+    triggers = [(t, values) for t, values in frames if detector.add(values, int(t * 1e9))]
+
+    delays = []
+    errors = []
+    false_triggers = 0
+    matched = set()
+    for t, values in triggers:
+        placement = next((index for index, (placed, _, removed, _) in enumerate(placements) if placed <= t < removed), None)
+        if placement is None or placement in matched:
+            false_triggers += 1
+            continue
+        matched.add(placement)
+
+        placed, settled, _, final = placements[placement]
+        delays.append(t - settled)
+
+        # Grading error, max-min of the triggering sweep against the settled platform
+        pairs = [(value, height) for value, height in zip(values, final) if value is not None]
+        measured = max(value for value, _ in pairs) - min(value for value, _ in pairs)
+        actual = max(height for _, height in pairs) - min(height for _, height in pairs)
+        errors.append(abs(measured - actual))
+
+    missed = len(placements) - len(matched)
+    return delays, errors, false_triggers, missed
+
+def run_grid(args):
+    frames, placements = simulate(args.cycles, args.sweep, args.noise, args.dropout, args.seed)
+    print(f"{len(placements)} placements, {len(frames)} sweeps of {args.sweep} s, noise {args.noise} um, dropout {args.dropout:.0%}")
+    print(f"{'window ms':>9} | {'range um':>8} | {'delay mean / p95 s':>19} | {'early':>5} | {'grade err p95 / max um':>22} | {'false':>5} | {'missed':>6}")
+
+    for window_ms in WINDOWS_MS:
+        for settle_range in SETTLE_RANGES:
+            delays, errors, false_triggers, missed = evaluate(frames, placements, window_ms, settle_range)
+            delays.sort()
+            errors.sort()
+            early = sum(1 for delay in delays if delay < 0)
+            mean_delay = sum(delays) / len(delays) if delays else float("nan")
+            p95_delay = delays[len(delays) * 95 // 100] if delays else float("nan")
+            p95_error = errors[len(errors) * 95 // 100] if errors else 0
+            print(f"{window_ms:>9} | {settle_range:>8} | {mean_delay:8.2f} / {p95_delay:8.2f} | {early:>5} | "
+                  f"{p95_error:>10} / {max(errors, default=0):>9} | {false_triggers:>5} | {missed:>6}")
+
+def run_capture(file_names):
+    # Trigger points in a recorded controller stream
+    framer = ReadingFramer()
+    assembler = SweepAssembler(MUX_PORTS_IN_USE)
+    detector = SettleDetector()
+    first_ns = None
+
+    def feed(chunk, timestamp_ns):
+        nonlocal first_ns
+        first_ns = timestamp_ns if first_ns is None else first_ns
+        for index, microns in framer.feed(chunk):
+            frame = assembler.add(index, microns, timestamp_ns)
+            if frame is not None and detector.add(frame.values, frame.timestamp_ns):
+                print(f"{(timestamp_ns - first_ns) / 1e9:9.2f} s  sweep {frame.sequence:>6}  trigger {frame.values}")
+
+    replay(file_names, feed, speed=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate settle detection thresholds")
+    parser.add_argument("--capture", nargs="*", help="Run the default detector over recorded captures instead")
+    parser.add_argument("--cycles", type=int, default=300)
+    parser.add_argument("--sweep", type=float, default=1.4, help="Seconds per sweep frame")
+    parser.add_argument("--noise", type=float, default=0.5, help="Reading noise, um standard deviation")
+    parser.add_argument("--dropout", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.capture:
+        run_capture(args.capture)
+    else:
+        run_grid(args)
@@ -0,0 +1,149 @@
+import argparse
+import csv
+import random
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from os import path
+from time import perf_counter
+
+import pandas as pd
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from Grading import FAIL, PASS, GradeResult
+from PersistenceWorker import PersistenceWorker
+from Results import COLUMNS, DATE_FORMAT, csv_row, make_record
+from ResultsStore import ResultsStore, import_csv, week_start_s
+
+'''
+"Every test of platform X" and "yield this week" answered by scanning
+data.csv (csv module and pandas) against ResultsStore's indexed queries,
+after a one-shot import of the same file. Checks both give the same answers,
+and that importing a data.csv the jig has been saving to alongside the store
+does not count those tests twice.
+
+Usage:
+    python3 store_benchmark.py [--rows 300000] [--platforms 20000]
+'''
+
+def history(file_name: str, rows: int, platforms: int, seed: int):
+    # A year of tests, oldest first, a platform retested now and then
+    rng = random.Random(seed)
+    now = datetime.now()
+    start = now - timedelta(days=365)
+    step = (now - start) / rows
+    with open(file_name, "wb") as file:
+        file.write(",".join(COLUMNS).encode() + b"\n")
+        for index in range(rows):
+            readings = [round(1.5 + rng.randint(0, 45) / 1000, 3) for _ in range(9)]
+            max_min = round(max(readings) - min(readings), 3)
+            result = GradeResult(PASS if max_min <= 0.035 else FAIL, max_min, 0, 8)
+            file.write(csv_row(make_record(f"PN{rng.randrange(platforms):08d}", result, readings, start + step * index)))
+
+def best_of(runs: int, query):
+    best, answer = None, None
+    for _ in range(runs):
+        start = perf_counter()
+        answer = query()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, answer
+
+def csv_platform(file_name: str, platform_id: str) -> int:
+    with open(file_name, newline="") as file:
+        return sum(1 for row in csv.DictReader(file) if row["PlatformID"] == platform_id)
+
+def csv_week(file_name: str, since: datetime) -> tuple:
+    # Dates do not sort as text, every row has to be parsed
+    passed = failed = 0
+    with open(file_name, newline="") as file:
+        for row in csv.DictReader(file):
+            if datetime.strptime(row["Date"], DATE_FORMAT) >= since:
+                passed += row["Grade"] == PASS
+                failed += row["Grade"] == FAIL
+    return passed, failed
+
+def pandas_platform(file_name: str, platform_id: str) -> int:
+    data = pd.read_csv(file_name)
+    return int((data["PlatformID"] == platform_id).sum())
+
+def pandas_week(file_name: str, since: datetime) -> tuple:
+    data = pd.read_csv(file_name)
+    week = data[pd.to_datetime(data["Date"], format=DATE_FORMAT) >= since]
+    return int((week["Grade"] == PASS).sum()), int((week["Grade"] == FAIL).sum())
+
+def check_import_after_saves(directory: str) -> bool:
+    # Live saves go to data.csv and the store, an import of data.csv afterwards only adds older rows
+    file_name = path.join(directory, "live.csv")
+    history(file_name, 50, 10, 1)
+    store = ResultsStore(path.join(directory, "live.db"))
+    with PersistenceWorker(file_name, store=store) as worker:
+        for index in range(3):
+            worker.submit(make_record("PN0", GradeResult(PASS, 0.02, 0, 8), [1.5] * 9))
+        worker.submit(make_record("PN1", GradeResult(FAIL, 0.05, 0, 8), [1.5] * 9))
+
+    saved_this_week = store.yield_this_week().tested
+    history_this_week = sum(csv_week(file_name, datetime.fromtimestamp(week_start_s()))) - saved_this_week
+    imported = import_csv(store, file_name)
+    again = import_csv(store, file_name, force=True)
+    count = store.count()
+    tests = len(store.tests_for("PN0"))
+    week = store.yield_this_week().tested
+    store.close()
+
+    ok = imported == 50 and again == 0 and count == 54 and week == saved_this_week + history_this_week and tests >= 3
+    print(f"Import after 4 live saves: {imported} imported, {again} on a forced repeat, {count} rows, "
+          f"{week} tested this week ({saved_this_week} saved live), no duplicates: {ok}")
+    return ok
+
+def run(rows: int, platforms: int, directory: str) -> bool:
+    file_name = path.join(directory, "data.csv")
+    history(file_name, rows, platforms, 0)
+
+    store = ResultsStore(path.join(directory, "results.db"))
+    start = perf_counter()
+    imported = import_csv(store, file_name)
+    import_s = perf_counter() - start
+    print(f"Imported {imported} rows in {import_s:.2f} s ({imported / import_s:,.0f} rows/s)")
+
+    platform_id = "PN00000042"
+    since_s = week_start_s()
+    since = datetime.fromtimestamp(since_s)
+    queries = [
+        ("tests for one platform", [
+            ("csv scan", 1, lambda: csv_platform(file_name, platform_id)),
+            ("pandas", 1, lambda: pandas_platform(file_name, platform_id)),
+            ("ResultsStore", 20, lambda: len(store.tests_for(platform_id)))]),
+        ("yield this week", [
+            ("csv scan", 1, lambda: csv_week(file_name, since)),
+            ("pandas", 1, lambda: pandas_week(file_name, since)),
+            ("ResultsStore", 20, lambda: (lambda summary: (summary.passed, summary.failed))(store.yield_between(since_s)))]),
+    ]
+
+    ok = imported == rows
+    for question, ways in queries:
+        answers = []
+        for name, runs, query in ways:
+            elapsed_ms, answer = best_of(runs, query)
+            answers.append(answer)
+            print(f"{question:>24} | {name:>12} | {elapsed_ms:10.2f} ms | {answer}")
+        ok &= all(answer == answers[0] for answer in answers)
+    store.close()
+    print(f"Same answers: {ok}")
+    return check_import_after_saves(directory) and ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark results queries, CSV scans against the SQLite store")
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--platforms", type=int, default=20_000)
+    parser.add_argument("--dir", default=None, help="Where to write, defaults to a temporary directory")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=args.dir)
+    try:
+        ok = run(args.rows, args.platforms, directory)
+    finally:
+        shutil.rmtree(directory)
+    sys.exit(0 if ok else 1)
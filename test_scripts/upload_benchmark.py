@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from threading import Lock, Thread
+from time import perf_counter, sleep
+
+import requests
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "qt-platform-parallelism"))
+from Grading import PASS, GradeResult
+from PostToSheet import SheetUploader
+from Results import make_record, to_json
+
+'''
+Upload latency per result against a local HTTPS stand-in for the sheet
+script: a bare requests.post per result (the old post_to_google_sheets)
+against SheetUploader's pooled keep-alive session, one at a time and with
+several requests in flight.
+
+The stand-in answers POST /exec with a redirect to another host name
+(localhost for 127.0.0.1), like script.google.com sending the result on to
+script.googleusercontent.com. --rtt-ms is added to every request and three
+times to every new connection, TCP plus the TLS handshake. Also checks the
+uploader never has more than max_in_flight requests at the server at once.
+
+Usage:
+    python3 upload_benchmark.py [--results 200] [--rtt-ms 20] [--in-flight 4]
+'''
+
+class StandInSheet(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, context: ssl.SSLContext, rtt_s: float):
+        self.context = context
+        self.rtt_s = rtt_s
+        self.lock = Lock()
+        self.connections = 0
+        self.active = 0
+        self.most_active = 0
+        self.rows = 0
+        super().__init__(("127.0.0.1", 0), Handler)
+
+    def finish_request(self, request, client_address):
+        # Per connection thread, the handshake does not hold up other clients
+        with self.lock:
+            self.connections += 1
+        sleep(3 * self.rtt_s)
+        try:
+            request = self.context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        super().finish_request(request, client_address)
+
+    def track(self, change: int):
+        with self.lock:
+            self.active += change
+            self.most_active = max(self.most_active, self.active)
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # Headers and body go out in separate writes, no delayed ACK stall
+
+    def do_POST(self):
+        self.server.track(1)
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        sleep(self.server.rtt_s)
+        with self.server.lock:
+            self.server.rows += len(body.get("rows", [body]))
+        self.server.track(-1)
+        self.send_response(302)
+        self.send_header("Location", f"https://localhost:{self.server.server_address[1]}/echo")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        sleep(self.server.rtt_s)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+def certificate(directory: str) -> tuple:
+    cert, key = path.join(directory, "cert.pem"), path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert, "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1,DNS:localhost"], check=True, capture_output=True)
+    return cert, key
+
+def bodies(results: int) -> list:
+    return [to_json(make_record(f"PN{index:08d}", GradeResult(PASS, 0.021, 0, 8), [1.5 + slot / 1000 for slot in range(9)])) for index in range(results)]
+
+def percentiles(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {percentile: latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)] * 1000 for percentile in (50, 90, 99)}
+
+def bare(url: str, results: list) -> tuple:
+    # post_to_google_sheets before SheetUploader
+    latencies = []
+    start = perf_counter()
+    for body in results:
+        request_start = perf_counter()
+        ok = requests.post(url, json=body).status_code == 200
+        latencies.append(perf_counter() - request_start)
+        if not ok:
+            raise RuntimeError("Stand-in sheet refused a result")
+    return perf_counter() - start, percentiles(latencies)
+
+def pooled(url: str, results: list, in_flight: int, callers: int) -> tuple:
+    uploader = SheetUploader(url, max_in_flight=in_flight)
+    start = perf_counter()
+    with ThreadPoolExecutor(callers) as pool:
+        ok = all(pool.map(uploader.post_json, results))
+    elapsed = perf_counter() - start
+    latency = uploader.latency_percentiles()
+    uploader.close()
+    if not ok:
+        raise RuntimeError("Stand-in sheet refused a result")
+    return elapsed, latency
+
+def run(results: int, rtt_s: float, in_flight: int, directory: str) -> bool:
+    cert, key = certificate(directory)
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    os.environ["REQUESTS_CA_BUNDLE"] = cert # Trusted by requests.post and Session alike
+
+    print(f"{'':>26} | {'connections':>11} | {'ms per result':>13} | {'request p50 / p90 / p99 ms':>26}")
+    averages = {}
+    ok = True
+    runs = [("requests.post", None, lambda url, items: bare(url, items)),
+            ("SheetUploader, 1 at once", 1, lambda url, items: pooled(url, items, 1, 1)),
+            (f"SheetUploader, {in_flight} at once", in_flight, lambda url, items: pooled(url, items, in_flight, in_flight * 4))]
+    for name, limit, upload in runs:
+        server = StandInSheet(context, rtt_s)
+        Thread(target=server.serve_forever, daemon=True).start()
+        elapsed, latency = upload(f"https://127.0.0.1:{server.server_address[1]}/exec", bodies(results))
+        server.shutdown()
+        server.server_close()
+
+        averages[name] = elapsed / results
+        print(f"{name:>26} | {server.connections:11d} | {averages[name] * 1000:13.1f} | "
+              f"{latency[50]:8.1f} / {latency[90]:6.1f} / {latency[99]:6.1f}")
+        ok &= server.rows == results
+        if limit is not None and server.most_active > limit:
+            print(f"{name}: {server.most_active} requests in flight at once")
+            ok = False
+
+    print(f"Per result: {averages['requests.post'] / averages['SheetUploader, 1 at once']:.1f}x faster pooled, "
+          f"{averages['requests.post'] / averages[f'SheetUploader, {in_flight} at once']:.1f}x with {in_flight} in flight")
+    return ok and averages["SheetUploader, 1 at once"] < averages["requests.post"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pooled keep-alive uploads against a local HTTPS stand-in")
+    parser.add_argument("--results", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=20, help="Emulated network round trip")
+    parser.add_argument("--in-flight", type=int, default=4, help="Requests at once for the concurrent run")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        ok = run(args.results, args.rtt_ms / 1000, args.in_flight, directory)
+    finally:
+        shutil.rmtree(directory)
+    sys.exit(0 if ok else 1)